@@ -1,3 +1,11 @@
 # -*- coding: utf-8 -*-
 __title__ = 'django_cbrf'
 __version__ = '1.0.2'
+
+try:
+    import django
+
+    if django.VERSION < (3, 2):
+        default_app_config = 'django_cbrf.apps.DjangoCbrfConfig'
+except ImportError:  # setup.py is importing the package before dependencies are installed
+    pass
@@ -1,24 +1,60 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
 
+import asyncio
+import bisect
 import datetime
+import functools
 import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from decimal import Decimal
 
-from cbrf import get_currencies_info, get_dynamic_rates, get_daily_rates
+import django
+from asgiref.sync import sync_to_async
 from cbrf.utils import str_to_date
-from django.db import models, transaction, IntegrityError
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction, IntegrityError, connections, router
+from django.db.models import Max, Subquery
 
 try:
     from django.utils.translation import ugettext_lazy as _
 except ImportError:  # django > 3
     from django.utils.translation import gettext_lazy as _
 
-from django_cbrf.utils import get_cbrf_model
-from .settings import CBRF_APP_NAME
+from django_cbrf.utils import get_cbrf_model, get_model
+from .registry import CurrencyInfo, get_currency_registry
+from .cache import rate_cache, shared_rate_cache, invalidate_rates, as_date
+from .api import get_currencies_info, get_daily_rates, aget_daily_rates, aget_dynamic_rates
+from .matrix import rate_matrix
+from .metrics import get_metrics
+from .querysets import RateRow, RecordManager
+from .refresh import get_refresher
+from .streaming import stream_dynamic_rates, iter_batches, parse_date, parse_value
+from .settings import (
+    CBRF_APP_NAME, DEFAULT_APP_NAME, BATCH_SIZE, POPULATE_ALL_DAILY, MISSING_CURRENCY_POLICY, GAP_MERGE_DAYS,
+    MATRIX_AUTO_UPDATE, BACKFILL_CHUNK_DAYS, DAYS_FOR_POPULATE, NEGATIVE_CACHE,
+    PUBLICATION_CALENDAR, MAX_STALENESS,
+)
 
 logger = logging.getLogger(__name__)
 
+PopulateResult = namedtuple('PopulateResult', ['inserted', 'updated', 'unchanged'])
+BackfillProgress = namedtuple('BackfillProgress', ['done', 'total', 'rates', 'seconds'])
+
+ASYNC_ORM = django.VERSION >= (4, 1)  # afirst(), aget() and `async for` over querysets
+
+
+def requires_async_orm(method):
+    """ Make async method raise ImproperlyConfigured on Django older than 4.1 """
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not ASYNC_ORM:
+            raise ImproperlyConfigured("Async API requires Django 4.1 or newer")
+        return await method(*args, **kwargs)
+    return wrapper
+
 
 class AbstractCurrency(models.Model):
     """ Abstract Currency model """
@@ -70,20 +106,9 @@ class AbstractCurrency(models.Model):
         """
         raw_currencies = get_currencies_info()
         for currency in raw_currencies:
-            _iso_num_code = currency.findtext('ISO_Num_Code')
-            _iso_char_code = currency.findtext('ISO_Char_Code')
-
             try:
                 with transaction.atomic():
-                    cls.objects.create(
-                        cbrf_id=currency.attrib['ID'],
-                        parent_code=currency.findtext('ParentCode').replace(' ', ''),
-                        name=currency.findtext('Name'),
-                        eng_name=currency.findtext('EngName'),
-                        denomination=int(currency.findtext('Nominal')),
-                        iso_num_code=int(_iso_num_code) if _iso_num_code else None,
-                        iso_char_code=_iso_char_code if _iso_char_code else None,
-                    )
+                    cls.objects.create(**cls._parse_currency(currency))
             except IntegrityError as err:
                 if force:
                     logger.warning('{} with id: {} is already populated. Skipping.'.format(
@@ -94,33 +119,142 @@ class AbstractCurrency(models.Model):
                     raise err
 
     @classmethod
-    def populate(cls, force: bool = False):
+    def _bulk_populate(cls) -> PopulateResult:
+        """ Load list of Currencies from cbr.ru and upsert them in a single statement.
+
+        Existing currencies are matched by `cbrf_id`; changed names, denominations and codes
+        are updated in place, unchanged rows are not touched at all.
+
+        :return: :class PopulateResult: with inserted, updated and unchanged counters
+        """
+        parsed = [cls._parse_currency(currency) for currency in get_currencies_info()]
+        fields = [name for name in parsed[0] if name != 'cbrf_id'] if parsed else []
+
+        existing = cls.objects.filter(cbrf_id__in=[item['cbrf_id'] for item in parsed])
+        existing = {row['cbrf_id']: row for row in existing.values('pk', 'cbrf_id', *fields)}
+
+        to_create, to_update, unchanged = [], [], 0
+        for item in parsed:
+            current = existing.get(item['cbrf_id'])
+            if current is None:
+                to_create.append(item)
+            elif any(current[name] != item[name] for name in fields):
+                to_update.append((current['pk'], item))
+            else:
+                unchanged += 1
+
+        if to_create or to_update:
+            db = router.db_for_write(cls)
+            with transaction.atomic(using=db):
+                if django.VERSION >= (4, 1) and connections[db].features.supports_update_conflicts_with_target:
+                    cls.objects.using(db).bulk_create(
+                        [cls(**item) for item in to_create + [item for _pk, item in to_update]],
+                        update_conflicts=True,
+                        unique_fields=['cbrf_id'],
+                        update_fields=fields,
+                    )
+                else:
+                    cls.objects.using(db).bulk_create([cls(**item) for item in to_create])
+                    cls.objects.using(db).bulk_update([cls(pk=pk, **item) for pk, item in to_update], fields)
+
+            transaction.on_commit(get_currency_registry(cls).invalidate, using=db)
+
+        result = PopulateResult(inserted=len(to_create), updated=len(to_update), unchanged=unchanged)
+        logger.info('Currencies populated: {} inserted, {} updated, {} unchanged.'.format(*result))
+        return result
+
+    @staticmethod
+    def _parse_currency(currency) -> dict:
+        """ Convert one <Item> element of the currencies directory to model field values """
+        _iso_num_code = currency.findtext('ISO_Num_Code')
+        _iso_char_code = currency.findtext('ISO_Char_Code')
+
+        return dict(
+            cbrf_id=currency.attrib['ID'],
+            parent_code=currency.findtext('ParentCode').replace(' ', ''),
+            name=currency.findtext('Name'),
+            eng_name=currency.findtext('EngName'),
+            denomination=int(currency.findtext('Nominal')),
+            iso_num_code=int(_iso_num_code) if _iso_num_code else None,
+            iso_char_code=_iso_char_code if _iso_char_code else None,
+        )
+
+    @classmethod
+    def populate(cls, force: bool = False, bulk: bool = False):
+        """ Load list of Currencies from cbr.ru
+
+        :param force: skip already existing currencies instead of raising IntegrityError
+        :param bulk: upsert all currencies at once, see :meth _bulk_populate:
+        """
+        if bulk:
+            return cls._bulk_populate()
         cls._populate(force=force)
 
+    @classmethod
+    def _from_registry(cls, currency: CurrencyInfo or None) -> 'AbstractCurrency' or None:
+        """ Build model instance from the registry entry without DB query
+
+        Every call returns a new instance, so changing it doesn't affect the registry. Only fields of
+        :class CurrencyInfo: are set; other fields of custom models are deferred and loaded with
+        a query on first access.
+        """
+        if currency is None:
+            return None
+        field_names = [cls._meta.pk.attname] + list(CurrencyInfo._fields[1:])
+        return cls.from_db(router.db_for_read(cls), field_names, list(currency))
+
     @classmethod
     def get_by_cbrf_id(cls, cbrf_id: str):
-        try:
-            return cls.objects.get(cbrf_id=cbrf_id)
-        except cls.DoesNotExist:
+        registry = get_currency_registry(cls)
+        if registry.enabled:
+            currency = cls._from_registry(registry.get_by_cbrf_id(cbrf_id))
+        else:
+            currency = cls.objects.filter(cbrf_id=cbrf_id).first()
+
+        if currency is None:
             logger.error("Currency with {} code is not exist!".format(cbrf_id))
             logger.warning("You could use 'python manage.py load_currencies' to populate local db.")
-            return None
+        return currency
 
     @classmethod
     def get_by_iso_num_code(cls, iso_num_code: str or int):
-        try:
-            return cls.objects.get(iso_num_code=int(iso_num_code))
-        except cls.DoesNotExist:
+        registry = get_currency_registry(cls)
+        if registry.enabled:
+            currency = cls._from_registry(registry.get_by_iso_num_code(iso_num_code))
+        else:
+            currency = cls.objects.filter(iso_num_code=int(iso_num_code)).first()
+
+        if currency is None:
             logger.error("Currency with {} iso code is not exist!".format(iso_num_code))
-            return None
+        return currency
 
     @classmethod
     def get_by_iso_char_code(cls, iso_char_code: str):
-        try:
-            return cls.objects.get(iso_char_code=iso_char_code)
-        except cls.DoesNotExist:
+        registry = get_currency_registry(cls)
+        if registry.enabled:
+            currency = cls._from_registry(registry.get_by_iso_char_code(iso_char_code))
+        else:
+            currency = cls.objects.filter(iso_char_code__iexact=iso_char_code).first()
+
+        if currency is None:
             logger.error("Currency with {} iso code is not exist!".format(iso_char_code))
-            return None
+        return currency
+
+    @classmethod
+    @requires_async_orm
+    async def aget_by_iso_char_code(cls, iso_char_code: str):
+        """ Async version of :meth get_by_iso_char_code: (Django >= 4.1) """
+        registry = get_currency_registry(cls)
+        if registry.enabled:
+            if not registry.loaded:
+                await sync_to_async(registry.load)()
+            currency = cls._from_registry(registry.get_by_iso_char_code(iso_char_code))
+        else:
+            currency = await cls.objects.filter(iso_char_code__iexact=iso_char_code).afirst()
+
+        if currency is None:
+            logger.error("Currency with {} iso code is not exist!".format(iso_char_code))
+        return currency
 
 
 class AbstractRecord(models.Model):
@@ -130,6 +264,11 @@ class AbstractRecord(models.Model):
     date = models.DateField()
     value = models.DecimalField(verbose_name=_('value'), max_digits=9, decimal_places=4)
 
+    objects = RecordManager()
+
+    # set for the latest stored rates returned instead of not loaded yet ones, see :meth get_for_date:
+    stale = False
+
     class Meta:
         abstract = True
         verbose_name = _('record')
@@ -140,105 +279,986 @@ class AbstractRecord(models.Model):
         return '[{}] {}: {}'.format(self.currency.iso_char_code, self.date, self.value)
 
     @classmethod
-    def _populate_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None):
+    def _populate_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None,
+                           all_currencies: bool = None):
+        """ Load currency rate for the date.
 
+        :param currency: see :class Currency:
+        :param date: date of rate, today by default
+        :param all_currencies: store rates of every currency from the same daily document,
+                               `CBRF_POPULATE_ALL_DAILY` by default
+        """
         raw_rates = get_daily_rates(date)
+        cls._add_publication(raw_rates, date)
+        cls._add_missing(raw_rates, date, currency)
+        return cls._store_for_date(currency, raw_rates, all_currencies=all_currencies)
+
+    @classmethod
+    def _store_for_date(cls, currency: AbstractCurrency, raw_rates, all_currencies: bool = None):
+        """ Store currency rate from already downloaded daily document, see :meth _populate_for_date: """
+        if all_currencies is None:
+            all_currencies = POPULATE_ALL_DAILY
+
         record = [rate for rate in raw_rates if rate.attrib['ID'] == currency.cbrf_id]
 
         if record:
             actual_date = str_to_date(raw_rates.attrib['Date'])
+            if all_currencies:
+                cls._populate_all_for_date(raw_rates=raw_rates)
+                return cls.objects.select_related('currency').get(currency=currency, date=actual_date.date())
+
             rate = record[0]
             with transaction.atomic():
-                (record, _created) = cls.objects.get_or_create(
+                (record, _created) = cls.objects.select_related('currency').get_or_create(
                     currency=currency,
                     date=actual_date.date(),
-                    value=Decimal(rate.findtext('Value').replace(',', '.'))
+                    value=cls._parse_value(rate)
                 )
                 if not _created:
                     logger.warning("Rate {} for {} already in db. Skipped.".format(
                         currency.eng_name, actual_date))
+                else:
+                    cls._rates_changed([currency.cbrf_id], actual_date.date())
+                get_metrics().increment('cbrf_rows_total', result='inserted' if _created else 'skipped')
                 return record
 
         raise ValueError("Error in parameters")
 
+    @classmethod
+    def _populate_all_for_date(cls, date: datetime.datetime = None, raw_rates=None,
+                               update: bool = False) -> PopulateResult:
+        """ Load rates of all currencies for the date and store them at once.
+
+        XML Elements -> models.Model
+
+        <ValCurs Date="23.02.2017" name="Foreign Currency Market">
+            <Valute ID="R01235">
+                <NumCode>840</NumCode>
+                <CharCode>USD</CharCode>
+                <Nominal>1</Nominal>
+                <Name>Доллар США</Name>
+                <Value>57,4762</Value>
+            </Valute>
+        <...>
+
+        Currencies which are not in DB are handled according `CBRF_MISSING_CURRENCY_POLICY`:
+        'skip' them, 'populate' the currencies directory and retry, or raise an 'error'.
+
+        :param date: date of rates, today by default
+        :param raw_rates: already downloaded daily document, if any
+        :param update: update already stored rates if their value was changed
+        :return: :class PopulateResult: with inserted, updated and unchanged counters
+        """
+        if raw_rates is None:
+            raw_rates = get_daily_rates(date)
+            cls._add_publication(raw_rates, date)
+        if not len(raw_rates):
+            return PopulateResult(inserted=0, updated=0, unchanged=0)
+
+        actual_date = str_to_date(raw_rates.attrib['Date']).date()
+        currencies = cls._get_currencies_for_rates([rate.attrib['ID'] for rate in raw_rates])
+
+        return cls._bulk_write(
+            ((currencies[rate.attrib['ID']], actual_date, cls._parse_value(rate))
+             for rate in raw_rates if rate.attrib['ID'] in currencies),
+            update=update,
+        )
+
+    @staticmethod
+    def _get_currencies_for_rates(cbrf_ids) -> dict:
+        """ Get {cbrf_id: currency} for rates to store, handling unknown currencies according the policy """
+        Currency = get_cbrf_model('Currency')
+
+        currencies = {currency.cbrf_id: currency for currency in Currency.objects.filter(cbrf_id__in=cbrf_ids)}
+        missing = [cbrf_id for cbrf_id in cbrf_ids if cbrf_id not in currencies]
+
+        if missing and MISSING_CURRENCY_POLICY == 'error':
+            raise ValueError("Currencies with {} codes are not exist!".format(', '.join(missing)))
+
+        if missing and MISSING_CURRENCY_POLICY == 'populate':
+            Currency.populate(bulk=True)
+            currencies.update({currency.cbrf_id: currency for currency in Currency.objects.filter(cbrf_id__in=missing)})
+            missing = [cbrf_id for cbrf_id in missing if cbrf_id not in currencies]
+
+        if missing:
+            logger.warning("Currencies with {} codes are not exist. Skipped.".format(', '.join(missing)))
+
+        return currencies
+
     @classmethod
     def _populate_for_dates(cls, date_begin: datetime.datetime, date_end: datetime.datetime,
-                            currency: AbstractCurrency):
+                            currency: AbstractCurrency, update: bool = False):
         """ Load list of currency rates from date_begin to date_end.
         
         :param date_begin: first day of rates
         :param date_end: last day of rates
         :param currency: see :class Currency:
+        :param update: update already stored rates if their value was changed
         """
-        raw_rates = get_dynamic_rates(date_req1=date_begin, date_req2=date_end, currency_id=currency.cbrf_id)
+        cls._bulk_populate_for_dates(date_begin, date_end, currency, update=update)
 
-        for rate in raw_rates:
-            with transaction.atomic():
-                try:
-                    cls.objects.create(
-                        currency=currency,
-                        date=str_to_date(rate.attrib['Date']).date(),
-                        value=Decimal(rate.findtext('Value').replace(',', '.'))
-                    )
-                except IntegrityError:
-                    logger.warning("Rate {} for {} already in db. Skipped.".format(
-                        currency.eng_name, str_to_date(rate.attrib['Date'])))
+        return cls.objects.select_related('currency').filter(
+            currency=currency, date__gte=date_begin, date__lte=date_end)
+
+    @classmethod
+    def _bulk_populate_for_dates(cls, date_begin: datetime.datetime, date_end: datetime.datetime,
+                                 currency: AbstractCurrency, update: bool = False) -> PopulateResult:
+        """ Load list of currency rates from date_begin to date_end and store only missing ones.
+
+        The response is parsed while it is downloaded and stored in batches of `CBRF_BATCH_SIZE` rates.
+
+        :return: :class PopulateResult: with inserted, updated and unchanged counters
+        """
+        result = cls._write_stream(cls._iter_for_dates(date_begin, date_end, currency), update=update)
+        cls._add_coverage(currency, date_begin, date_end)
+        return result
+
+    @staticmethod
+    def _iter_for_dates(date_begin: datetime.datetime, date_end: datetime.datetime, currency: AbstractCurrency):
+        """ Stream currency rates from date_begin to date_end without touching DB
+
+        :return: iterator of (currency, date, value) tuples for :meth _bulk_write:
+        """
+        for date, value in stream_dynamic_rates(date_req1=date_begin, date_req2=date_end,
+                                                currency_id=currency.cbrf_id):
+            yield currency, date, value
+
+    @classmethod
+    def _fetch_for_dates(cls, date_begin: datetime.datetime, date_end: datetime.datetime,
+                         currency: AbstractCurrency) -> list:
+        """ Load and parse currency rates from date_begin to date_end without touching DB
+
+        :return: list of (currency, date, value) tuples for :meth _bulk_write:
+        """
+        return list(cls._iter_for_dates(date_begin, date_end, currency))
+
+    @classmethod
+    def _add_coverage(cls, currency: AbstractCurrency, date_begin: datetime.datetime, date_end: datetime.datetime):
+        """ Remember that the range was fetched. Today and future dates are never marked: rates for them
+        may be published later """
+        date_end = min(as_date(date_end), datetime.date.today() - datetime.timedelta(days=1))
+        get_model(DEFAULT_APP_NAME, 'RateCoverage').add(cls._meta.label_lower, currency.cbrf_id,
+                                                        as_date(date_begin), date_end)
+
+    @staticmethod
+    def _add_publication(raw_rates, date: datetime.datetime = None):
+        """ Remember the date of the daily document requested for the date, see :class PublicationDate: """
+        if PUBLICATION_CALENDAR and 'Date' in raw_rates.attrib:
+            get_model(DEFAULT_APP_NAME, 'PublicationDate').add(parse_date(raw_rates.attrib['Date']), as_date(date))
+
+    @staticmethod
+    def _get_effective_dates(dates) -> dict:
+        """ Get {date: date of the rate set effective on it} for dates known to the publication calendar """
+        if not PUBLICATION_CALENDAR:
+            return {}
+        return get_model(DEFAULT_APP_NAME, 'PublicationDate').get_effective_dates(as_date(date) for date in dates)
+
+    @classmethod
+    def _get_stale(cls, currency: AbstractCurrency, date: datetime.datetime, max_staleness: int):
+        """ Get the latest stored rate before today or future date marked as `stale` and schedule its refresh
+
+        The rate is not stale (and no refresh is scheduled) if CBR API recently returned its rate set for
+        the date, see :meth PublicationDate.is_current:.
+
+        :return: None if stale-while-revalidate is off, the date is in the past or there is no stored rate
+                 within `max_staleness` days
+        """
+        day = as_date(date)
+        if not max_staleness or day < datetime.date.today():
+            return None
+        record = cls.objects.select_related('currency').filter(
+            currency_id=currency.pk, date__lt=day,
+            date__gte=day - datetime.timedelta(days=max_staleness)).order_by('-date').first()
+        if record is None:
+            return None
+        if PUBLICATION_CALENDAR and get_model(DEFAULT_APP_NAME, 'PublicationDate').is_current(record.date, day):
+            return record
+        record.stale = True
+        get_refresher().schedule(cls._meta.label_lower, currency.cbrf_id, day)
+        return record
+
+    @classmethod
+    def _get_lookup_dates(cls, currencies, dates, found: dict, force: bool = False) -> dict:
+        """ Map dates having misses in `found` to dates of the rate sets effective on them
+
+        Stored rates of these sets are read into `found` with one query, unless `force` is set.
+
+        :return: {date: date of the rate to look up}
+        """
+        effective_dates = cls._get_effective_dates(
+            {date for currency in currencies for date in dates if (currency.pk, date) not in found})
+        lookups = {date: effective_dates.get(date, date) for date in dates}
+        shifted = set(lookups.values()) - set(dates)
+        if shifted and not force:
+            found.update(cls._get_stored(currencies, shifted))
+        return lookups
+
+    @classmethod
+    def _add_missing(cls, raw_rates, date: datetime.datetime = None, currency: AbstractCurrency = None):
+        """ Remember that the daily document requested for the date doesn't contain the currency,
+        see :class MissingRate: """
+        if NEGATIVE_CACHE and not any(rate.attrib['ID'] == currency.cbrf_id for rate in raw_rates):
+            get_model(DEFAULT_APP_NAME, 'MissingRate').add(cls._meta.label_lower, [currency.cbrf_id], as_date(date))
+
+    @classmethod
+    def _is_missing(cls, currency: AbstractCurrency, date: datetime.datetime) -> bool:
+        """ Is it remembered that CBR API has no rate of the currency for the date? """
+        return NEGATIVE_CACHE and get_model(DEFAULT_APP_NAME, 'MissingRate').is_missing(
+            cls._meta.label_lower, currency.cbrf_id, as_date(date))
+
+    @classmethod
+    def _get_for_missing_date(cls, currency: AbstractCurrency, date: datetime.datetime):
+        """ Answer a lookup of not stored rate without requesting CBR API
+
+        If nothing was published on the date (see :class PublicationDate:), the rate set effective on it
+        is looked up instead, and its date should be requested from CBR API if the rate is not stored,
+        so the same document is not downloaded under every date it covers.
+
+        :return: (stored rate or None, date to request CBR API for)
+        :raise ValueError: if CBR API has no rate of the currency for the date, see :class MissingRate:
+        """
+        if cls._is_missing(currency, date):
+            raise ValueError("Error in parameters")
+        effective_date = cls._get_effective_dates([date]).get(as_date(date))
+        if effective_date is None or effective_date == as_date(date):
+            return None, date
+        if cls._is_missing(currency, effective_date):
+            raise ValueError("Error in parameters")
+        return cls.objects.select_related('currency').filter(
+            currency_id=currency.pk, date=effective_date).first(), effective_date
+
+    @classmethod
+    def _get_gaps(cls, currency: AbstractCurrency, date_begin: datetime.datetime,
+                  date_end: datetime.datetime) -> list:
+        """ Get sub-ranges of the range which were never fetched from CBR API, see :class RateCoverage: """
+        return get_model(DEFAULT_APP_NAME, 'RateCoverage').get_gaps(
+            cls._meta.label_lower, currency.cbrf_id, as_date(date_begin), as_date(date_end),
+            merge_days=GAP_MERGE_DAYS)
+
+    @classmethod
+    def _bulk_write(cls, rows, update: bool = False, batch_size: int = BATCH_SIZE,
+                    by_currency: dict = None) -> PopulateResult:
+        """ Store rates in a few statements.
+
+        Rates already stored for the same currency and date are loaded with one query and skipped
+        (or updated, if `update` is set and the value was changed); missing ones are inserted
+        with chunked `bulk_create`.
+
+        `inserted` (and the `cbrf_rows_total{result="inserted"}` metric) counts rows sent to INSERT,
+        not rows stored: a row inserted by a concurrent writer after the lookup is skipped by
+        the database (`ignore_conflicts`), but still counted.
+
+        :param rows: iterable of (currency, date, value) tuples, currency is a model instance
+                     or :class CurrencyInfo:
+        :param update: update already stored rates if their value was changed
+        :param batch_size: max number of rows per INSERT / UPDATE statement
+        :param by_currency: dict to fill with {currency: :class PopulateResult:} of every currency's rows
+        :return: :class PopulateResult: with inserted, updated and unchanged counters
+        """
+        rows = {(currency.pk, date): (currency, value) for currency, date, value in rows}
+        if not rows:
+            return PopulateResult(inserted=0, updated=0, unchanged=0)
+
+        dates = [date for _currency_id, date in rows]
+        existing = cls.objects.filter(
+            currency_id__in={currency_id for currency_id, _date in rows},
+            date__gte=min(dates),
+            date__lte=max(dates),
+        ).values_list('currency_id', 'date', 'pk', 'value')
+        existing = {(currency_id, date): (pk, value) for currency_id, date, pk, value in existing}
+
+        to_create, to_update, unchanged, changed, changed_dates = [], [], 0, set(), set()
+        counts = {}
+        for (currency_id, date), (currency, value) in rows.items():
+            stored = existing.get((currency_id, date))
+            counters = counts.setdefault(currency, [0, 0, 0])
+            if stored is None:
+                to_create.append(cls(currency_id=currency_id, date=date, value=value))
+                counters[0] += 1
+            elif update and stored[1] != value:
+                to_update.append(cls(pk=stored[0], currency_id=currency_id, date=date, value=value))
+                counters[1] += 1
+            else:
+                unchanged += 1
+                counters[2] += 1
+                continue
+            changed.add(currency.cbrf_id)
+            changed_dates.add(date)
+
+        metrics = get_metrics()
+        with metrics.timer('cbrf_write_seconds'), transaction.atomic(using=router.db_for_write(cls)):
+            cls.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+            if to_update:
+                cls.objects.bulk_update(to_update, ['value'], batch_size=batch_size)
+
+        if changed:
+            cls._rates_changed(changed, min(changed_dates))
+
+        metrics.increment('cbrf_rows_total', len(to_create), result='inserted')
+        metrics.increment('cbrf_rows_total', len(to_update), result='updated')
+        metrics.increment('cbrf_rows_total', unchanged, result='skipped')
+
+        if by_currency is not None:
+            by_currency.update((currency, PopulateResult(*counters)) for currency, counters in counts.items())
+        return PopulateResult(inserted=len(to_create), updated=len(to_update), unchanged=unchanged)
+
+    @classmethod
+    @rate_matrix.batch()
+    def _write_stream(cls, rows, update: bool = False, batch_size: int = BATCH_SIZE) -> PopulateResult:
+        """ Store rates from iterator with :meth _bulk_write: in batches of `batch_size` rates
+
+        :return: :class PopulateResult: with counters summed over batches
+        """
+        result = PopulateResult(inserted=0, updated=0, unchanged=0)
+        for batch in iter_batches(rows, batch_size):
+            result = PopulateResult(*map(sum, zip(result, cls._bulk_write(batch, update=update,
+                                                                            batch_size=batch_size))))
+        return result
+
+    @classmethod
+    def _rates_changed(cls, cbrf_ids, date_from: datetime.date):
+        """ Drop cached lookups and schedule update of the rate matrix after rates from `date_from` on were written
 
-        return cls.objects.filter(currency=currency, date__gte=date_begin, date__lte=date_end)
+        Both happen once the current transaction is committed, so concurrent lookups can't cache
+        the old state again after invalidation.
+        """
+        using = router.db_for_write(cls)
+        transaction.on_commit(functools.partial(invalidate_rates, set(cbrf_ids)), using=using)
+
+        if MATRIX_AUTO_UPDATE and rate_matrix.enabled and cls is get_cbrf_model('Record'):
+            rate_matrix.schedule_update(date_from, using=using)
+
+    @staticmethod
+    def _parse_value(rate) -> Decimal:
+        """ Convert <Value> of a <Valute> or <Record> element to Decimal """
+        return parse_value(rate.findtext('Value'))
+
+    @classmethod
+    def populate_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None,
+                          all_currencies: bool = None):
+        return cls._populate_for_date(currency, date, all_currencies=all_currencies)
 
     @classmethod
-    def populate_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None):
-        return cls._populate_for_date(currency, date)
+    def populate_all_for_date(cls, date: datetime.datetime = None) -> PopulateResult:
+        return cls._populate_all_for_date(date)
 
     @classmethod
     def populate_for_dates(cls, date_begin: datetime.datetime, date_end: datetime.datetime,
-                           currency: AbstractCurrency):
-        cls._populate_for_dates(date_begin, date_end, currency)
+                           currency: AbstractCurrency, update: bool = False) -> PopulateResult:
+        return cls._bulk_populate_for_dates(date_begin, date_end, currency, update=update)
+
+    @classmethod
+    @rate_matrix.batch()
+    def populate_for_dates_many(cls, date_begin: datetime.datetime, date_end: datetime.datetime, currencies,
+                                workers: int = 1, update: bool = False) -> dict:
+        """ Load rates from date_begin to date_end for several currencies.
+
+        CBR API responses are downloaded and parsed concurrently by `workers` threads, while all DB
+        writes are done by the calling thread in batches. With one worker responses are streamed
+        to DB without buffering. A failure of one currency doesn't abort others.
+
+        :return: {currency: :class PopulateResult: or exception}
+        """
+        results = {}
+
+        def write(currency, rows):
+            results[currency] = cls._write_stream(rows, update=update)
+            cls._add_coverage(currency, date_begin, date_end)
+
+        if workers <= 1:
+            for currency in currencies:
+                try:
+                    write(currency, cls._iter_for_dates(date_begin, date_end, currency))
+                except Exception as err:
+                    logger.error("Can't load rates for {}: {}".format(currency.cbrf_id, err))
+                    get_metrics().increment('cbrf_errors_total', operation='populate_for_dates_many')
+                    results[currency] = err
+            return results
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(cls._fetch_for_dates, date_begin, date_end, currency): currency
+                for currency in currencies
+            }
+            for future in as_completed(futures):
+                currency = futures[future]
+                try:
+                    write(currency, future.result())
+                except Exception as err:
+                    logger.error("Can't load rates for {}: {}".format(currency.cbrf_id, err))
+                    get_metrics().increment('cbrf_errors_total', operation='populate_for_dates_many')
+                    results[currency] = err
+
+        return results
+
+    @classmethod
+    @rate_matrix.batch()
+    def backfill(cls, date_begin: datetime.datetime, date_end: datetime.datetime, currencies,
+                 chunk_days: int = BACKFILL_CHUNK_DAYS, workers: int = 1, update: bool = False,
+                 progress=None) -> dict:
+        """ Load long history of rates in chunks, resuming an interrupted run.
+
+        Not fetched sub-ranges (see :class RateCoverage:) of every currency are split into chunks of
+        `chunk_days` days. A chunk is marked as fetched right after its rates are stored, so chunks
+        finished by an interrupted run are skipped by the next one. Chunks are downloaded by `workers`
+        threads with at most two chunks per thread waiting for the writer; DB writes are done by
+        the calling thread. A failure of one chunk doesn't abort others.
+
+        :param progress: callable receiving :class BackfillProgress: after every chunk
+        :return: {currency: :class PopulateResult: or the first exception of its chunks}
+        """
+        chunks = [
+            (currency, chunk_begin, chunk_end)
+            for currency in currencies
+            for gap_begin, gap_end in cls._get_gaps(currency, date_begin, date_end)
+            for chunk_begin, chunk_end in cls._split_range(gap_begin, gap_end, chunk_days)
+        ]
+        results = {currency: PopulateResult(inserted=0, updated=0, unchanged=0) for currency in currencies}
+        counters = {'done': 0, 'rates': 0}
+        started = time.monotonic()
+
+        def write(chunk, fetch):
+            currency, chunk_begin, chunk_end = chunk
+            try:
+                result = cls._write_stream(fetch(), update=update)
+                cls._add_coverage(currency, chunk_begin, chunk_end)
+            except Exception as err:
+                logger.error("Can't load rates for {} from {} to {}: {}".format(
+                    currency.cbrf_id, chunk_begin, chunk_end, err))
+                get_metrics().increment('cbrf_errors_total', operation='backfill')
+                if not isinstance(results[currency], Exception):
+                    results[currency] = err
+            else:
+                if not isinstance(results[currency], Exception):
+                    results[currency] = PopulateResult(*map(sum, zip(results[currency], result)))
+                counters['rates'] += sum(result)
+
+            counters['done'] += 1
+            if progress is not None:
+                progress(BackfillProgress(done=counters['done'], total=len(chunks), rates=counters['rates'],
+                                          seconds=time.monotonic() - started))
+
+        if workers <= 1:
+            for chunk in chunks:
+                write(chunk, lambda: cls._iter_for_dates(chunk[1], chunk[2], chunk[0]))
+            return results
+
+        queue, pending = iter(chunks), {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for chunk in queue:
+                    pending[executor.submit(cls._fetch_for_dates, chunk[1], chunk[2], chunk[0])] = chunk
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+
+                finished, _running = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(pending.pop(future), future.result)
+
+        return results
 
     @classmethod
-    def get_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None, force: bool = False):
+    @rate_matrix.batch()
+    def sync(cls, currencies=None, date_end: datetime.datetime = None, days: int = DAYS_FOR_POPULATE) -> dict:
+        """ Load rates which are newer than the last stored ones.
+
+        The last stored date of every currency is read with one aggregate query; rates are loaded from
+        the next day to `date_end`. Missing days are loaded with one daily document per day (all
+        currencies at once, stored with one bulk insert) or one dynamic range per currency, whichever
+        needs less CBR API requests: a daily run costs a single request. A failure of one currency
+        doesn't abort others.
+
+        :param currencies: currencies to sync, every currency having any rates by default
+        :param date_end: last date to sync, today by default
+        :param days: number of days to load for currencies without rates
+        :return: {currency: :class PopulateResult: or exception}
+        """
+        date_end = as_date(date_end)
+        last_dates = cls.objects.all()
+        if currencies is not None:
+            currencies = list({currency.pk: currency for currency in currencies}.values())
+            last_dates = last_dates.filter(currency_id__in=[currency.pk for currency in currencies])
+        last_dates = dict(last_dates.values_list('currency_id').annotate(last=Max('date')).values_list(
+            'currency_id', 'last'))
+
+        if currencies is None:
+            currencies = list(get_cbrf_model('Currency').objects.filter(pk__in=list(last_dates)))
+
+        results, ranges = {}, {}
+        for currency in currencies:
+            last = last_dates.get(currency.pk)
+            date_begin = last + datetime.timedelta(days=1) if last else date_end - datetime.timedelta(days=days)
+            if date_begin > date_end:
+                results[currency] = PopulateResult(inserted=0, updated=0, unchanged=0)
+            else:
+                ranges[currency] = date_begin
+        if not ranges:
+            return results
+
+        first_date = min(ranges.values())
+        if (date_end - first_date).days + 1 < len(ranges):
+            results.update(cls._sync_daily(ranges, first_date, date_end))
+            return results
+
+        for currency, date_begin in ranges.items():
+            try:
+                results[currency] = cls._bulk_populate_for_dates(date_begin, date_end, currency)
+            except Exception as err:
+                logger.error("Can't sync rates for {}: {}".format(currency.cbrf_id, err))
+                get_metrics().increment('cbrf_errors_total', operation='sync')
+                results[currency] = err
+        return results
+
+    @classmethod
+    def _sync_daily(cls, ranges: dict, date_begin: datetime.date, date_end: datetime.date) -> dict:
+        """ Load rates for {currency: first missing date} from daily documents and store them at once
+
+        A failed day is reported for every currency needing it; rates of such currency loaded
+        from earlier days are still stored, later ones are not, so the next sync resumes from
+        the failed day.
+        """
+        currencies = {currency.cbrf_id: currency for currency in ranges}
+        rows, errors, day = {}, {}, date_begin
+        while day <= date_end and len(errors) < len(ranges):
+            try:
+                raw_rates = get_daily_rates(day)
+                cls._add_publication(raw_rates, day)
+                parsed = []
+                if len(raw_rates):
+                    actual_date = parse_date(raw_rates.attrib['Date'])
+                    for rate in raw_rates:
+                        currency = currencies.get(rate.attrib['ID'])
+                        if currency is not None and ranges[currency] <= actual_date <= date_end:
+                            parsed.append((currency, actual_date, cls._parse_value(rate)))
+            except Exception as err:
+                logger.error("Can't sync rates for {}: {}".format(day, err))
+                get_metrics().increment('cbrf_errors_total', operation='sync')
+                for currency, first_date in ranges.items():
+                    if first_date <= day and currency not in errors:
+                        errors[currency] = (day, err)
+            else:
+                for currency, actual_date, value in parsed:
+                    if currency not in errors:
+                        rows[(currency.cbrf_id, actual_date)] = (currency, actual_date, value)
+            day += datetime.timedelta(days=1)
+
+        counts = {}
+        try:
+            cls._bulk_write(rows.values(), by_currency=counts)
+        except Exception as err:
+            logger.error("Can't sync rates: {}".format(err))
+            get_metrics().increment('cbrf_errors_total', operation='sync')
+            return {currency: err for currency in ranges}
+
+        results = {}
+        for currency, first_date in ranges.items():
+            failed_day, error = errors.get(currency, (None, None))
+            if error is None:
+                cls._add_coverage(currency, first_date, date_end)
+                results[currency] = counts.get(currency, PopulateResult(inserted=0, updated=0, unchanged=0))
+                continue
+            if failed_day > first_date:
+                cls._add_coverage(currency, first_date, failed_day - datetime.timedelta(days=1))
+            results[currency] = error
+        return results
+
+    @staticmethod
+    def _split_range(date_begin: datetime.date, date_end: datetime.date, days: int) -> list:
+        """ Split range into [(date_begin, date_end), ...] sub-ranges of at most `days` days """
+        chunks, step = [], datetime.timedelta(days=days)
+        while date_begin <= date_end:
+            chunks.append((date_begin, min(date_begin + step - datetime.timedelta(days=1), date_end)))
+            date_begin += step
+        return chunks
+
+    @classmethod
+    def get_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None, force: bool = False,
+                     max_staleness: int = None):
+        """ Get rate of the currency for the date: from caches, local DB or CBR API
+
+        :param max_staleness: for today and future dates, return the latest stored rate at most this number
+                              of days older, marked as `stale`, instead of waiting for CBR API and refresh it
+                              in background, see :mod django_cbrf.refresh:; `CBRF_MAX_STALENESS` by default
+        """
+        kind, day, metrics = cls._cache_kind('for_date'), as_date(date), get_metrics()
+        if not force:
+            rate = rate_cache.get(kind, currency.cbrf_id, day)
+            if rate is not None:
+                metrics.increment('cbrf_lookups_total', method='get_for_date', source='cache')
+                return rate
+            rate = shared_rate_cache.get(kind, currency.cbrf_id, day)
+            if rate is not None:
+                metrics.increment('cbrf_lookups_total', method='get_for_date', source='shared_cache')
+                rate = cls._load_record(rate)
+                rate_cache.set(kind, currency.cbrf_id, day, rate)
+                return rate
 
         currency = get_cbrf_model('Currency').objects.get(cbrf_id=currency.cbrf_id)
-        if force:
-            rate = cls._populate_for_date(currency, date)
-        else:
-            rate = cls.objects.filter(currency=currency, date=date).all()
-            rate = rate.first() if rate else cls._populate_for_date(currency, date)
+        rate, request_date = None, date
+        if not force:
+            rate, source = cls.objects.select_related('currency').filter(currency=currency, date=day).first(), 'db'
+            if rate is None:
+                try:
+                    (rate, request_date), source = cls._get_for_missing_date(currency, day), 'negative_cache'
+                except ValueError:
+                    metrics.increment('cbrf_lookups_total', method='get_for_date', source='negative_cache')
+                    raise
+            if rate is None:
+                rate = cls._get_stale(currency, day, MAX_STALENESS if max_staleness is None else max_staleness)
+                if rate is not None and rate.stale:
+                    metrics.increment('cbrf_lookups_total', method='get_for_date', source='stale')
+                    return rate
+                source = 'db'
+        if rate is None:
+            rate, source = cls._populate_for_date(currency, request_date), 'api'
+        metrics.increment('cbrf_lookups_total', method='get_for_date', source=source)
 
+        rate_cache.set(kind, currency.cbrf_id, day, rate)
+        shared_rate_cache.set(kind, currency.cbrf_id, day, cls._dump_record(rate), day)
         return rate
 
     @classmethod
     def get_for_dates(cls, date_begin: datetime.datetime,
                       date_end: datetime.datetime, currency: AbstractCurrency,
                       force: bool = False):
-        """ Try to get rates from local DB. If response is empty -> try to get from CBR API """
+        """ Try to get rates from local DB. Sub-ranges which were never fetched -> try to get from CBR API
+
+        Adjacent gaps separated by at most `CBRF_GAP_MERGE_DAYS` fetched days are loaded with one request.
+        With `force` the whole range is loaded again and changed rates are updated.
+
+        If `CBRF_SHARED_CACHE` is set, rates are read through the shared cache and returned as a list.
+        """
+        kind, date_key = cls._cache_kind('for_dates'), '{}-{}'.format(as_date(date_begin), as_date(date_end))
+        if shared_rate_cache.enabled and not force:
+            rates = shared_rate_cache.get(kind, currency.cbrf_id, date_key)
+            if rates is not None:
+                return [cls._load_record(rate) for rate in rates]
 
         currency = get_cbrf_model('Currency').objects.get(cbrf_id=currency.cbrf_id)
 
         if force:
-            rates = cls._populate_for_dates(date_begin, date_end, currency)
+            rates = cls._populate_for_dates(date_begin, date_end, currency, update=True)
         else:
-            rates = cls.objects.filter(
+            for gap_begin, gap_end in cls._get_gaps(currency, date_begin, date_end):
+                cls._bulk_populate_for_dates(gap_begin, gap_end, currency)
+            rates = cls.objects.select_related('currency').filter(
                 currency=currency,
                 date__gte=date_begin,
                 date__lte=date_end)
-            if not rates:
-                rates = cls._populate_for_dates(date_begin, date_end, currency)
+
+        if shared_rate_cache.enabled:
+            rates = list(rates)
+            shared_rate_cache.set(kind, currency.cbrf_id, date_key,
+                                  [cls._dump_record(rate) for rate in rates], as_date(date_end))
 
         return rates
 
     @classmethod
-    def get_latest(cls, currency: AbstractCurrency, force: bool = False) -> 'AbstractRecord':
-        """ Get the latest rate for given currency """
-        return cls.get_latest_for_date(currency, force, datetime.datetime.today())
+    def iter_rows(cls, date_begin: datetime.datetime, date_end: datetime.datetime, currencies=None,
+                  chunk_size: int = 2000):
+        """ Iterate over stored rates of the range as :class RateRow: (date, iso_char_code, value, denomination)
+
+        Intended for large reads: no model instances are created, rows are read with one query and
+        fetched `chunk_size` at a time. Only rates stored in local DB are returned, load them beforehand
+        with :meth backfill: or :meth sync:. Rows are ordered by currency and date.
+
+        :param currencies: iterable of currencies (model instances or :class CurrencyInfo:), all by default
+        """
+        rates = cls.objects.filter(date__gte=as_date(date_begin), date__lte=as_date(date_end))
+        if currencies is not None:
+            rates = rates.filter(currency_id__in=[currency.pk for currency in currencies])
+        return rates.order_by('currency_id', 'date').rows(chunk_size=chunk_size)
+
+    @classmethod
+    def get_many(cls, currencies, dates, force: bool = False) -> dict:
+        """ Get rates for every pair of given currencies and dates.
+
+        Stored rates are read with one query. Missing ones are loaded from CBR API with as few requests
+        as possible: one daily document per missing date or one dynamic range per currency with misses,
+        whichever is less, and read with one more query. Dates without publications according to
+        :class PublicationDate: are answered with the rate set effective on them, like :meth get_for_date:
+        does. Currencies are used as is, without re-fetching.
+
+        :param currencies: iterable of currencies (model instances or :class CurrencyInfo:)
+        :param dates: iterable of dates
+        :param force: load all pairs from CBR API even if they are already in DB
+        :return: {(currency, date): record}, record is None if CBR has no rate for the date
+        """
+        currencies = list({currency.pk: currency for currency in currencies}.values())
+        dates = sorted({as_date(date) for date in dates})
+
+        found = {} if force else cls._get_stored(currencies, dates)
+        lookups = cls._get_lookup_dates(currencies, dates, found, force)
+        misses = [(currency, date) for currency in currencies for date in sorted(set(lookups.values()))
+                  if (currency.pk, date) not in found]
+        if misses:
+            cls._populate_many(misses, update=force)
+            found.update(cls._get_stored(
+                {currency.pk: currency for currency, _date in misses}.values(), {date for _currency, date in misses}))
+
+        return {(currency, date): found.get((currency.pk, lookups[date])) for currency in currencies for date in dates}
+
+    @classmethod
+    def _get_stored(cls, currencies, dates) -> dict:
+        """ Get stored rates as {(currency_id, date): record} with one query """
+        records = cls.objects.select_related('currency').filter(
+            currency_id__in=[currency.pk for currency in currencies], date__in=list(dates))
+        return {(record.currency_id, record.date): record for record in records}
+
+    @classmethod
+    def _populate_many(cls, pairs, update: bool = False):
+        """ Load rates for (currency, date) pairs with the least number of CBR API requests """
+        by_currency, by_date = {}, {}
+        for currency, date in pairs:
+            by_currency.setdefault(currency.pk, (currency, []))[1].append(date)
+            by_date.setdefault(date, []).append(currency)
+
+        if len(by_date) < len(by_currency):
+            for date in sorted(by_date):
+                cls._populate_all_for_date(date, update=update)
+        else:
+            for currency, dates in by_currency.values():
+                cls._bulk_populate_for_dates(min(dates), max(dates), currency, update=update)
+
+    @classmethod
+    def get_latest(cls, currency: AbstractCurrency, force: bool = False, max_staleness: int = None) -> 'AbstractRecord':
+        """ Get the latest rate for given currency, see :meth get_for_date: about `max_staleness` """
+        return cls.get_latest_for_date(currency, force, datetime.datetime.today(), max_staleness=max_staleness)
 
     @classmethod
     def get_latest_for_date(cls, currency: AbstractCurrency, force: bool = False,
-                            date: datetime.datetime = None) -> 'AbstractRecord':
-        """ Get the latest rate for given currency and date """
+                            date: datetime.datetime = None, max_staleness: int = None) -> 'AbstractRecord':
+        """ Get the latest rate for given currency and date, see :meth get_for_date: about `max_staleness` """
         if not date:
             date = datetime.datetime.today()
-        record = cls.get_for_date(currency, date=date, force=force)
+        metrics = get_metrics()
+        if not force:
+            record = rate_cache.get(cls._cache_kind('latest'), currency.cbrf_id, as_date(date))
+            if record is not None:
+                metrics.increment('cbrf_lookups_total', method='get_latest_for_date', source='cache')
+                return record
+
+        record, source = None, 'get_for_date'
+        published = date if force else cls._get_effective_dates([date]).get(as_date(date), date)
+        if force or not cls._is_fetched(currency, published):
+            try:
+                record = cls.get_for_date(currency, date=published, force=force, max_staleness=max_staleness)
+            except ValueError:
+                if not cls._is_missing(currency, published):
+                    raise
+            if record is not None and record.stale:
+                metrics.increment('cbrf_lookups_total', method='get_latest_for_date', source='stale')
+                return record
         if not record:
-            record = cls.objects.filter(currency=currency, date__lte=date).order_by("-date").first()
+            record, source = cls.objects.select_related('currency').filter(
+                currency=currency, date__lte=date).order_by("-date").first(), 'db'
+        metrics.increment('cbrf_lookups_total', method='get_latest_for_date', source=source)
+
+        rate_cache.set(cls._cache_kind('latest'), currency.cbrf_id, as_date(date), record)
         return record
+
+    @classmethod
+    def get_latest_many(cls, pairs, batch_size: int = 250) -> dict:
+        """ Get the latest rates on or before the dates for many (currency, date) pairs.
+
+        Every pair is resolved by a correlated subquery which seeks the (currency, -date) index
+        (declared by concrete `Record` models, see README), all of them are sent in one statement
+        per `batch_size` pairs. CBR API is never requested.
+
+        :param pairs: iterable of (currency, date), currency is a model instance or :class CurrencyInfo:
+        :return: {(currency, date): record or None}
+        """
+        pairs = {(currency.pk, as_date(date)): currency for currency, date in pairs}
+        keys = list(pairs)
+
+        found = {}
+        for index in range(0, len(keys), batch_size):
+            latest = [
+                Subquery(cls.objects.filter(currency_id=currency_id, date__lte=date).order_by('-date').values('pk')[:1])
+                for currency_id, date in keys[index:index + batch_size]
+            ]
+            for record in cls.objects.select_related('currency').filter(pk__in=latest):
+                found.setdefault(record.currency_id, {})[record.date] = record
+
+        found = {currency_id: (sorted(records), records) for currency_id, records in found.items()}
+        result = {}
+        for (currency_id, date), currency in pairs.items():
+            dates, records = found.get(currency_id, ([], {}))
+            position = bisect.bisect_right(dates, date) - 1
+            result[(currency, date)] = records[dates[position]] if position >= 0 else None
+        return result
+
+    @classmethod
+    def _is_fetched(cls, currency: AbstractCurrency, date: datetime.datetime) -> bool:
+        """ Was the date already requested from CBR API (so a missing rate means no publication)? """
+        return get_model(DEFAULT_APP_NAME, 'RateCoverage').is_fetched(
+            cls._meta.label_lower, currency.cbrf_id, as_date(date))
+
+    @classmethod
+    @requires_async_orm
+    async def aget_for_date(cls, currency: AbstractCurrency, date: datetime.datetime = None,
+                            force: bool = False) -> 'AbstractRecord':
+        """ Async version of :meth get_for_date: (Django >= 4.1)
+
+        Stored rates are read with async ORM, missing ones are downloaded with :meth BaseTransport.aopen:.
+        """
+        kind, day, metrics = cls._cache_kind('for_date'), as_date(date), get_metrics()
+        rate, source, request_date = None, 'db', date
+        if not force:
+            rate = rate_cache.get(kind, currency.cbrf_id, day)
+            if rate is not None:
+                metrics.increment('cbrf_lookups_total', method='aget_for_date', source='cache')
+                return rate
+            rate = await cls.objects.select_related('currency').filter(currency_id=currency.pk, date=day).afirst()
+            if rate is None:
+                (rate, request_date), source = await sync_to_async(cls._get_for_missing_date)(currency, day), \
+                    'negative_cache'
+
+        if rate is None:
+            raw_rates = await aget_daily_rates(request_date)
+            currency = await cls._aget_currency_instance(currency)
+            await sync_to_async(cls._add_publication)(raw_rates, request_date)
+            await sync_to_async(cls._add_missing)(raw_rates, request_date, currency)
+            rate, source = await sync_to_async(cls._store_for_date)(currency, raw_rates), 'api'
+        metrics.increment('cbrf_lookups_total', method='aget_for_date', source=source)
+
+        rate_cache.set(kind, currency.cbrf_id, day, rate)
+        return rate
+
+    @classmethod
+    @requires_async_orm
+    async def aget_for_dates(cls, date_begin: datetime.datetime, date_end: datetime.datetime,
+                             currency: AbstractCurrency, force: bool = False) -> list:
+        """ Async version of :meth get_for_dates: (Django >= 4.1), returns list of records
+
+        Gaps of the range are downloaded concurrently.
+        """
+        if force:
+            gaps = [(as_date(date_begin), as_date(date_end))]
+        else:
+            gaps = await sync_to_async(cls._get_gaps)(currency, date_begin, date_end)
+
+        await asyncio.gather(*[
+            cls._apopulate_for_dates(gap_begin, gap_end, currency, update=force) for gap_begin, gap_end in gaps
+        ])
+
+        return [rate async for rate in cls.objects.select_related('currency').filter(
+            currency_id=currency.pk, date__gte=as_date(date_begin), date__lte=as_date(date_end))]
+
+    @classmethod
+    @requires_async_orm
+    async def aget_latest(cls, currency: AbstractCurrency, force: bool = False) -> 'AbstractRecord':
+        """ Async version of :meth get_latest: (Django >= 4.1) """
+        return await cls.aget_latest_for_date(currency, force, datetime.datetime.today())
+
+    @classmethod
+    @requires_async_orm
+    async def aget_latest_for_date(cls, currency: AbstractCurrency, force: bool = False,
+                                   date: datetime.datetime = None) -> 'AbstractRecord':
+        """ Async version of :meth get_latest_for_date: (Django >= 4.1) """
+        if not date:
+            date = datetime.datetime.today()
+        if not force:
+            record = rate_cache.get(cls._cache_kind('latest'), currency.cbrf_id, as_date(date))
+            if record is not None:
+                return record
+
+        record, published = None, date
+        if not force:
+            published = (await sync_to_async(cls._get_effective_dates)([date])).get(as_date(date), date)
+        if force or not await sync_to_async(cls._is_fetched)(currency, published):
+            try:
+                record = await cls.aget_for_date(currency, date=published, force=force)
+            except ValueError:
+                if not await sync_to_async(cls._is_missing)(currency, published):
+                    raise
+        if not record:
+            record = await cls.objects.select_related('currency').filter(
+                currency_id=currency.pk, date__lte=as_date(date)).order_by("-date").afirst()
+
+        rate_cache.set(cls._cache_kind('latest'), currency.cbrf_id, as_date(date), record)
+        return record
+
+    @classmethod
+    @requires_async_orm
+    async def aget_many(cls, currencies, dates, force: bool = False) -> dict:
+        """ Async version of :meth get_many: (Django >= 4.1)
+
+        Misses of different currencies are downloaded concurrently, one dynamic range per currency.
+        """
+        currencies = list({currency.pk: currency for currency in currencies}.values())
+        dates = sorted({as_date(date) for date in dates})
+
+        found = {} if force else await sync_to_async(cls._get_stored)(currencies, dates)
+        lookups = await sync_to_async(cls._get_lookup_dates)(currencies, dates, found, force)
+        misses = {}
+        for currency in currencies:
+            for date in sorted(set(lookups.values())):
+                if (currency.pk, date) not in found:
+                    misses.setdefault(currency.pk, (currency, []))[1].append(date)
+
+        if misses:
+            await asyncio.gather(*[
+                cls._apopulate_for_dates(min(missed), max(missed), currency, update=force)
+                for currency, missed in misses.values()
+            ])
+            found.update(await sync_to_async(cls._get_stored)(
+                [currency for currency, _missed in misses.values()], set(lookups.values())))
+
+        return {(currency, date): found.get((currency.pk, lookups[date])) for currency in currencies for date in dates}
+
+    @classmethod
+    async def _apopulate_for_dates(cls, date_begin: datetime.date, date_end: datetime.date,
+                                   currency: AbstractCurrency, update: bool = False) -> PopulateResult:
+        """ Async version of :meth _bulk_populate_for_dates: """
+        raw_rates = await aget_dynamic_rates(date_req1=date_begin, date_req2=date_end, currency_id=currency.cbrf_id)
+        rows = [(currency, parse_date(rate.attrib['Date']), cls._parse_value(rate)) for rate in raw_rates]
+
+        def write():
+            result = cls._bulk_write(rows, update=update)
+            cls._add_coverage(currency, date_begin, date_end)
+            return result
+
+        return await sync_to_async(write)()
+
+    @staticmethod
+    async def _aget_currency_instance(currency) -> AbstractCurrency:
+        """ Currency model instance for writes (lookups accept :class CurrencyInfo: as well) """
+        if isinstance(currency, AbstractCurrency):
+            return currency
+        return await get_cbrf_model('Currency').objects.aget(pk=currency.pk)
+
+    @classmethod
+    def _cache_kind(cls, kind: str) -> str:
+        """ Kind of rate cache entries, unique per Record model """
+        return '{}:{}'.format(cls._meta.label_lower, kind)
+
+    @classmethod
+    def _dump_record(cls, record) -> tuple or None:
+        """ Compact representation of the record for shared cache: tuple of concrete field values,
+        dates as ordinals and decimals as strings """
+        if record is None:
+            return None
+        values = []
+        for field in cls._meta.concrete_fields:
+            value = getattr(record, field.attname)
+            if value is not None and field.get_internal_type() == 'DateField':
+                value = value.toordinal()
+            elif value is not None and field.get_internal_type() == 'DecimalField':
+                value = str(value)
+            values.append(value)
+        return tuple(values)
+
+    @classmethod
+    def _load_record(cls, values: tuple) -> 'AbstractRecord':
+        """ Restore record from :meth _dump_record: representation """
+        fields = cls._meta.concrete_fields
+        values = [
+            datetime.date.fromordinal(value) if value is not None and field.get_internal_type() == 'DateField' else
+            Decimal(value) if value is not None and field.get_internal_type() == 'DecimalField' else
+            value
+            for field, value in zip(fields, values)
+        ]
+        return cls.from_db(router.db_for_read(cls), [field.attname for field in fields], values)
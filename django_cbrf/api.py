@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+from xml.etree.ElementTree import XML, Element
+
+from cbrf.utils import date_to_str
+
+from .settings import API_URL
+from .transport import get_transport
+
+
+def get_url(script: str, **params) -> str:
+    """ Build url of CBR API script, params with None values are skipped """
+    query = '&'.join('{}={}'.format(name, value) for name, value in params.items() if value is not None)
+    return '{}/scripts/{}?{}'.format(API_URL, script, query)
+
+
+def get_currencies_info() -> Element:
+    """ Get directory of currencies, see :func cbrf.get_currencies_info: """
+    return XML(get_transport().get(get_url('XML_valFull.asp')))
+
+
+def get_daily_rates(date_req: datetime.datetime = None) -> Element:
+    """ Get rates of all currencies for the date (today by default), see :func cbrf.get_daily_rates: """
+    return XML(get_transport().get(get_url('XML_daily.asp', date_req=date_to_str(date_req) if date_req else None)))
+
+
+async def aget_daily_rates(date_req: datetime.datetime = None) -> Element:
+    """ Async version of :func get_daily_rates: """
+    return XML(await get_transport().aget(
+        get_url('XML_daily.asp', date_req=date_to_str(date_req) if date_req else None)))
+
+
+def get_dynamic_rates_url(date_req1: datetime.datetime, date_req2: datetime.datetime, currency_id: str) -> str:
+    return get_url('XML_dynamic.asp', date_req1=date_to_str(date_req1), date_req2=date_to_str(date_req2),
+                   VAL_NM_RQ=currency_id)
+
+
+def get_dynamic_rates(date_req1: datetime.datetime, date_req2: datetime.datetime, currency_id: str) -> Element:
+    """ Get rates of the currency for the period, see :func cbrf.get_dynamic_rates: """
+    return XML(get_transport().get(get_dynamic_rates_url(date_req1, date_req2, currency_id)))
+
+
+async def aget_dynamic_rates(date_req1: datetime.datetime, date_req2: datetime.datetime, currency_id: str) -> Element:
+    """ Async version of :func get_dynamic_rates: """
+    return XML(await get_transport().aget(get_dynamic_rates_url(date_req1, date_req2, currency_id)))
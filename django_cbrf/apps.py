@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.apps import AppConfig
+
+
+class DjangoCbrfConfig(AppConfig):
+    name = 'django_cbrf'
+    verbose_name = 'CB RF'
+
+    def ready(self):
+        from .registry import connect_signals
+        connect_signals()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from urllib.parse import urlsplit, parse_qsl
+
+from .settings import ARCHIVE_PATH, ARCHIVE_MODE
+from .transport import BaseTransport
+
+logger = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+READ_THROUGH = 'read-through'
+MODES = (RECORD, REPLAY, READ_THROUGH)
+
+
+class _RecordingReader(object):
+    """ File-like wrapper of response body which writes everything read into the archive file
+
+    The file is compressed on the fly and moved to its place only when the body was read to the end,
+    so interrupted downloads never get into the archive.
+    """
+
+    def __init__(self, body, path: str):
+        self.body = body
+        self.path = path
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix='.cbrf-', dir=directory)
+        self.file = gzip.GzipFile(fileobj=os.fdopen(fd, 'wb'), mode='wb')
+        self.complete = False
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.body.read() if size is None or size < 0 else self.body.read(size)
+        self.file.write(data)
+        if not data or size is None or size < 0:
+            self.complete = True
+        return data
+
+    def close(self):
+        self.body.close()
+        fileobj = self.file.fileobj
+        self.file.close()
+        fileobj.close()
+        if self.complete:
+            os.replace(self.temp_path, self.path)
+        else:
+            os.unlink(self.temp_path)
+
+
+class ArchiveTransport(BaseTransport):
+    """ On-disk archive of raw CBR API responses in front of another transport
+
+    Responses are stored gzipped, addressed by SHA-256 of script name and sorted query parameters
+    (host is not a part of the key). Modes:
+
+    * 'record': always request CBR API and (re)write the archive;
+    * 'replay': serve only from the archive, raise LookupError for missing responses;
+    * 'read-through': serve from the archive, request and record missing responses. Responses which
+      may still change (today's and future dates) are requested first and served from the archive
+      only if the request fails.
+
+    Requests served by the archive are reported as `cbrf_archive_*` metrics, requests to CBR API
+    are reported by the wrapped transport.
+    """
+    metrics_prefix = 'cbrf_archive'
+
+    def __init__(self, transport: BaseTransport, path: str = ARCHIVE_PATH, mode: str = ARCHIVE_MODE):
+        super(ArchiveTransport, self).__init__()
+        if mode not in MODES:
+            raise ValueError("Archive mode must be one of {}".format(', '.join(MODES)))
+        self.transport = transport
+        self.path = path
+        self.mode = mode
+
+    @staticmethod
+    def _split(url: str) -> tuple:
+        parts = urlsplit(url)
+        return parts.path.rsplit('/', 1)[-1], sorted(parse_qsl(parts.query))
+
+    def get_path(self, url: str) -> str:
+        """ Path of the archived response for url """
+        script, params = self._split(url)
+        key = '{}?{}'.format(script, '&'.join('{}={}'.format(name, value) for name, value in params))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, script.rsplit('.', 1)[0], digest[:2], '{}.xml.gz'.format(digest))
+
+    @classmethod
+    def is_volatile(cls, url: str) -> bool:
+        """ Response may still change: daily rates without date or any date is today or later """
+        script, params = cls._split(url)
+        dates = [value for name, value in params if name.startswith('date_req') and value]
+        if script == 'XML_daily.asp' and not dates:
+            return True
+        today = datetime.date.today()
+        return any(datetime.datetime.strptime(value, '%d/%m/%Y').date() >= today for value in dates)
+
+    def _open(self, url: str) -> tuple:
+        path = self.get_path(url)
+        archived = os.path.exists(path)
+
+        if self.mode == REPLAY:
+            if not archived:
+                raise LookupError("Response for {} is not in archive {}".format(url, self.path))
+            return 200, gzip.open(path, 'rb')
+
+        if self.mode == READ_THROUGH and archived and not self.is_volatile(url):
+            return 200, gzip.open(path, 'rb')
+
+        try:
+            body = self.transport.open(url)
+        except Exception:
+            if self.mode == READ_THROUGH and archived:
+                logger.warning("Request to {} failed, served from archive.".format(url))
+                return 200, gzip.open(path, 'rb')
+            raise
+        return 200, _RecordingReader(body, path)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from .settings import (
+    CACHE_ENABLED, CACHE_SIZE, CACHE_TTL, CACHE_TODAY_TTL,
+    SHARED_CACHE, SHARED_CACHE_TTL, SHARED_CACHE_TODAY_TTL,
+)
+
+
+def as_date(date=None) -> datetime.date:
+    """ Normalize date argument of rate lookups: None -> today, datetime -> date """
+    if date is None:
+        return datetime.date.today()
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    return date
+
+
+class LocalRateCache(object):
+    """ In-process LRU cache of rate lookups with TTL
+
+    Keys are (kind, cbrf_id, date) tuples. Entries for today (and future) dates live `today_ttl`
+    seconds, entries for historic dates live `ttl` seconds. The least recently used entry is evicted
+    when the cache is full.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL, today_ttl: float = CACHE_TODAY_TTL,
+                 enabled: bool = CACHE_ENABLED):
+        self.size = size
+        self.ttl = ttl
+        self.today_ttl = today_ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, cbrf_id: str, date: datetime.date):
+        """ Get cached value or None """
+        if not self.enabled:
+            return None
+
+        key = (kind, cbrf_id, date)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, kind: str, cbrf_id: str, date: datetime.date, value):
+        if not self.enabled or value is None:
+            return
+
+        ttl = self.today_ttl if date >= datetime.date.today() else self.ttl
+        key = (kind, cbrf_id, date)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, cbrf_ids=None):
+        """ Drop entries of given currencies (all entries by default) """
+        with self._lock:
+            if cbrf_ids is None:
+                self._data.clear()
+                return
+            cbrf_ids = set(cbrf_ids)
+            for key in [key for key in self._data if key[1] in cbrf_ids]:
+                del self._data[key]
+
+    def clear(self):
+        """ Drop all entries and reset counters """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+class SharedRateCache(object):
+    """ Rate lookups cache shared between processes, built on Django cache framework
+
+    Keys are versioned per currency: ingestion of new rates bumps the version, so all entries of
+    the currency become unreachable at once in every process. Values are stored as compact tuples
+    (see :meth AbstractRecord._dump_record:) instead of pickled model instances.
+    """
+    prefix = 'cbrf'
+
+    def __init__(self, alias: str = SHARED_CACHE, ttl: float = SHARED_CACHE_TTL,
+                 today_ttl: float = SHARED_CACHE_TODAY_TTL):
+        self.alias = alias
+        self.ttl = ttl
+        self.today_ttl = today_ttl
+
+    @property
+    def enabled(self) -> bool:
+        return self.alias is not None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version_key(self, cbrf_id: str) -> str:
+        return '{}:v:{}'.format(self.prefix, cbrf_id)
+
+    def _key(self, kind: str, cbrf_id: str, date_key) -> str:
+        version = self.cache.get(self._version_key(cbrf_id), 0)
+        return '{}:{}:{}:{}:{}'.format(self.prefix, kind, cbrf_id, version, date_key)
+
+    def get(self, kind: str, cbrf_id: str, date_key):
+        """ Get cached value or None """
+        if not self.enabled:
+            return None
+        return self.cache.get(self._key(kind, cbrf_id, date_key))
+
+    def set(self, kind: str, cbrf_id: str, date_key, value, last_date: datetime.date):
+        """ Store value; `last_date` is the latest date covered by the value and selects the TTL """
+        if not self.enabled or value is None:
+            return
+
+        ttl = self.today_ttl if last_date >= datetime.date.today() else self.ttl
+        self.cache.set(self._key(kind, cbrf_id, date_key), value, ttl)
+
+    def bump(self, cbrf_ids):
+        """ Make all entries of given currencies stale """
+        if not self.enabled:
+            return
+
+        for cbrf_id in set(cbrf_ids):
+            try:
+                self.cache.incr(self._version_key(cbrf_id))
+            except ValueError:
+                self.cache.set(self._version_key(cbrf_id), 1, None)
+
+
+rate_cache = LocalRateCache()
+shared_rate_cache = SharedRateCache()
+
+
+def invalidate_rates(cbrf_ids):
+    """ Drop cached lookups of given currencies after their rates were written """
+    rate_cache.invalidate(cbrf_ids)
+    shared_rate_cache.bump(cbrf_ids)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import bisect
+import datetime
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, see `pip install django_cbrf[numpy]`
+    numpy = None
+
+from .cache import as_date
+from .registry import get_currency_registry
+from .settings import ASOF_LOOKBACK_DAYS
+from .utils import get_cbrf_model
+
+RUB = 'RUB'
+RUB_CODES = {'RUB', 'RUR'}
+
+
+def get_rate(iso_char_code: str, date: datetime.datetime = None) -> Decimal:
+    """ Get price of one unit of the currency in RUB for the date (the latest rate on or before it)
+
+    :raises ValueError: unknown currency or no rate
+    """
+    iso_char_code = iso_char_code.upper()
+    if iso_char_code in RUB_CODES:
+        return Decimal(1)
+
+    Currency, Record = get_cbrf_model('Currency'), get_cbrf_model('Record')
+    currency = Currency.get_by_iso_char_code(iso_char_code)
+    if currency is None:
+        raise ValueError("Currency with {} iso code is not exist!".format(iso_char_code))
+
+    record = Record.get_latest_for_date(currency, date=date)
+    if record is None:
+        raise ValueError("There is no {} rate for {}".format(iso_char_code, as_date(date)))
+    return record.value / currency.denomination
+
+
+def convert(amount, from_iso: str, to_iso: str, date: datetime.datetime = None) -> Decimal:
+    """ Convert amount from one currency to another with CB RF rates for the date
+
+    Cross rates are calculated through RUB, denominations are taken into account.
+
+    :raises ValueError: unknown currency or no rate
+    """
+    amount = Decimal(amount)
+    if from_iso.upper() == to_iso.upper():
+        return amount
+    return amount * get_rate(from_iso, date) / get_rate(to_iso, date)
+
+
+def _load_rates(currencies, date_begin: datetime.date, date_end: datetime.date) -> dict:
+    """ Load rates of currencies with one query as {currency pk: ([dates], [values])} sorted by date """
+    Record = get_cbrf_model('Record')
+
+    rates = {currency.pk: ([], []) for currency in currencies}
+    records = Record.objects.filter(
+        currency_id__in=list(rates), date__gte=date_begin, date__lte=date_end,
+    ).order_by('currency_id', 'date').values_list('currency_id', 'date', 'value')
+    for currency_id, date, value in records:
+        rates[currency_id][0].append(date)
+        rates[currency_id][1].append(value)
+    return rates
+
+
+def get_rates(pairs, lookback_days: int = ASOF_LOOKBACK_DAYS) -> dict:
+    """ Get RUB prices of currency units for many (iso_char_code, date) pairs with one DB query
+
+    Rate for the date is the latest stored rate on or before it, but not older than `lookback_days`.
+    CBR API is not requested: load rates in advance (`load_rates`, :meth Record.get_many:).
+
+    :return: {(ISO_CODE, date): Decimal}
+    :raises ValueError: unknown currency or no rate
+    """
+    pairs = {(iso_char_code.upper(), as_date(date)) for iso_char_code, date in pairs}
+    foreign = {iso_char_code for iso_char_code, _date in pairs if iso_char_code not in RUB_CODES}
+    if not foreign:
+        return {pair: Decimal(1) for pair in pairs}
+
+    registry = get_currency_registry()
+    Currency = get_cbrf_model('Currency')
+    currencies = {}
+    for iso_char_code in foreign:
+        currency = registry.get_by_iso_char_code(iso_char_code) if registry.enabled else \
+            Currency.objects.filter(iso_char_code__iexact=iso_char_code).first()
+        if currency is None:
+            raise ValueError("Currency with {} iso code is not exist!".format(iso_char_code))
+        currencies[iso_char_code] = currency
+
+    dates = [date for _iso_char_code, date in pairs]
+    rates = _load_rates(currencies.values(), min(dates) - datetime.timedelta(days=lookback_days), max(dates))
+
+    result = {}
+    for iso_char_code, date in pairs:
+        if iso_char_code in RUB_CODES:
+            result[(iso_char_code, date)] = Decimal(1)
+            continue
+
+        currency = currencies[iso_char_code]
+        dates, values = rates[currency.pk]
+        index = bisect.bisect_right(dates, date) - 1
+        if index < 0 or (date - dates[index]).days > lookback_days:
+            raise ValueError("There is no {} rate for {}".format(iso_char_code, date))
+        result[(iso_char_code, date)] = values[index] / currency.denomination
+
+    return result
+
+
+def convert_many(rows, exact: bool = False, lookback_days: int = ASOF_LOOKBACK_DAYS):
+    """ Convert many amounts at once
+
+    All rates are resolved with one DB query, see :func get_rates:; amounts of rows converted to the same
+    currency are returned as is, like :func convert: does, without a rate. Conversion itself is vectorized
+    with NumPy (float64) if it is installed and `exact` is not requested; otherwise exact Decimal
+    arithmetic is used.
+
+    :param rows: iterable of (amount, from_iso, to_iso, date) tuples
+    :param exact: always return Decimals
+    :return: numpy.ndarray of floats or list of Decimals, in order of rows
+    """
+    rows = [(amount, from_iso.upper(), to_iso.upper(), as_date(date)) for amount, from_iso, to_iso, date in rows]
+    if not rows:
+        return [] if exact or numpy is None else numpy.array([], dtype=numpy.float64)
+
+    converted = [(from_iso, to_iso, date) for _amount, from_iso, to_iso, date in rows if from_iso != to_iso]
+    rates = get_rates(
+        [(from_iso, date) for from_iso, _to_iso, date in converted] +
+        [(to_iso, date) for _from_iso, to_iso, date in converted],
+        lookback_days=lookback_days,
+    )
+
+    if exact or numpy is None:
+        return [
+            Decimal(amount) if from_iso == to_iso else
+            Decimal(amount) * rates[(from_iso, date)] / rates[(to_iso, date)]
+            for amount, from_iso, to_iso, date in rows
+        ]
+
+    keys = list(rates)
+    index = {key: position for position, key in enumerate(keys)}
+    same = len(keys)  # position of 1.0 used for both sides of rows converted to the same currency
+    table = numpy.array([float(rates[key]) for key in keys] + [1.0], dtype=numpy.float64)
+
+    amounts = numpy.array([float(amount) for amount, _from_iso, _to_iso, _date in rows], dtype=numpy.float64)
+    from_index = numpy.array([index[(from_iso, date)] if from_iso != to_iso else same
+                              for _amount, from_iso, to_iso, date in rows])
+    to_index = numpy.array([index[(to_iso, date)] if from_iso != to_iso else same
+                            for _amount, from_iso, to_iso, date in rows])
+
+    return amounts * table[from_index] / table[to_index]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+import logging
+
+from django.core.management import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from django_cbrf.utils import get_cbrf_model
+from ...settings import BACKFILL_CHUNK_DAYS
+
+logger = logging.getLogger(__name__)
+
+
+def date_argument(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    """ Load long history of currency rates from cbr.ru in resumable chunks """
+
+    help = """
+Download rates for selected (or all) currencies from '--since' date to '--until' date (today by default)
+in chunks of '--chunk-days' days. For example:
+
+    `manage.py backfill_rates USD EUR --since 2000-01-01 --workers 4`
+
+Every stored chunk is remembered in DB, so after interruption the same command continues
+with chunks which were not loaded yet.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('iso_codes', nargs='*', type=str)
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Load rates of all currencies with ISO code')
+        parser.add_argument('--since', type=date_argument, required=True, help='First date, YYYY-MM-DD')
+        parser.add_argument('--until', type=date_argument, default=None, help='Last date, YYYY-MM-DD')
+        parser.add_argument('--chunk-days', type=int, default=BACKFILL_CHUNK_DAYS,
+                            help='Number of days requested at once')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads downloading chunks concurrently')
+
+    def handle(self, *args, **options):
+        Currency = get_cbrf_model('Currency')
+        Record = get_cbrf_model('Record')
+
+        if not options['iso_codes'] and not options['all']:
+            raise CommandError("Pass ISO codes of currencies or --all.")
+
+        if not Currency.objects.exists():
+            logger.info("No one Currency in DB. Populating...")
+            Currency.populate(bulk=True)
+
+        if options['all']:
+            currencies = list(Currency.objects.exclude(iso_char_code=None).exclude(iso_char_code=''))
+        else:
+            currencies = []
+            for currency_iso in options['iso_codes']:
+                currency = Currency.get_by_iso_char_code(currency_iso.upper())
+                if currency:
+                    currencies.append(currency)
+                else:
+                    logger.error("Currency with '{}' ISO code is not exist. Skipped.".format(currency_iso))
+
+        def progress(state):
+            logger.info("{}/{} chunks, {} rates, {:.1f} rates/s".format(
+                state.done, state.total, state.rates, state.rates / state.seconds if state.seconds else 0))
+
+        results = Record.backfill(options['since'], options['until'] or now().date(), currencies,
+                                  chunk_days=options['chunk_days'], workers=options['workers'], progress=progress)
+
+        failed = []
+        for currency, result in results.items():
+            if isinstance(result, Exception):
+                failed.append(currency.iso_char_code)
+            else:
+                logger.info("'{}': {} inserted, {} already in db.".format(
+                    currency.iso_char_code, result.inserted, result.unchanged))
+
+        if failed:
+            raise CommandError("Rates for {} were not loaded completely, run the command again to resume.".format(
+                ', '.join(failed)))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import logging
+
+from django.core.management import BaseCommand, CommandError
+
+from ...matrix import RateMatrix, rate_matrix
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """ Build memory-mapped rate matrix from rates stored in DB """
+
+    help = """
+Write all rates stored in DB into the memory-mapped matrix file (`CBRF_MATRIX_PATH` by default):
+
+    manage.py build_rate_matrix --path /var/lib/cbrf/rates.bin
+
+Running processes pick up the new version of the file without restart.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=None,
+                            help='Path of the matrix file, `CBRF_MATRIX_PATH` by default')
+
+    def handle(self, *args, **options):
+        matrix = RateMatrix(options['path']) if options['path'] else rate_matrix
+        if not matrix.enabled:
+            raise CommandError("Set CBRF_MATRIX_PATH or pass --path.")
+
+        days = matrix.build()
+
+        logger.info("Done. Rate matrix {} was built: {} days.".format(matrix.path, days))
@@ -20,28 +20,27 @@ Download all currencies and save them in DB
 To force populate use:
 
     manage.py load_currencies --force
+
+Currencies which are already in DB will be updated in place (names, denominations, codes).
     """
 
     def add_arguments(self, parser):
         parser.add_argument('-f', '--force', action='store_true', default=False,
-                            help='Populate Currencies even they already exist')
+                            help='Populate Currencies even they already exist (update changed ones)')
 
     def handle(self, *args, **options):
         Currency = get_cbrf_model('Currency')
 
         force = options.get('force', False)
 
-        if not force:
-            try:
-                Currency.populate()
-            except IntegrityError:
-                logger.error('Abort. Looks like Currencies already populated. '
-                             'To force populate use "python manage.py load_currencies --force"')
-                raise IntegrityError(
-                    'Currencies already populated. '
-                    'To force populate use "python manage.py load_currencies --force"'
-                )
-        else:
-            Currency.populate(force=True)
-
-        logger.info('Done. Currencies was populated.')
+        if not force and Currency.objects.exists():
+            logger.error('Abort. Looks like Currencies already populated. '
+                         'To force populate use "python manage.py load_currencies --force"')
+            raise IntegrityError(
+                'Currencies already populated. '
+                'To force populate use "python manage.py load_currencies --force"'
+            )
+
+        result = Currency.populate(bulk=True)
+
+        logger.info('Done. Currencies was populated: {} inserted, {} updated, {} unchanged.'.format(*result))
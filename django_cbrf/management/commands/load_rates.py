@@ -4,7 +4,7 @@ from __future__ import unicode_literals, absolute_import
 import datetime
 import logging
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 from django.utils.timezone import now
 
 from django_cbrf.utils import get_cbrf_model
@@ -27,11 +27,15 @@ For example, command like:
     `manage.py load_rates USD RUB --days 90`
     
 will populate rates for $ and ₽ for last 90 days.
+
+Use `--workers N` to download rates of N currencies concurrently.
     """
 
     def add_arguments(self, parser):
         parser.add_argument('iso_codes', nargs='+', type=str)
         parser.add_argument('--days', type=int, default=DAYS_FOR_POPULATE)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads downloading rates concurrently')
 
     def handle(self, *args, **options):
         days = options['days']
@@ -44,10 +48,24 @@ will populate rates for $ and ₽ for last 90 days.
         date_1 = now().date() - datetime.timedelta(days=days)
         date_2 = now().date()
 
+        to_load = []
         for currency_iso in currencies:
             currency = Currency.get_by_iso_char_code(currency_iso.upper())
             if currency:
                 logger.info("Get rates for '{}'".format(currency.eng_name))
-                Record.populate_for_dates(date_1, date_2, currency)
+                to_load.append(currency)
             else:
                 logger.error("Currency with '{}' ISO code is not exist. Skipped.".format(currency_iso))
+
+        results = Record.populate_for_dates_many(date_1, date_2, to_load, workers=options['workers'])
+
+        failed = []
+        for currency, result in results.items():
+            if isinstance(result, Exception):
+                failed.append(currency.iso_char_code)
+            else:
+                logger.info("'{}': {} inserted, {} already in db.".format(
+                    currency.iso_char_code, result.inserted, result.unchanged))
+
+        if failed:
+            raise CommandError("Rates for {} were not loaded.".format(', '.join(failed)))
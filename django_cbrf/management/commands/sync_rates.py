@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import logging
+
+from django.core.management import BaseCommand, CommandError
+
+from django_cbrf.utils import get_cbrf_model
+from ...settings import DAYS_FOR_POPULATE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """ Load currency rates which are newer than the stored ones """
+
+    help = """
+Download rates for selected currencies from the day after the last stored rate up to today:
+
+    `manage.py sync_rates USD EUR`
+
+Use `--all` to sync every currency which has any rates in DB. Currencies without rates
+are loaded for the last '--days' days.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('iso_codes', nargs='*', type=str)
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Sync every currency which has any rates')
+        parser.add_argument('--days', type=int, default=DAYS_FOR_POPULATE,
+                            help='Number of days to load for currencies without rates')
+
+    def handle(self, *args, **options):
+        Currency = get_cbrf_model('Currency')
+        Record = get_cbrf_model('Record')
+
+        if not options['iso_codes'] and not options['all']:
+            raise CommandError("Pass ISO codes of currencies or --all.")
+
+        currencies = None
+        if not options['all']:
+            currencies = []
+            for currency_iso in options['iso_codes']:
+                currency = Currency.get_by_iso_char_code(currency_iso.upper())
+                if currency:
+                    currencies.append(currency)
+                else:
+                    logger.error("Currency with '{}' ISO code is not exist. Skipped.".format(currency_iso))
+
+        results = Record.sync(currencies, days=options['days'])
+
+        failed = []
+        for currency, result in results.items():
+            if isinstance(result, Exception):
+                failed.append(currency.iso_char_code)
+            else:
+                logger.info("'{}': {} inserted.".format(currency.iso_char_code, result.inserted))
+
+        if failed:
+            raise CommandError("Rates for {} were not synced.".format(', '.join(failed)))
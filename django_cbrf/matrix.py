@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import contextlib
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from decimal import Decimal
+
+from django.db import transaction
+
+from .cache import as_date
+from .settings import MATRIX_PATH, MATRIX_CHECK_INTERVAL
+from .utils import get_cbrf_model
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CBRFRM01'
+# magic, decimal places of values, ordinal of the first day, number of days, number of currencies, index size
+HEADER = struct.Struct('<8siiiiI')
+NO_RATE = -1
+
+
+def _align(offset: int, size: int = 8) -> int:
+    return (offset + size - 1) // size * size
+
+
+class _Snapshot(object):
+    """ One mapped version of the matrix file """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.scale, self.first_day, self.days, size, index_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a rate matrix file".format(path))
+
+        offset = HEADER.size
+        self.currencies = [tuple(currency) for currency in
+                           json.loads(self._mmap[offset:offset + index_size].decode('utf-8'))]
+        self.columns = {cbrf_id: column for column, (cbrf_id, _iso, _denomination) in enumerate(self.currencies)}
+        self.by_iso_char_code = {}
+        for cbrf_id, iso_char_code, denomination in self.currencies:
+            if iso_char_code:
+                self.by_iso_char_code.setdefault(iso_char_code.upper(), (cbrf_id, denomination))
+        self.size = size
+
+        cells = self.days * size
+        offset = _align(offset + index_size)
+        buffer = memoryview(self._mmap)
+        self.values = buffer[offset:offset + cells * 8].cast('q')
+        offset += cells * 8
+        self.asof = buffer[offset:offset + cells * 4].cast('i')
+
+    def is_stale(self, path: str) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) != \
+            (self.stat.st_ino, self.stat.st_mtime_ns, self.stat.st_size)
+
+    def get(self, cbrf_id: str, date: datetime.date, latest: bool, lookback_days: int = None):
+        column = self.columns.get(cbrf_id)
+        day = date.toordinal() - self.first_day
+        if column is None or day < 0:
+            return None
+        if day >= self.days:
+            if not latest:
+                return None
+            day = self.days - 1
+
+        source = self.asof[day * self.size + column]
+        if source == NO_RATE or (not latest and source != day):
+            return None
+        if lookback_days is not None and date.toordinal() - self.first_day - source > lookback_days:
+            return None
+        return (datetime.date.fromordinal(self.first_day + source),
+                Decimal(self.values[source * self.size + column]).scaleb(-self.scale))
+
+
+class RateMatrix(object):
+    """ Dense date × currency matrix of rates in a memory-mapped file
+
+    The file keeps ``Record.value`` of every currency as scaled integers, one row per day, together
+    with the index of the latest day having a rate for every cell, so both exact and as-of lookups
+    are a couple of array reads. The file is mapped read-only, so all worker processes share the
+    same pages. New versions are written to a temporary file and atomically renamed over the old one;
+    readers re-check the file at most every `check_interval` seconds and switch to the new version.
+
+    Writers of the file are serialized with an exclusive `flock` on ``<path>.lock``, so concurrent
+    updates from several processes don't lose each other's rows.
+
+    The matrix is never filled from CBR API: build it with `build_rate_matrix` command or
+    :meth build:. It is updated automatically once the transaction storing new rates is committed,
+    one update per populate or sync call.
+    """
+
+    def __init__(self, path: str = MATRIX_PATH, check_interval: float = MATRIX_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            self._checked = time.monotonic()
+            if self._snapshot is None or self._snapshot.is_stale(self.path):
+                try:
+                    self._snapshot = _Snapshot(self.path)
+                except FileNotFoundError:
+                    self._snapshot = None
+            return self._snapshot
+
+    def reload(self):
+        """ Map the current version of the file now """
+        with self._lock:
+            self._checked = 0
+            self._snapshot = None
+
+    def get(self, cbrf_id: str, date: datetime.datetime = None) -> Decimal or None:
+        """ Get stored rate (`Record.value`) of the currency for the date, None if there is no rate """
+        snapshot = self._get_snapshot() if self.enabled else None
+        if snapshot is None:
+            return None
+        found = snapshot.get(cbrf_id, as_date(date), latest=False)
+        return found[1] if found else None
+
+    def get_latest(self, cbrf_id: str, date: datetime.datetime = None, lookback_days: int = None) -> tuple or None:
+        """ Get (date, value) of the latest stored rate of the currency on or before the date
+
+        :param lookback_days: ignore rates older than this number of days
+        :return: (datetime.date, Decimal) or None
+        """
+        snapshot = self._get_snapshot() if self.enabled else None
+        if snapshot is None:
+            return None
+        return snapshot.get(cbrf_id, as_date(date), latest=True, lookback_days=lookback_days)
+
+    def get_unit_rate(self, iso_char_code: str, date: datetime.datetime = None,
+                      lookback_days: int = None) -> Decimal or None:
+        """ Get as-of price of one unit of the currency in RUB by its ISO char code """
+        snapshot = self._get_snapshot() if self.enabled else None
+        if snapshot is None:
+            return None
+        currency = snapshot.by_iso_char_code.get(iso_char_code.upper())
+        if currency is None:
+            return None
+        found = snapshot.get(currency[0], as_date(date), latest=True, lookback_days=lookback_days)
+        return found[1] / currency[1] if found else None
+
+    def build(self) -> int:
+        """ Rebuild the whole file from DB
+
+        :return: number of days in the matrix
+        """
+        with self._locked():
+            return self._build()
+
+    def _build(self) -> int:
+        return self._write(self._load_currencies(), None, self._load_values(None))
+
+    def update(self, date_from: datetime.datetime = None) -> int:
+        """ Re-read rates from `date_from` on and append / replace them in the file
+
+        Rows before `date_from` are copied from the current version as is. The file is rebuilt
+        from scratch if there is no current version, `date_from` is before its first day or the
+        set of currencies was changed.
+
+        :return: number of days in the matrix
+        """
+        if not self.enabled:
+            return 0
+
+        with self._locked():
+            self.reload()
+            snapshot = self._get_snapshot()
+            currencies = self._load_currencies()
+            if date_from is None or snapshot is None or currencies != snapshot.currencies or \
+                    as_date(date_from).toordinal() < snapshot.first_day:
+                return self._build()
+
+            return self._write(currencies, snapshot, self._load_values(as_date(date_from)), as_date(date_from))
+
+    def schedule_update(self, date_from: datetime.datetime, using: str = None):
+        """ Update the file from `date_from` on after the current transaction is committed
+
+        Updates scheduled in one transaction or inside :meth batch: block are merged into one
+        update from the earliest date.
+        """
+        state = self._pending
+        queued = getattr(state, 'date_from', None)
+        state.date_from = as_date(date_from) if queued is None else min(queued, as_date(date_from))
+        if not getattr(state, 'depth', 0):
+            transaction.on_commit(self._update_pending, using=using)
+
+    @contextlib.contextmanager
+    def batch(self, using: str = None):
+        """ Postpone updates scheduled by the current thread inside the block to its end
+
+        Can be used as a decorator as well.
+        """
+        state = self._pending
+        state.depth = getattr(state, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if not state.depth and getattr(state, 'date_from', None) is not None:
+                transaction.on_commit(self._update_pending, using=using)
+
+    def _update_pending(self):
+        """ Run the merged update; on failure keep its range for the next scheduled update to retry
+
+        Runs after the rates were committed, so errors are logged instead of failing the write.
+        """
+        date_from, self._pending.date_from = getattr(self._pending, 'date_from', None), None
+        if date_from is None:
+            return
+        try:
+            self.update(date_from)
+        except Exception:
+            logger.exception("Rate matrix {} was not updated".format(self.path))
+            queued = getattr(self._pending, 'date_from', None)
+            self._pending.date_from = date_from if queued is None else min(queued, date_from)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """ Hold exclusive lock of the file for read-modify-rename """
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _load_currencies() -> list:
+        Currency = get_cbrf_model('Currency')
+        return [(cbrf_id, iso_char_code, denomination) for cbrf_id, iso_char_code, denomination in
+                Currency.objects.order_by('cbrf_id').values_list('cbrf_id', 'iso_char_code', 'denomination')]
+
+    @staticmethod
+    def _load_values(date_from: datetime.date or None):
+        Record = get_cbrf_model('Record')
+        records = Record.objects.all()
+        if date_from is not None:
+            records = records.filter(date__gte=date_from)
+        return records.values_list('currency__cbrf_id', 'date', 'value').iterator()
+
+    def _write(self, currencies: list, snapshot, records, date_from: datetime.date = None) -> int:
+        Record = get_cbrf_model('Record')
+        scale = Record._meta.get_field('value').decimal_places
+        columns = {cbrf_id: column for column, (cbrf_id, _iso, _denomination) in enumerate(currencies)}
+        size = len(columns)
+
+        rows = {}
+        for cbrf_id, date, value in records:
+            if cbrf_id in columns:
+                rows.setdefault(date.toordinal(), {})[columns[cbrf_id]] = int(value.scaleb(scale))
+
+        if snapshot is not None:
+            first_day = snapshot.first_day
+            kept = min(date_from.toordinal() - first_day, snapshot.days)
+        else:
+            first_day = min(rows or [datetime.date.today().toordinal()])
+            kept = 0
+        days = max(max(rows or [0]) - first_day + 1, kept)
+
+        values = array('q', bytes(8 * days * size))
+        asof = array('i', [NO_RATE]) * (days * size)
+        if kept:
+            values[:kept * size] = array('q', snapshot.values[:kept * size].tobytes())
+            asof[:kept * size] = array('i', snapshot.asof[:kept * size].tobytes())
+
+        for day in range(kept, days):
+            row, offset = rows.get(first_day + day, {}), day * size
+            for column in range(size):
+                if column in row:
+                    values[offset + column] = row[column]
+                    asof[offset + column] = day
+                elif day:
+                    asof[offset + column] = asof[offset - size + column]
+
+        index = json.dumps(currencies).encode('utf-8')
+        header = HEADER.pack(MAGIC, scale, first_day, days, size, len(index)) + index
+        header += bytes(_align(len(header)) - len(header))
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.cbrf-matrix-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(values.tobytes())
+                f.write(asof.tobytes())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        logger.debug("Rate matrix {} written: {} days × {} currencies".format(self.path, days, size))
+        self.reload()
+        return days
+
+
+rate_matrix = RateMatrix()
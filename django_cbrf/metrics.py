@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import bisect
+import threading
+import time
+
+from django.utils.module_loading import import_string
+
+from .settings import METRICS
+
+# Counters and histograms reported by django_cbrf:
+#
+# cbrf_lookups_total{method, source}             rate lookups by source: cache, shared_cache, db, negative_cache, stale, api
+# cbrf_api_requests_total{endpoint, status}      requests to CBR API (status is 'error' for failed ones)
+# cbrf_api_request_seconds{endpoint}             duration of CBR API requests
+# cbrf_archive_requests_total{endpoint, status}  requests served by the archive of CBR API responses
+# cbrf_archive_request_seconds{endpoint}         duration of requests served by the archive
+# cbrf_rows_total{result}                        written rates: inserted (sent to INSERT), updated, skipped
+# cbrf_write_seconds                             duration of batched rate writes
+# cbrf_errors_total{operation}                   failed loads of populate_for_dates_many, backfill, sync, refresh
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.monotonic() - self.started, **self.labels)
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class BaseMetrics(object):
+    """ Metrics backend which does nothing, the default one
+
+    Backends implement :meth increment: for counters and :meth observe: for histograms; metric
+    labels are passed as keyword arguments.
+    """
+    enabled = False
+
+    def increment(self, name: str, value: float = 1, **labels):
+        pass
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def timer(self, name: str, **labels):
+        """ Context manager observing duration of the block in seconds """
+        return _Timer(self, name, labels) if self.enabled else _null_timer
+
+
+class PrometheusMetrics(BaseMetrics):
+    """ In-process counters and histograms exported in Prometheus text format
+
+    Every process keeps its own values, expose them with :func django_cbrf.views.metrics: view.
+    """
+    enabled = True
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0]
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name: str, **labels) -> float:
+        """ Get value of a counter (number of observations for a histogram) """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][2]
+            return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _format_labels(labels) -> str:
+        if not labels:
+            return ''
+        return '{{{}}}'.format(','.join('{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in labels))
+
+    def render(self) -> str:
+        """ Render all metrics in Prometheus text exposition format """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self._histograms.items())
+
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(name, self._format_labels(labels), value))
+
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(name, self._format_labels(labels + (('le', bound),)), cumulative))
+            lines.append('{}_bucket{} {}'.format(name, self._format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(name, self._format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, self._format_labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = None
+_lock = threading.Lock()
+
+
+def get_metrics() -> BaseMetrics:
+    """ Get metrics backend configured by ``settings.CBRF_METRICS`` (created on the first call) """
+    global _metrics
+    if _metrics is None:
+        with _lock:
+            if _metrics is None:
+                _metrics = import_string(METRICS)()
+    return _metrics
+
+
+def set_metrics(metrics: BaseMetrics or None):
+    """ Replace metrics backend of the process, None restores the configured one """
+    global _metrics
+    with _lock:
+        _metrics = metrics
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cbrf', '0002_denomination_integer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='record model')),
+                ('cbrf_id', models.CharField(max_length=12, verbose_name='CB RF code')),
+                ('date_begin', models.DateField()),
+                ('date_end', models.DateField()),
+            ],
+            options={
+                'verbose_name': 'rate coverage',
+                'verbose_name_plural': 'rate coverage',
+                'indexes': [models.Index(fields=['model', 'cbrf_id', 'date_begin'], name='django_cbrf_model_7175cc_idx')],
+            },
+        ),
+    ]
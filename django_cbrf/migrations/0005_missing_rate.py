@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cbrf', '0004_record_asof_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MissingRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='record model')),
+                ('cbrf_id', models.CharField(max_length=12, verbose_name='CB RF code')),
+                ('date', models.DateField()),
+                ('checked', models.DateTimeField(verbose_name='checked at')),
+            ],
+            options={
+                'verbose_name': 'missing rate',
+                'verbose_name_plural': 'missing rates',
+                'unique_together': {('model', 'cbrf_id', 'date')},
+            },
+        ),
+    ]
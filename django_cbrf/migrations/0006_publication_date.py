@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cbrf', '0005_missing_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicationDate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('effective_until', models.DateField()),
+            ],
+            options={
+                'verbose_name': 'publication date',
+                'verbose_name_plural': 'publication calendar',
+            },
+        ),
+    ]
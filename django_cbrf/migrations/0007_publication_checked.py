@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cbrf', '0006_publication_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publicationdate',
+            name='checked_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='publicationdate',
+            name='checked',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='checked at'),
+        ),
+    ]
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
 
+import bisect
+import datetime
+
+from django.db import models, transaction
+from django.utils import timezone
+
 from .abstract_models import AbstractCurrency, AbstractRecord
+from .settings import NEGATIVE_CACHE_TODAY_TTL, NEGATIVE_CACHE_RECENT_TTL, NEGATIVE_CACHE_RECENT_DAYS
 
 
 class Currency(AbstractCurrency):
@@ -9,4 +16,188 @@ class Currency(AbstractCurrency):
 
 
 class Record(AbstractRecord):
-    pass
+    class Meta(AbstractRecord.Meta):
+        indexes = [models.Index(fields=['currency', '-date'], name='django_cbrf_record_asof')]
+
+
+class RateCoverage(models.Model):
+    """ Date range of currency rates which were already requested from CBR API
+
+    Ranges are stored even if CBR API returned no rates for them (weekends, holidays, delisted
+    currencies), so they are never requested again. Overlapping and adjacent ranges are merged.
+    """
+    model = models.CharField(verbose_name='record model', max_length=100)
+    cbrf_id = models.CharField(verbose_name='CB RF code', max_length=12)
+    date_begin = models.DateField()
+    date_end = models.DateField()
+
+    class Meta:
+        verbose_name = 'rate coverage'
+        verbose_name_plural = 'rate coverage'
+        indexes = [models.Index(fields=['model', 'cbrf_id', 'date_begin'])]
+
+    def __str__(self):
+        return '[{}] {} - {}'.format(self.cbrf_id, self.date_begin, self.date_end)
+
+    @classmethod
+    def add(cls, model: str, cbrf_id: str, date_begin: datetime.date, date_end: datetime.date):
+        """ Mark range as fetched, merging it with overlapping and adjacent ones """
+        if date_begin > date_end:
+            return
+
+        one_day = datetime.timedelta(days=1)
+        with transaction.atomic():
+            ranges = cls.objects.select_for_update().filter(
+                model=model, cbrf_id=cbrf_id, date_begin__lte=date_end + one_day, date_end__gte=date_begin - one_day)
+            ranges = list(ranges)
+            if any(item.date_begin <= date_begin and date_end <= item.date_end for item in ranges):
+                return
+            date_begin = min([date_begin] + [item.date_begin for item in ranges])
+            date_end = max([date_end] + [item.date_end for item in ranges])
+            cls.objects.filter(pk__in=[item.pk for item in ranges]).delete()
+            cls.objects.create(model=model, cbrf_id=cbrf_id, date_begin=date_begin, date_end=date_end)
+
+    @classmethod
+    def is_fetched(cls, model: str, cbrf_id: str, date: datetime.date) -> bool:
+        """ Was the date already fetched? If so, a missing rate for it means there is no publication """
+        return cls.objects.filter(model=model, cbrf_id=cbrf_id, date_begin__lte=date, date_end__gte=date).exists()
+
+    @classmethod
+    def get_gaps(cls, model: str, cbrf_id: str, date_begin: datetime.date, date_end: datetime.date,
+                 merge_days: int = 0) -> list:
+        """ Get not fetched sub-ranges of the range as [(date_begin, date_end), ...]
+
+        :param merge_days: gaps separated by at most this number of fetched days are merged into one
+        """
+        ranges = cls.objects.filter(
+            model=model, cbrf_id=cbrf_id, date_begin__lte=date_end, date_end__gte=date_begin,
+        ).order_by('date_begin').values_list('date_begin', 'date_end')
+
+        one_day = datetime.timedelta(days=1)
+        gaps, cursor = [], date_begin
+        for covered_begin, covered_end in ranges:
+            if covered_begin > cursor:
+                gaps.append((cursor, covered_begin - one_day))
+            cursor = max(cursor, covered_end + one_day)
+        if cursor <= date_end:
+            gaps.append((cursor, date_end))
+
+        merged = []
+        for gap in gaps:
+            if merged and (gap[0] - merged[-1][1]).days - 1 <= merge_days:
+                merged[-1] = (merged[-1][0], gap[1])
+            else:
+                merged.append(gap)
+        return merged
+
+
+class MissingRate(models.Model):
+    """ Date for which CBR API has no published rate of a currency (the daily document doesn't contain it)
+
+    Dates without publications at all are kept in :class PublicationDate:. Entries for today and future dates
+    expire in `CBRF_NEGATIVE_CACHE_TODAY_TTL` seconds, for the last `CBRF_NEGATIVE_CACHE_RECENT_DAYS`
+    days in `CBRF_NEGATIVE_CACHE_RECENT_TTL` seconds, older ones never expire.
+    """
+    model = models.CharField(verbose_name='record model', max_length=100)
+    cbrf_id = models.CharField(verbose_name='CB RF code', max_length=12)
+    date = models.DateField()
+    checked = models.DateTimeField(verbose_name='checked at')
+
+    class Meta:
+        verbose_name = 'missing rate'
+        verbose_name_plural = 'missing rates'
+        unique_together = ('model', 'cbrf_id', 'date')
+
+    def __str__(self):
+        return '[{}] {}'.format(self.cbrf_id, self.date)
+
+    @staticmethod
+    def get_ttl(date: datetime.date) -> int or None:
+        """ Get lifetime of the entry for the date in seconds, None if it never expires """
+        today = datetime.date.today()
+        if date >= today:
+            return NEGATIVE_CACHE_TODAY_TTL
+        if date >= today - datetime.timedelta(days=NEGATIVE_CACHE_RECENT_DAYS):
+            return NEGATIVE_CACHE_RECENT_TTL
+        return None
+
+    @classmethod
+    def add(cls, model: str, cbrf_ids, date: datetime.date):
+        """ Remember that there is no rate for the date for every one of `cbrf_ids` """
+        cbrf_ids, now = sorted(set(cbrf_ids)), timezone.now()
+        with transaction.atomic():
+            cls.objects.filter(model=model, cbrf_id__in=cbrf_ids, date=date).delete()
+            cls.objects.bulk_create([cls(model=model, cbrf_id=cbrf_id, date=date, checked=now) for cbrf_id in cbrf_ids])
+
+    @classmethod
+    def is_missing(cls, model: str, cbrf_id: str, date: datetime.date) -> bool:
+        """ Is there a not expired entry for the currency and the date? """
+        entries = cls.objects.filter(model=model, cbrf_id=cbrf_id, date=date)
+        ttl = cls.get_ttl(date)
+        if ttl is not None:
+            entries = entries.filter(checked__gte=timezone.now() - datetime.timedelta(seconds=ttl))
+        return entries.exists()
+
+
+class PublicationDate(models.Model):
+    """ Calendar of CBR publications: date of a rate set and the last date it is known to be effective on
+
+    Filled from `Date` attribute of daily documents: the document requested for any date contains the rate
+    set effective on it, so there are no publications between the set date and the requested one. Ranges
+    are extended up to yesterday only: rates for today and future dates may be published later. That the set
+    is still effective on today or a future date is kept in `checked_until` and `checked` instead and
+    is trusted for `CBRF_NEGATIVE_CACHE_TODAY_TTL` seconds.
+    """
+    date = models.DateField(unique=True)
+    effective_until = models.DateField()
+    checked_until = models.DateField(null=True, blank=True)
+    checked = models.DateTimeField(verbose_name='checked at', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'publication date'
+        verbose_name_plural = 'publication calendar'
+
+    def __str__(self):
+        return '{} - {}'.format(self.date, self.effective_until)
+
+    @classmethod
+    def add(cls, date: datetime.date, requested: datetime.date):
+        """ Remember that the daily document requested for `requested` date contains rates set for `date` """
+        today = datetime.date.today()
+        effective_until = max(date, min(requested, today - datetime.timedelta(days=1)))
+        with transaction.atomic():
+            publication, created = cls.objects.get_or_create(date=date, defaults={'effective_until': effective_until})
+            if not created and publication.effective_until < effective_until:
+                cls.objects.filter(pk=publication.pk).update(effective_until=effective_until)
+            if requested >= today:
+                cls.objects.filter(pk=publication.pk).update(checked_until=requested, checked=timezone.now())
+
+    @classmethod
+    def is_current(cls, date: datetime.date, requested: datetime.date) -> bool:
+        """ Was the rate set of the date recently seen effective on today or future `requested` date? """
+        return cls.objects.filter(
+            date=date, checked_until__gte=requested,
+            checked__gte=timezone.now() - datetime.timedelta(seconds=NEGATIVE_CACHE_TODAY_TTL),
+        ).exists()
+
+    @classmethod
+    def get_effective_dates(cls, dates) -> dict:
+        """ Get {date: date of the rate set effective on it} for dates known to the calendar with one query """
+        dates = sorted(set(dates))
+        if not dates:
+            return {}
+        publications = list(cls.objects.filter(date__lte=dates[-1], effective_until__gte=dates[0]).order_by(
+            'date').values_list('date', 'effective_until'))
+        starts = [date for date, _effective_until in publications]
+
+        result = {}
+        for date in dates:
+            position = bisect.bisect_right(starts, date) - 1
+            if position >= 0 and publications[position][1] >= date:
+                result[date] = starts[position]
+        return result
+
+    @classmethod
+    def get_effective_date(cls, date: datetime.date) -> datetime.date or None:
+        """ Get date of the rate set effective on the date, None if it is not known yet """
+        return cls.get_effective_dates([date]).get(date)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast
+
+from .conversion import RUB, RUB_CODES
+from .utils import get_cbrf_model
+
+RATE_FIELD = models.DecimalField(max_digits=30, decimal_places=10)
+
+RateRow = namedtuple('RateRow', ['date', 'iso_char_code', 'value', 'denomination'])
+
+
+class _Numeric(Cast):
+    """ Cast to exact numeric; SQLite has no exact decimals, so cast to REAL there to avoid integer division """
+
+    def __init__(self, expression):
+        super(_Numeric, self).__init__(expression, output_field=RATE_FIELD)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super(_Numeric, self).as_sql(compiler, connection, template='CAST(%(expressions)s AS REAL)',
+                                            **extra_context)
+
+
+def rate_subquery(date_ref, **currency_filter) -> Subquery:
+    """ Correlated subquery of the latest RUB price of one currency unit on or before `date_ref`
+
+    :param date_ref: expression of the date, usually `OuterRef('date')`
+    :param currency_filter: lookups of `Record` selecting the currency
+    """
+    Record = get_cbrf_model('Record')
+
+    records = Record.objects.filter(date__lte=date_ref, **currency_filter).order_by('-date').annotate(
+        unit_rate=ExpressionWrapper(F('value') / _Numeric(F('currency__denomination')), output_field=RATE_FIELD),
+    ).values('unit_rate')[:1]
+    return Subquery(records, output_field=RATE_FIELD)
+
+
+def annotate_converted(queryset, amount_field: str, currency_field: str, date_field: str, to: str = RUB,
+                       rate_name: str = 'rate', amount_name: str = 'converted_amount'):
+    """ Annotate queryset with CB RF rate for the date and the amount converted to `to` currency
+
+    Everything is calculated in DB with correlated subqueries on ``settings.CBRF_APP_NAME`` Record model,
+    so the result could be filtered, aggregated and ordered by. The rate is the latest one on or before
+    the date; the annotations are NULL if there is no such rate.
+
+        Order.objects.annotate_converted('amount', 'currency', 'created').aggregate(Sum('converted_amount'))
+
+    :param amount_field: name of the amount field
+    :param currency_field: name of ForeignKey to Currency or of the field with ISO char code
+    :param date_field: name of the date field
+    :param to: ISO char code of the target currency
+    :param rate_name: name of the cross rate annotation
+    :param amount_name: name of the converted amount annotation
+    """
+    if queryset.model._meta.get_field(currency_field).is_relation:
+        rate = rate_subquery(OuterRef(date_field), currency_id=OuterRef(currency_field))
+    else:
+        rate = Case(
+            When(**{'{}__in'.format(currency_field): RUB_CODES, 'then': Value(Decimal(1))}),
+            default=rate_subquery(OuterRef(date_field), currency__iso_char_code=OuterRef(currency_field)),
+            output_field=RATE_FIELD,
+        )
+
+    if to.upper() not in RUB_CODES:
+        rate = rate / rate_subquery(OuterRef(date_field), currency__iso_char_code=to.upper())
+
+    return queryset.annotate(**{
+        rate_name: ExpressionWrapper(rate, output_field=RATE_FIELD),
+    }).annotate(**{
+        amount_name: ExpressionWrapper(F(amount_field) * F(rate_name), output_field=RATE_FIELD),
+    })
+
+
+class ConvertibleQuerySet(models.QuerySet):
+    """ QuerySet of models with amounts in foreign currencies
+
+        class Order(models.Model):
+            amount = models.DecimalField(max_digits=12, decimal_places=2)
+            currency = models.ForeignKey('django_cbrf.Currency', on_delete=models.PROTECT)
+            created = models.DateField()
+
+            objects = ConvertibleManager()
+    """
+
+    def annotate_converted(self, amount_field: str, currency_field: str, date_field: str, to: str = RUB,
+                           rate_name: str = 'rate', amount_name: str = 'converted_amount'):
+        return annotate_converted(self, amount_field, currency_field, date_field, to=to,
+                                  rate_name=rate_name, amount_name=amount_name)
+
+
+ConvertibleManager = models.Manager.from_queryset(ConvertibleQuerySet)
+
+
+class RecordQuerySet(models.QuerySet):
+    """ QuerySet of rates """
+
+    def rows(self, chunk_size: int = 2000):
+        """ Iterate over rates as :class RateRow: without creating model instances
+
+        Rates are read with one query joined with currencies and fetched `chunk_size` rows at a time.
+        """
+        return map(RateRow._make, self.values_list(
+            'date', 'currency__iso_char_code', 'value', 'currency__denomination').iterator(chunk_size=chunk_size))
+
+
+RecordManager = models.Manager.from_queryset(RecordQuerySet)
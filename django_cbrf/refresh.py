@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .metrics import get_metrics
+from .settings import REFRESHER, REFRESH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_rate(model: str, cbrf_id: str, date: datetime.date):
+    """ Load the rate of the currency for the date, which was served stale, see :meth AbstractRecord.get_for_date:
+
+    :param model: label of Record model, 'django_cbrf.record'
+    """
+    Record = apps.get_model(model)
+    currency = Record._meta.get_field('currency').related_model.objects.get(cbrf_id=cbrf_id)
+    Record.get_latest_for_date(currency, date=date, max_staleness=0)
+
+
+class BaseRefresher(object):
+    """ Runs refreshes of stale rates, at most one per (Record model, currency) at a time
+
+    The base class refreshes synchronously in :meth schedule:, which is handy for tests. Subclasses
+    implement :meth _submit: to run :func refresh_rate: elsewhere and call :meth done: when it's over;
+    refreshers of task queues could enqueue it and call :meth done: right away.
+    """
+
+    def __init__(self):
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, model: str, cbrf_id: str, date: datetime.date) -> bool:
+        """ Schedule refresh of the rate, return False if a refresh of the currency is already in flight """
+        key = (model, cbrf_id)
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+
+        try:
+            self._submit(model, cbrf_id, date)
+        except Exception:
+            self.done(model, cbrf_id)
+            raise
+        return True
+
+    def done(self, model: str, cbrf_id: str):
+        with self._lock:
+            self._in_flight.discard((model, cbrf_id))
+
+    def _submit(self, model: str, cbrf_id: str, date: datetime.date):
+        self._run(model, cbrf_id, date)
+
+    def _run(self, model: str, cbrf_id: str, date: datetime.date):
+        try:
+            refresh_rate(model, cbrf_id, date)
+        except Exception as err:
+            logger.error("Can't refresh rate of {} for {}: {}".format(cbrf_id, date, err))
+            get_metrics().increment('cbrf_errors_total', operation='refresh')
+        finally:
+            self.done(model, cbrf_id)
+
+
+class ThreadRefresher(BaseRefresher):
+    """ Default refresher: runs refreshes in a pool of `workers` background threads of the process """
+
+    def __init__(self, workers: int = REFRESH_WORKERS):
+        super(ThreadRefresher, self).__init__()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cbrf-refresh')
+
+    def _submit(self, model: str, cbrf_id: str, date: datetime.date):
+        self.executor.submit(self._run_in_thread, model, cbrf_id, date)
+
+    def _run_in_thread(self, model: str, cbrf_id: str, date: datetime.date):
+        try:
+            self._run(model, cbrf_id, date)
+        finally:
+            connections.close_all()
+
+
+_refresher = None
+_lock = threading.Lock()
+
+
+def get_refresher() -> BaseRefresher:
+    """ Get refresher configured by ``settings.CBRF_REFRESHER`` (created on the first call) """
+    global _refresher
+    if _refresher is None:
+        with _lock:
+            if _refresher is None:
+                _refresher = import_string(REFRESHER)()
+    return _refresher
+
+
+def set_refresher(refresher: BaseRefresher or None):
+    """ Replace refresher of the process, None restores the configured one """
+    global _refresher
+    with _lock:
+        _refresher = refresher
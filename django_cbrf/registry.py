@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .settings import CURRENCY_REGISTRY, CURRENCY_REGISTRY_TTL
+
+CurrencyInfo = namedtuple('CurrencyInfo', [
+    'pk', 'cbrf_id', 'parent_code', 'name', 'eng_name', 'denomination', 'iso_num_code', 'iso_char_code',
+])
+
+
+class CurrencyRegistry(object):
+    """ Process-wide in-memory index of the currencies directory
+
+    Currencies are loaded from DB once, on the first lookup, and kept as immutable
+    :class CurrencyInfo: tuples indexed by CB RF code, ISO char code and ISO numeric code.
+    Codes are matched case-insensitively. The index is dropped (and lazily reloaded) once
+    a transaction changing the currencies table by `populate` or by `post_save` / `post_delete`
+    signals of this process is committed; changes made by other processes are picked up once
+    the index is older than `ttl` seconds.
+    """
+
+    def __init__(self, model, enabled: bool = CURRENCY_REGISTRY, ttl: float = CURRENCY_REGISTRY_TTL):
+        self.model = model
+        self.enabled = enabled
+        self.ttl = ttl
+        self._indexes = None
+        self._expires = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> tuple:
+        by_cbrf_id, by_iso_char_code, by_iso_num_code = {}, {}, {}
+        for row in self.model.objects.values_list('pk', *CurrencyInfo._fields[1:]):
+            currency = CurrencyInfo(*row)
+            by_cbrf_id[currency.cbrf_id.upper()] = currency
+            if currency.iso_char_code:
+                by_iso_char_code.setdefault(currency.iso_char_code.upper(), currency)
+            if currency.iso_num_code is not None:
+                by_iso_num_code.setdefault(currency.iso_num_code, currency)
+
+        return by_cbrf_id, by_iso_char_code, by_iso_num_code
+
+    def _get_indexes(self) -> tuple:
+        indexes = self._indexes
+        if not self.loaded:
+            with self._lock:
+                if self.loaded:
+                    return self._indexes
+                generation = self._generation
+                indexes = self._load()
+                if generation == self._generation:
+                    self._indexes = indexes
+                    self._expires = None if self.ttl is None else time.monotonic() + self.ttl
+        return indexes
+
+    @property
+    def loaded(self) -> bool:
+        """ Whether the index is loaded and not expired """
+        return self._indexes is not None and (self._expires is None or time.monotonic() < self._expires)
+
+    def load(self):
+        """ Load the index now instead of on the first lookup """
+        self._get_indexes()
+
+    def invalidate(self):
+        """ Drop the index, it will be reloaded on the next lookup """
+        with self._lock:
+            self._indexes = None
+            self._generation += 1
+
+    def all(self) -> list:
+        return list(self._get_indexes()[0].values())
+
+    def get_by_cbrf_id(self, cbrf_id: str) -> CurrencyInfo or None:
+        return self._get_indexes()[0].get(str(cbrf_id).upper())
+
+    def get_by_iso_char_code(self, iso_char_code: str) -> CurrencyInfo or None:
+        return self._get_indexes()[1].get(str(iso_char_code).upper())
+
+    def get_by_iso_num_code(self, iso_num_code: str or int) -> CurrencyInfo or None:
+        try:
+            return self._get_indexes()[2].get(int(iso_num_code))
+        except (TypeError, ValueError):
+            return None
+
+
+_registries = {}
+
+
+def get_currency_registry(model=None) -> CurrencyRegistry:
+    """ Get registry of the Currency model (``settings.CBRF_APP_NAME`` one by default) """
+    if model is None:
+        from .utils import get_cbrf_model
+        model = get_cbrf_model('Currency')
+
+    registry = _registries.get(model._meta.label)
+    if registry is None:
+        registry = _registries.setdefault(model._meta.label, CurrencyRegistry(model))
+    return registry
+
+
+def _invalidate_registry(sender, **kwargs):
+    """ Drop the index once the change is committed, so readers can't cache the old rows again """
+    transaction.on_commit(get_currency_registry(sender).invalidate, using=kwargs.get('using'))
+
+
+def connect_signals():
+    """ Reload registries of all Currency models when they are changed """
+    from .abstract_models import AbstractCurrency
+
+    for model in apps.get_models():
+        if issubclass(model, AbstractCurrency):
+            post_save.connect(_invalidate_registry, sender=model, dispatch_uid='cbrf_registry_save')
+            post_delete.connect(_invalidate_registry, sender=model, dispatch_uid='cbrf_registry_delete')
@@ -2,11 +2,49 @@
 from __future__ import unicode_literals, absolute_import
 
 import logging
+
+from cbrf import const
 from django.conf import settings
 
 DEFAULT_APP_NAME = 'django_cbrf'
 CBRF_APP_NAME = getattr(settings, 'CBRF_APP_NAME', DEFAULT_APP_NAME)
 DAYS_FOR_POPULATE = getattr(settings, 'CBRF_DAYS_FOR_POPULATE', 60)
+BATCH_SIZE = getattr(settings, 'CBRF_BATCH_SIZE', 500)
+POPULATE_ALL_DAILY = getattr(settings, 'CBRF_POPULATE_ALL_DAILY', False)
+CACHE_ENABLED = getattr(settings, 'CBRF_CACHE_ENABLED', False)
+CACHE_SIZE = getattr(settings, 'CBRF_CACHE_SIZE', 1024)
+CACHE_TTL = getattr(settings, 'CBRF_CACHE_TTL', 24 * 60 * 60)  # seconds, for historic dates
+CACHE_TODAY_TTL = getattr(settings, 'CBRF_CACHE_TODAY_TTL', 5 * 60)  # seconds, for today's date
+SHARED_CACHE = getattr(settings, 'CBRF_SHARED_CACHE', None)  # alias from settings.CACHES
+SHARED_CACHE_TTL = getattr(settings, 'CBRF_SHARED_CACHE_TTL', 24 * 60 * 60)  # seconds, for historic dates
+SHARED_CACHE_TODAY_TTL = getattr(settings, 'CBRF_SHARED_CACHE_TODAY_TTL', 5 * 60)  # seconds, for today's date
+GAP_MERGE_DAYS = getattr(settings, 'CBRF_GAP_MERGE_DAYS', 7)
+ASOF_LOOKBACK_DAYS = getattr(settings, 'CBRF_ASOF_LOOKBACK_DAYS', 14)
+CURRENCY_REGISTRY = getattr(settings, 'CBRF_CURRENCY_REGISTRY', True)
+CURRENCY_REGISTRY_TTL = getattr(settings, 'CBRF_CURRENCY_REGISTRY_TTL', 5 * 60)  # seconds, None - never expires
+MISSING_CURRENCY_POLICY = getattr(settings, 'CBRF_MISSING_CURRENCY_POLICY', 'skip')  # 'skip', 'populate' or 'error'
+MATRIX_PATH = getattr(settings, 'CBRF_MATRIX_PATH', None)  # file of the memory-mapped rate matrix
+MATRIX_CHECK_INTERVAL = getattr(settings, 'CBRF_MATRIX_CHECK_INTERVAL', 1)  # seconds between checks for new version
+MATRIX_AUTO_UPDATE = getattr(settings, 'CBRF_MATRIX_AUTO_UPDATE', True)
+BACKFILL_CHUNK_DAYS = getattr(settings, 'CBRF_BACKFILL_CHUNK_DAYS', 365)
+API_URL = getattr(settings, 'CBRF_API_URL', const.CBRF_URL)
+TRANSPORT = getattr(settings, 'CBRF_TRANSPORT', 'django_cbrf.transport.SessionTransport')
+CONNECT_TIMEOUT = getattr(settings, 'CBRF_CONNECT_TIMEOUT', 5)  # seconds
+READ_TIMEOUT = getattr(settings, 'CBRF_READ_TIMEOUT', 30)  # seconds
+RETRIES = getattr(settings, 'CBRF_RETRIES', 3)
+RETRY_BACKOFF = getattr(settings, 'CBRF_RETRY_BACKOFF', 0.5)  # seconds, doubled on every retry
+POOL_SIZE = getattr(settings, 'CBRF_POOL_SIZE', 10)
+ARCHIVE_PATH = getattr(settings, 'CBRF_ARCHIVE_PATH', None)  # directory of raw CBR API responses archive
+ARCHIVE_MODE = getattr(settings, 'CBRF_ARCHIVE_MODE', 'read-through')  # 'record', 'replay' or 'read-through'
+METRICS = getattr(settings, 'CBRF_METRICS', 'django_cbrf.metrics.BaseMetrics')  # metrics backend class
+NEGATIVE_CACHE = getattr(settings, 'CBRF_NEGATIVE_CACHE', True)  # remember dates without published rates
+NEGATIVE_CACHE_TODAY_TTL = getattr(settings, 'CBRF_NEGATIVE_CACHE_TODAY_TTL', 5 * 60)  # seconds, today and future
+NEGATIVE_CACHE_RECENT_TTL = getattr(settings, 'CBRF_NEGATIVE_CACHE_RECENT_TTL', 60 * 60)  # seconds, recent dates
+NEGATIVE_CACHE_RECENT_DAYS = getattr(settings, 'CBRF_NEGATIVE_CACHE_RECENT_DAYS', 7)  # older entries never expire
+PUBLICATION_CALENDAR = getattr(settings, 'CBRF_PUBLICATION_CALENDAR', True)  # remember dates of CBR publications
+MAX_STALENESS = getattr(settings, 'CBRF_MAX_STALENESS', None)  # days, enables stale-while-revalidate for today
+REFRESHER = getattr(settings, 'CBRF_REFRESHER', 'django_cbrf.refresh.ThreadRefresher')  # runs refreshes of stale rates
+REFRESH_WORKERS = getattr(settings, 'CBRF_REFRESH_WORKERS', 2)
 
 DEBUG = getattr(settings, 'DEBUG', True)
 
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import datetime
+from contextlib import closing
+from decimal import Decimal
+from itertools import islice
+from xml.etree.ElementTree import iterparse
+
+from .api import get_dynamic_rates_url
+from .transport import get_transport
+
+
+def parse_date(value: str) -> datetime.date:
+    """ Convert 'dd.mm.yyyy' date of CBR API to date """
+    return datetime.date(int(value[6:10]), int(value[3:5]), int(value[0:2]))
+
+
+def parse_value(value: str) -> Decimal:
+    """ Convert '28,6200' value of CBR API to Decimal """
+    return Decimal(value.replace(',', '.'))
+
+
+def open_dynamic_rates(date_req1: datetime.datetime, date_req2: datetime.datetime, currency_id: str):
+    """ Request rates of the currency for the period and return the response body as a file-like object
+
+    The body is not read: it is consumed by the parser while it is downloaded.
+    """
+    return get_transport().open(get_dynamic_rates_url(date_req1, date_req2, currency_id))
+
+
+def iterparse_dynamic_rates(source):
+    """ Parse XML_dynamic.asp document incrementally
+
+        <ValCurs ID="R01235" DateRange1="02.03.2001" DateRange2="14.03.2001" name="Foreign Currency Market Dynamic">
+            <Record Date="02.03.2001" Id="R01235">
+                <Nominal>1</Nominal>
+                <Value>28,6200</Value>
+            </Record>
+        <...>
+
+    Every <Record> is dropped right after it is parsed, so memory doesn't depend on the document size.
+
+    :param source: file-like object with the document
+    :return: iterator of (date, value) tuples
+    """
+    root = None
+    for event, element in iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = element
+        elif event == 'end' and element.tag == 'Record':
+            yield parse_date(element.get('Date')), parse_value(element.findtext('Value'))
+            root.clear()
+
+
+def stream_dynamic_rates(date_req1: datetime.datetime, date_req2: datetime.datetime, currency_id: str):
+    """ Download and parse rates of the currency for the period at once
+
+    :return: iterator of (date, value) tuples
+    """
+    with closing(open_dynamic_rates(date_req1=date_req1, date_req2=date_req2, currency_id=currency_id)) as source:
+        for rate in iterparse_dynamic_rates(source):
+            yield rate
+
+
+def iter_batches(iterable, size: int):
+    """ Split iterable into lists of `size` items (the last one may be shorter) """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
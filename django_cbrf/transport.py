@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+import io
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import closing
+
+import requests
+from asgiref.sync import sync_to_async
+from cbrf import const
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import get_metrics
+from .settings import TRANSPORT, CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES, RETRY_BACKOFF, POOL_SIZE, ARCHIVE_PATH
+
+logger = logging.getLogger(__name__)
+
+RequestTiming = namedtuple('RequestTiming', ['url', 'status', 'seconds'])
+
+
+def get_script(url: str) -> str:
+    """ Get name of CBR API script from url: 'XML_daily.asp' """
+    return url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+
+class _TimedBody(object):
+    """ File-like wrapper of response body which calls `on_done` once, when it is read to the end or closed """
+
+    def __init__(self, body, on_done):
+        self.body = body
+        self.on_done = on_done
+
+    def _done(self):
+        if self.on_done is not None:
+            on_done, self.on_done = self.on_done, None
+            on_done()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.body.read() if size is None or size < 0 else self.body.read(size)
+        if not data or size is None or size < 0:
+            self._done()
+        return data
+
+    def close(self):
+        try:
+            self.body.close()
+        finally:
+            self._done()
+
+
+class BaseTransport(object):
+    """ Performs GET requests to CBR API
+
+    Subclasses implement :meth _open: returning (status, file-like body) and may implement native
+    :meth aopen: for async callers, by default :meth open: runs in a worker thread; timing of every request
+    (until its body is read) is kept in `timings` (the last `timings_size` ones), logged and reported to metrics backend
+    as `<metrics_prefix>_requests_total` and `<metrics_prefix>_request_seconds`.
+    """
+    timings_size = 1000
+    metrics_prefix = 'cbrf_api'
+
+    def __init__(self):
+        self.timings = deque(maxlen=self.timings_size)
+
+    def _open(self, url: str) -> tuple:
+        raise NotImplementedError
+
+    def open(self, url: str):
+        """ Request url and return file-like object with response body, it is read while downloaded
+
+        The request is timed until the body is read to the end or closed.
+        """
+        started = time.monotonic()
+        try:
+            status, body = self._open(url)
+        except Exception:
+            self._record(url, None, started)
+            raise
+        return _TimedBody(body, lambda: self._record(url, status, started))
+
+    def _record(self, url: str, status: int or None, started: float):
+        timing = RequestTiming(url=url, status=status, seconds=time.monotonic() - started)
+        self.timings.append(timing)
+        logger.debug("Request to {}: {} in {:.3f}s".format(url, status, timing.seconds))
+
+        metrics, endpoint = get_metrics(), get_script(url)
+        metrics.increment(self.metrics_prefix + '_requests_total', endpoint=endpoint, status=status or 'error')
+        metrics.observe(self.metrics_prefix + '_request_seconds', timing.seconds, endpoint=endpoint)
+
+    def get(self, url: str) -> bytes:
+        """ Request url and return the whole response body """
+        with closing(self.open(url)) as body:
+            return body.read()
+
+    async def aopen(self, url: str):
+        """ Async version of :meth open: """
+        return await sync_to_async(self.open, thread_sensitive=False)(url)
+
+    async def aget(self, url: str) -> bytes:
+        """ Async version of :meth get:, the body is read in a worker thread """
+        body = await self.aopen(url)
+        with closing(body):
+            return await sync_to_async(body.read, thread_sensitive=False)()
+
+
+class SessionTransport(BaseTransport):
+    """ Default transport: one keep-alive `requests.Session` with connection pool
+
+    Connection errors, read timeouts and 5xx responses are retried `retries` times with exponential
+    backoff (`backoff` * 2 ** attempt seconds).
+    """
+
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 retries: int = RETRIES, backoff: float = RETRY_BACKOFF, pool_size: int = POOL_SIZE):
+        super(SessionTransport, self).__init__()
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(const.CBRF_HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _open(self, url: str) -> tuple:
+        response = self.session.get(url, timeout=self.timeout, stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        response.raw.decode_content = True
+        return response.status_code, response.raw
+
+
+class MemoryTransport(BaseTransport):
+    """ In-memory fake of CBR API for tests
+
+        set_transport(MemoryTransport({'XML_daily.asp': DAILY_XML}))
+
+    :param responses: {script name: body}, body is bytes, str or callable receiving the url
+    """
+
+    def __init__(self, responses: dict):
+        super(MemoryTransport, self).__init__()
+        self.responses = responses
+        self.requests = []
+
+    def _open(self, url: str) -> tuple:
+        self.requests.append(url)
+        script = get_script(url)
+        if script not in self.responses:
+            raise requests.HTTPError("404 Client Error: Not Found for url: {}".format(url))
+
+        body = self.responses[script]
+        if callable(body):
+            body = body(url)
+        if not isinstance(body, bytes):
+            body = body.encode('windows-1251')
+        return 200, io.BytesIO(body)
+
+
+_transport = None
+_lock = threading.Lock()
+
+
+def get_transport() -> BaseTransport:
+    """ Get transport configured by ``settings.CBRF_TRANSPORT`` (created on the first call)
+
+    It is wrapped with :class django_cbrf.archive.ArchiveTransport: if ``settings.CBRF_ARCHIVE_PATH`` is set.
+    """
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                transport = import_string(TRANSPORT)()
+                if ARCHIVE_PATH is not None:
+                    from .archive import ArchiveTransport
+                    transport = ArchiveTransport(transport)
+                _transport = transport
+    return _transport
+
+
+def set_transport(transport: BaseTransport or None):
+    """ Replace transport of the process, None restores the configured one """
+    global _transport
+    with _lock:
+        _transport = transport
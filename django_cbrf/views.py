@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.http import HttpResponse, Http404
+
+from .metrics import get_metrics
+
+
+def metrics(request):
+    """ Export django_cbrf metrics in Prometheus text format
+
+        urlpatterns = [
+            path('metrics/cbrf', django_cbrf.views.metrics),
+        ]
+
+    Available if ``settings.CBRF_METRICS`` backend can render them, e.g. `PrometheusMetrics`.
+    """
+    backend = get_metrics()
+    if not hasattr(backend, 'render'):
+        raise Http404("Metrics are not collected")
+    return HttpResponse(backend.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
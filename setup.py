@@ -12,6 +12,9 @@ setup(
         "django>=3.1",
         "cbrf==1.0.0",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     url='https://github.com/Egregors/django-cbrf',
     license='MIT',
     author='Vadim Iskuchekov (@egregors)',
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarks of django_cbrf against a local fake CBR API (see fake_cbr.py)
+
+Every scenario runs in a transaction which is rolled back afterwards, so all repeats start from
+the same DB state. Dates are counted back from a fixed `--end-date`, data served by the fake API
+is generated deterministically, so results of different runs with the same options are comparable.
+
+For every scenario the median and the best wall time of `--repeats` runs, the number of DB queries
+and the peak memory allocated by Python (measured by an extra, not timed, run under tracemalloc)
+are reported.
+
+    python tests/benchmark.py --output before.json
+    python tests/benchmark.py --compare before.json
+"""
+from __future__ import unicode_literals, absolute_import
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BASE_DIR, os.path.dirname(BASE_DIR)]
+
+from fake_cbr import FakeCBR  # noqa: E402
+
+Scenario = namedtuple('Scenario', ['name', 'setup', 'run'])
+Result = namedtuple('Result', ['median', 'best', 'queries', 'peak_mib'])
+
+
+def _serve(currencies: int, connection):
+    server = FakeCBR(currencies).serve()
+    connection.send(server.server_port)
+    threading.Event().wait()
+
+
+def start_fake_server(currencies: int) -> int:
+    """ Run fake CBR API in a separate process, so it doesn't affect timings and memory, return its port """
+    parent, child = multiprocessing.Pipe()
+    multiprocessing.Process(target=_serve, args=(currencies, child), daemon=True).start()
+    return parent.recv()
+
+
+def get_scenarios(args) -> list:
+    from django.core.management import call_command
+    from django_cbrf.cache import rate_cache
+    from django_cbrf.utils import get_cbrf_model
+
+    Currency, Record = get_cbrf_model('Currency'), get_cbrf_model('Record')
+    end = args.end_date
+    begin = end - datetime.timedelta(days=365 * args.years)
+    year_ago = end - datetime.timedelta(days=365)
+
+    def currencies(count: int) -> list:
+        return list(Currency.objects.order_by('cbrf_id')[:count])
+
+    def lookups(currencies_list: list) -> list:
+        dates = [year_ago + datetime.timedelta(days=day) for day in range(366)]
+        dates = [date for date in dates if date.weekday() < 5]
+        return [(currencies_list[number % len(currencies_list)], dates[number * 7 % len(dates)])
+                for number in range(args.lookups)]
+
+    def with_currencies(count: int):
+        def setup():
+            Currency.populate(bulk=True)
+            return currencies(count)
+        return setup
+
+    def with_rates(cache: bool):
+        def setup():
+            Currency.populate(bulk=True)
+            loaded = currencies(args.load_currencies)
+            Record.populate_for_dates_many(year_ago, end, loaded)
+            rate_cache.enabled = cache
+            pairs = lookups(loaded)
+            if cache:
+                for currency, date in pairs:
+                    Record.get_for_date(currency, date)
+                    Record.get_latest_for_date(currency, date=date)
+            return pairs
+        return setup
+
+    def get_for_date(pairs):
+        for currency, date in pairs:
+            Record.get_for_date(currency, date)
+
+    def get_latest(pairs):
+        for currency, date in pairs:
+            Record.get_latest_for_date(currency, date=date)
+
+    return [
+        Scenario('currency_populate', lambda: None, lambda state: Currency.populate(bulk=True)),
+        Scenario('currency_populate_unchanged', with_currencies(0), lambda state: Currency.populate(bulk=True)),
+        Scenario('populate_for_dates', with_currencies(1),
+                 lambda loaded: Record.populate_for_dates(begin, end, loaded[0])),
+        Scenario('get_for_date_cold', with_rates(cache=False), get_for_date),
+        Scenario('get_for_date_hot', with_rates(cache=True), get_for_date),
+        Scenario('get_latest_cold', with_rates(cache=False), get_latest),
+        Scenario('get_latest_hot', with_rates(cache=True), get_latest),
+        Scenario('load_rates', with_currencies(args.load_currencies), lambda loaded: call_command(
+            'load_rates', *[currency.iso_char_code for currency in loaded], days=365, workers=args.workers)),
+    ]
+
+
+def measure(scenario: Scenario, repeats: int) -> Result:
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+    from django_cbrf.cache import rate_cache
+    from django_cbrf.registry import get_currency_registry
+
+    times, queries, peak = [], 0, 0
+    for run in range(repeats + 1):
+        traced = run == 0
+        with transaction.atomic():
+            get_currency_registry().invalidate()
+            rate_cache.clear()
+            enabled = rate_cache.enabled
+            state = scenario.setup()
+
+            if traced:
+                tracemalloc.start()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                scenario.run(state)
+                elapsed = time.perf_counter() - started
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                times.append(elapsed)
+            queries = len(context)
+
+            rate_cache.enabled = enabled
+            transaction.set_rollback(True)
+
+    return Result(median=statistics.median(times), best=min(times), queries=queries, peak_mib=peak / 2 ** 20)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help='Names of scenarios to run, all by default')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--currencies', type=int, default=300, help='Number of currencies served by fake API')
+    parser.add_argument('--years', type=int, default=10, help='Years of history for populate_for_dates')
+    parser.add_argument('--load-currencies', type=int, default=20,
+                        help='Number of currencies for lookups and load_rates')
+    parser.add_argument('--lookups', type=int, default=2000, help='Number of lookups in get_* scenarios')
+    parser.add_argument('--workers', type=int, default=4, help='load_rates --workers')
+    parser.add_argument('--end-date', type=lambda value: datetime.datetime.strptime(value, '%Y-%m-%d').date(),
+                        default=datetime.date(2024, 12, 31), help='Last date of loaded history, YYYY-MM-DD')
+    parser.add_argument('--output', help='Save results to JSON file')
+    parser.add_argument('--compare', help='Compare with results saved by --output')
+    args = parser.parse_args()
+
+    port = start_fake_server(args.currencies)
+    os.environ['CBRF_URL_SCHEME'] = 'http'
+    os.environ['CBRF_URL_HOST'] = '127.0.0.1:{}'.format(port)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+
+    import django
+    from django.conf import settings
+    from django.db import connection
+
+    django.setup()
+    settings.DEBUG = False
+    logging.disable(logging.CRITICAL)
+    connection.creation.create_test_db(verbosity=0)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print('{:<30} {:>10} {:>10} {:>8} {:>10} {:>9}'.format('scenario', 'median, s', 'best, s', 'queries',
+                                                          'peak, MiB', 'change'))
+    for scenario in get_scenarios(args):
+        if args.scenarios and scenario.name not in args.scenarios:
+            continue
+        result = measure(scenario, args.repeats)
+        results[scenario.name] = result._asdict()
+
+        change = ''
+        if scenario.name in baseline:
+            change = '{:+.1%}'.format(result.median / baseline[scenario.name]['median'] - 1)
+        print('{:<30} {:>10.4f} {:>10.4f} {:>8} {:>10.2f} {:>9}'.format(
+            scenario.name, result.median, result.best, result.queries, result.peak_mib, change))
+
+    if args.output:
+        options = {name: str(value) for name, value in vars(args).items() if name not in ('output', 'compare')}
+        with open(args.output, 'w') as f:
+            json.dump({
+                'options': options,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
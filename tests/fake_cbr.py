@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+""" Local fake of CBR API serving generated XML documents
+
+Currencies and rates are generated deterministically: the same `currencies` number always gives
+the same directory and the same rate for every (currency, date), rates are published on weekdays only.
+
+    python tests/fake_cbr.py --port 8000 --currencies 300
+
+    CBRF_URL_SCHEME=http CBRF_URL_HOST=127.0.0.1:8000 python manage.py load_rates USD
+"""
+from __future__ import unicode_literals, absolute_import
+
+import argparse
+import datetime
+import string
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import product
+from urllib.parse import urlsplit, parse_qs
+
+ENCODING = 'windows-1251'
+
+
+def generate_currencies(count: int) -> list:
+    """ Get [(cbrf_id, iso_num_code, iso_char_code, denomination), ...] with USD and EUR first """
+    currencies = [('R01235', 840, 'USD', 1), ('R01239', 978, 'EUR', 1)]
+    codes = (''.join(letters) for letters in product(string.ascii_uppercase, repeat=3))
+    for number, code in zip(range(len(currencies), count), codes):
+        currencies.append(('R{:05d}'.format(10000 + number), 100 + number, code, 10 ** (number % 3)))
+    return currencies[:count]
+
+
+def get_rate(cbrf_id: str, date: datetime.date) -> str:
+    """ Rate of the currency for the date as CBR formats it ('28,6200') """
+    seed = int(cbrf_id[1:])
+    value = 10 + seed % 90 + ((seed * 7919 + date.toordinal() * 31) % 10000) / 10000
+    return '{:.4f}'.format(value).replace('.', ',')
+
+
+def get_publication_date(date: datetime.date) -> datetime.date:
+    """ The last weekday on or before the date """
+    while date.weekday() >= 5:
+        date -= datetime.timedelta(days=1)
+    return date
+
+
+def parse_date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, '%d/%m/%Y').date()
+
+
+class FakeCBR(object):
+
+    def __init__(self, currencies: int = 300):
+        self.currencies = generate_currencies(currencies)
+        self.by_id = {currency[0]: currency for currency in self.currencies}
+        self.requests = 0
+
+    def currencies_info(self) -> str:
+        items = ''.join(
+            '<Item ID="{0}"><Name>Валюта {2}</Name><EngName>Currency {2}</EngName><Nominal>{3}</Nominal>'
+            '<ParentCode>{0}</ParentCode><ISO_Num_Code>{1}</ISO_Num_Code><ISO_Char_Code>{2}</ISO_Char_Code>'
+            '</Item>'.format(*currency)
+            for currency in self.currencies
+        )
+        return '<?xml version="1.0" encoding="{}"?><Valuta name="Foreign Currency Market Lib">{}</Valuta>'.format(
+            ENCODING, items)
+
+    def daily(self, date: datetime.date) -> str:
+        date = get_publication_date(date)
+        items = ''.join(
+            '<Valute ID="{0}"><NumCode>{1:03d}</NumCode><CharCode>{2}</CharCode><Nominal>{3}</Nominal>'
+            '<Name>Валюта {2}</Name><Value>{4}</Value></Valute>'.format(*currency, get_rate(currency[0], date))
+            for currency in self.currencies
+        )
+        return '<?xml version="1.0" encoding="{}"?><ValCurs Date="{:%d.%m.%Y}" name="Foreign Currency Market">' \
+               '{}</ValCurs>'.format(ENCODING, date, items)
+
+    def dynamic(self, date_begin: datetime.date, date_end: datetime.date, cbrf_id: str) -> str:
+        records, date = [], date_begin
+        currency = self.by_id.get(cbrf_id)
+        while currency and date <= date_end:
+            if date.weekday() < 5:
+                records.append('<Record Date="{:%d.%m.%Y}" Id="{}"><Nominal>{}</Nominal><Value>{}</Value>'
+                               '</Record>'.format(date, cbrf_id, currency[3], get_rate(cbrf_id, date)))
+            date += datetime.timedelta(days=1)
+        return '<?xml version="1.0" encoding="{}"?><ValCurs ID="{}" DateRange1="{:%d.%m.%Y}" ' \
+               'DateRange2="{:%d.%m.%Y}" name="Foreign Currency Market Dynamic">{}</ValCurs>'.format(
+                   ENCODING, cbrf_id, date_begin, date_end, ''.join(records))
+
+    def respond(self, url: str) -> str or None:
+        parts = urlsplit(url)
+        script, params = parts.path.rsplit('/', 1)[-1], {k: v[0] for k, v in parse_qs(parts.query).items()}
+        self.requests += 1
+
+        if script == 'XML_valFull.asp':
+            return self.currencies_info()
+        if script == 'XML_daily.asp':
+            return self.daily(parse_date(params['date_req']) if 'date_req' in params else datetime.date.today())
+        if script == 'XML_dynamic.asp':
+            return self.dynamic(parse_date(params['date_req1']), parse_date(params['date_req2']),
+                                params['VAL_NM_RQ'])
+        return None
+
+    def serve(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """ Start server in a daemon thread, the port is in `server.server_port` """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = fake.respond(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                body = body.encode(ENCODING)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml; charset={}'.format(ENCODING))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--currencies', type=int, default=300)
+    args = parser.parse_args()
+
+    fake_server = FakeCBR(args.currencies).serve(args.host, args.port)
+    print("Fake CBR API is listening on http://{}:{}".format(args.host, fake_server.server_port))
+    threading.Event().wait()
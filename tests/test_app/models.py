@@ -2,6 +2,7 @@ from django.db import models
 
 # Create your models here.
 from django_cbrf.abstract_models import AbstractCurrency, AbstractRecord
+from django_cbrf.querysets import ConvertibleManager
 
 
 class Currency(AbstractCurrency):
@@ -10,3 +11,15 @@ class Currency(AbstractCurrency):
 
 class Record(AbstractRecord):
     custom_field = models.CharField(max_length=8)
+
+    class Meta(AbstractRecord.Meta):
+        indexes = [models.Index(fields=['currency', '-date'], name='test_app_record_asof')]
+
+
+class Order(models.Model):
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE)
+    iso_char_code = models.CharField(max_length=3)
+    date = models.DateField()
+
+    objects = ConvertibleManager()
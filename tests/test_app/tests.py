@@ -1,21 +1,137 @@
+import contextlib
 import decimal
+import gzip
+import io
 import logging
-from datetime import datetime
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
 from decimal import Decimal
+from unittest import mock, skipIf
+from xml.etree.ElementTree import XML
 
-from django.core.management import call_command
-from django.db import IntegrityError
-from django.test import TestCase
+import django
+import requests
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command, CommandError
+from django.db.models import Sum
+from django.db import DatabaseError, IntegrityError
+from django.http import Http404
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
 
 from django_cbrf import settings
+from django_cbrf import conversion
+from django_cbrf.models import MissingRate, PublicationDate, RateCoverage
+from django_cbrf.archive import ArchiveTransport
+from django_cbrf.cache import rate_cache, shared_rate_cache
+from django_cbrf.matrix import RateMatrix, rate_matrix
+from django_cbrf.querysets import RateRow
+from django_cbrf.metrics import BaseMetrics, PrometheusMetrics, set_metrics
+from django_cbrf.streaming import iterparse_dynamic_rates, iter_batches
+from django_cbrf.transport import MemoryTransport, SessionTransport, set_transport
+from django_cbrf.refresh import BaseRefresher, ThreadRefresher, set_refresher
+from django_cbrf.registry import CurrencyInfo, get_currency_registry
 from django_cbrf.utils import get_cbrf_model
+from django_cbrf import views
+from test_app.models import Order
 
 Currency = get_cbrf_model('Currency')
 Record = get_cbrf_model('Record')
 
+CURRENCIES_XML = """<?xml version="1.0" encoding="windows-1251"?>
+<Valuta name="Foreign Currency Market Lib">
+    <Item ID="R01235">
+        <Name>Доллар США</Name>
+        <EngName>US Dollar</EngName>
+        <Nominal>1</Nominal>
+        <ParentCode>R01235    </ParentCode>
+        <ISO_Num_Code>840</ISO_Num_Code>
+        <ISO_Char_Code>USD</ISO_Char_Code>
+    </Item>
+    <Item ID="R01239">
+        <Name>Евро</Name>
+        <EngName>Euro</EngName>
+        <Nominal>1</Nominal>
+        <ParentCode>R01239    </ParentCode>
+        <ISO_Num_Code>978</ISO_Num_Code>
+        <ISO_Char_Code>EUR</ISO_Char_Code>
+    </Item>
+    <Item ID="R01500">
+        <Name>Молдавский лей</Name>
+        <EngName>Moldovan Leu</EngName>
+        <Nominal>10</Nominal>
+        <ParentCode>R01500    </ParentCode>
+        <ISO_Num_Code>498</ISO_Num_Code>
+        <ISO_Char_Code>MDL</ISO_Char_Code>
+    </Item>
+</Valuta>"""
+
+DAILY_XML = """<?xml version="1.0" encoding="windows-1251"?>
+<ValCurs Date="23.02.2017" name="Foreign Currency Market">
+    <Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode><Nominal>1</Nominal>
+        <Name>Доллар США</Name><Value>57,4762</Value></Valute>
+    <Valute ID="R01239"><NumCode>978</NumCode><CharCode>EUR</CharCode><Nominal>1</Nominal>
+        <Name>Евро</Name><Value>60,6569</Value></Valute>
+    <Valute ID="R01500"><NumCode>498</NumCode><CharCode>MDL</CharCode><Nominal>10</Nominal>
+        <Name>Молдавских леев</Name><Value>29,3372</Value></Valute>
+    <Valute ID="R09999"><NumCode>999</NumCode><CharCode>XXX</CharCode><Nominal>1</Nominal>
+        <Name>Неизвестная валюта</Name><Value>1,0000</Value></Valute>
+</ValCurs>"""
+
+DYNAMIC_USD_XML = """<?xml version="1.0" encoding="windows-1251"?>
+<ValCurs ID="R01235" DateRange1="02.03.2001" DateRange2="07.03.2001" name="Foreign Currency Market Dynamic">
+    <Record Date="02.03.2001" Id="R01235"><Nominal>1</Nominal><Value>28,6200</Value></Record>
+    <Record Date="03.03.2001" Id="R01235"><Nominal>1</Nominal><Value>28,6500</Value></Record>
+    <Record Date="06.03.2001" Id="R01235"><Nominal>1</Nominal><Value>28,6600</Value></Record>
+    <Record Date="07.03.2001" Id="R01235"><Nominal>1</Nominal><Value>28,6300</Value></Record>
+</ValCurs>"""
+
+
+def xml_stream(xml):
+    """ Fake of CBR API response body """
+    return lambda **kwargs: io.BytesIO(xml.encode('windows-1251'))
+
+
+@contextlib.contextmanager
+def capture_on_commit():
+    """ Collect `transaction.on_commit` callbacks of the block instead of running them on commit
+
+    Works on Django < 3.2, which has no `TestCase.captureOnCommitCallbacks`.
+    """
+    callbacks = []
+    with mock.patch('django.db.transaction.on_commit', lambda func, using=None: callbacks.append(func)):
+        yield callbacks
+
+
+class CurrenciesTestCase(TestCase):
+    """ Currencies from CURRENCIES_XML loaded without CBR API before every test """
+
+    def setUp(self):
+        # test transactions are never committed, so changed currencies don't drop the registry
+        self.addCleanup(get_currency_registry().invalidate)
+        logging.disable(logging.CRITICAL)
+        with mock.patch('django_cbrf.abstract_models.get_currencies_info', return_value=XML(CURRENCIES_XML)):
+            Currency.populate(bulk=True)
+        self.usd = Currency.objects.get(cbrf_id='R01235')
+        self.eur = Currency.objects.get(cbrf_id='R01239')
+        self.mdl = Currency.objects.get(cbrf_id='R01500')
+
+    def use_transport(self, documents: dict) -> MemoryTransport:
+        """ Answer CBR API requests of the test with given documents, see :class MemoryTransport: """
+        transport = MemoryTransport(documents)
+        set_transport(transport)
+        self.addCleanup(set_transport, None)
+        return transport
+
 
 class CBRFManagementCommandsTestCase(TestCase):
     def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
         logging.disable(logging.CRITICAL)
 
     def test_load_currencies(self):
@@ -57,6 +173,7 @@ class CBRFManagementCommandsTestCase(TestCase):
 
 class CurrencyTestCase(TestCase):
     def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
         Currency.populate()
         logging.disable(logging.CRITICAL)
 
@@ -90,6 +207,7 @@ class CurrencyTestCase(TestCase):
 
 class RecordsTestCase(TestCase):
     def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
         Currency.populate()
 
     def test_populate_for_dates(self):
@@ -160,6 +278,1231 @@ class RecordsTestCase(TestCase):
         self.assertEqual(record.value, decimal.Decimal("70.3375"))
 
 
+class CurrencyBulkPopulateTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
+        logging.disable(logging.CRITICAL)
+
+    @mock.patch('django_cbrf.abstract_models.get_currencies_info')
+    def test_bulk_populate(self, get_currencies_info):
+        get_currencies_info.return_value = XML(CURRENCIES_XML)
+
+        result = Currency.populate(bulk=True)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (3, 0, 0))
+        self.assertEqual(Currency.objects.get(cbrf_id='R01500').parent_code, 'R01500')
+
+        Currency.objects.filter(cbrf_id='R01500').update(denomination=1, name='Old name')
+        Currency.objects.filter(cbrf_id='R01239').delete()
+
+        result = Currency.populate(bulk=True)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (1, 1, 1))
+        self.assertEqual(Currency.objects.count(), 3)
+        mdl = Currency.objects.get(cbrf_id='R01500')
+        self.assertEqual((mdl.denomination, mdl.name), (10, 'Молдавский лей'))
+
+    @mock.patch('django_cbrf.abstract_models.get_currencies_info')
+    def test_load_currencies_uses_bulk(self, get_currencies_info):
+        get_currencies_info.return_value = XML(CURRENCIES_XML)
+
+        call_command('load_currencies')
+        self.assertEqual(Currency.objects.count(), 3)
+
+        with self.assertRaises(IntegrityError):
+            call_command('load_currencies')
+
+        Currency.objects.filter(cbrf_id='R01235').update(eng_name='Dollar')
+        call_command('load_currencies', '--force')
+        self.assertEqual(Currency.objects.get(cbrf_id='R01235').eng_name, 'US Dollar')
+
+
+class CurrencyRegistryTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(CurrencyRegistryTestCase, self).setUp()
+        self.registry = get_currency_registry()
+
+    def test_lookups(self):
+        self.registry.get_by_cbrf_id('R01235')
+
+        with self.assertNumQueries(0):
+            usd = self.registry.get_by_iso_char_code('usd')
+            self.assertIsInstance(usd, CurrencyInfo)
+            self.assertEqual(usd.cbrf_id, 'R01235')
+            self.assertEqual(self.registry.get_by_iso_num_code('978').iso_char_code, 'EUR')
+            self.assertEqual(self.registry.get_by_cbrf_id('r01500').denomination, 10)
+            self.assertIsNone(self.registry.get_by_iso_char_code('LOL'))
+
+            self.assertEqual(Currency.get_by_iso_char_code('Usd').pk, usd.pk)
+            self.assertEqual(Currency.get_by_cbrf_id('R01500').eng_name, 'Moldovan Leu')
+            self.assertIsNone(Currency.get_by_iso_num_code(999))
+
+        with self.assertRaises(AttributeError):
+            usd.name = 'meh'
+
+    def test_reload_on_change(self):
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'Euro')
+
+        eur = Currency.objects.get(iso_char_code='EUR')
+        eur.eng_name = 'European Euro'
+        with capture_on_commit() as callbacks:
+            eur.save()
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'Euro')
+        callbacks[0]()
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'European Euro')
+
+        with capture_on_commit() as callbacks:
+            eur.delete()
+        callbacks[0]()
+        self.assertIsNone(Currency.get_by_iso_char_code('EUR'))
+
+        with mock.patch('django_cbrf.abstract_models.get_currencies_info', return_value=XML(CURRENCIES_XML)), \
+                capture_on_commit() as callbacks:
+            Currency.populate(bulk=True)
+        callbacks[0]()
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'Euro')
+
+    def test_reload_after_ttl(self):
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'Euro')
+
+        Currency.objects.filter(iso_char_code='EUR').update(eng_name='European Euro')
+        self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'Euro')
+
+        with mock.patch('django_cbrf.registry.time.monotonic', return_value=time.monotonic() + self.registry.ttl):
+            self.assertFalse(self.registry.loaded)
+            self.assertEqual(self.registry.get_by_iso_char_code('EUR').eng_name, 'European Euro')
+
+    def test_model_instances(self):
+        Currency.objects.filter(cbrf_id='R01235').update(custom_field='custom')
+        usd = Currency.get_by_cbrf_id('R01235')
+        usd.eng_name = 'changed'
+
+        self.assertEqual(Currency.get_by_cbrf_id('R01235').eng_name, 'US Dollar')
+        with self.assertNumQueries(1):
+            self.assertEqual(usd.custom_field, 'custom')
+
+
+@mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML))
+class RecordsBulkPopulateTestCase(CurrenciesTestCase):
+    def test_populate_for_dates_counts(self):
+        date_1, date_2 = datetime(2001, 3, 2), datetime(2001, 3, 7)
+
+        result = Record.populate_for_dates(date_1, date_2, self.usd)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (4, 0, 0))
+
+        Record.objects.filter(date=datetime(2001, 3, 3)).delete()
+        Record.objects.filter(date=datetime(2001, 3, 6)).update(value=Decimal('1'))
+
+        with self.assertNumQueries(7):  # SELECT and INSERT of rates, SELECT of coverage; inside savepoints
+            result = Record.populate_for_dates(date_1, date_2, self.usd)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (1, 0, 3))
+        self.assertEqual(Record.objects.get(date=datetime(2001, 3, 6)).value, Decimal('1'))
+
+        result = Record.populate_for_dates(date_1, date_2, self.usd, update=True)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (0, 1, 3))
+        self.assertEqual(Record.objects.get(date=datetime(2001, 3, 6)).value, Decimal('28.6600'))
+
+    def test_populate_for_dates_queryset(self):
+        rates = Record._populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd)
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(rates.get(date=datetime(2001, 3, 3)).value, Decimal('28.6500'))
+
+
+@mock.patch('django_cbrf.abstract_models.get_daily_rates', lambda date=None: XML(DAILY_XML))
+class RecordsPopulateAllForDateTestCase(CurrenciesTestCase):
+    def test_populate_all_for_date(self):
+        result = Record.populate_all_for_date(datetime(2017, 2, 25))
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (3, 0, 0))
+        self.assertEqual(Record.objects.get(currency__iso_char_code='MDL').value, Decimal('29.3372'))
+        self.assertEqual(set(Record.objects.values_list('date', flat=True)), {datetime(2017, 2, 23).date()})
+
+        result = Record.populate_all_for_date(datetime(2017, 2, 25))
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (0, 0, 3))
+
+    def test_populate_for_date_all_currencies(self):
+        record = Record.populate_for_date(self.usd, datetime(2017, 2, 25), all_currencies=True)
+        self.assertEqual(record.value, Decimal('57.4762'))
+        self.assertEqual(Record.objects.count(), 3)
+
+    def test_missing_currency_policy(self):
+        with mock.patch('django_cbrf.abstract_models.MISSING_CURRENCY_POLICY', 'error'):
+            with self.assertRaisesMessage(ValueError, 'R09999'):
+                Record.populate_all_for_date()
+
+        with mock.patch('django_cbrf.abstract_models.MISSING_CURRENCY_POLICY', 'populate'), \
+                mock.patch('django_cbrf.abstract_models.get_currencies_info') as get_currencies_info:
+            get_currencies_info.return_value = XML(CURRENCIES_XML.replace('R01500', 'R09999'))
+            result = Record.populate_all_for_date()
+        self.assertEqual(result.inserted, 4)
+
+
+@mock.patch('django_cbrf.abstract_models.get_daily_rates', lambda date=None: XML(DAILY_XML))
+class RateCacheTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(RateCacheTestCase, self).setUp()
+        Record.objects.create(currency=self.usd, date=datetime(2017, 2, 23), value=Decimal('57.4762'))
+
+        rate_cache.clear()
+        patcher = mock.patch.object(rate_cache, 'enabled', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rate_cache.clear)
+
+    def test_get_for_date_cached(self):
+        date = datetime(2017, 2, 23)
+
+        record = Record.get_for_date(self.usd, date)
+        self.assertEqual(record.value, Decimal('57.4762'))
+        self.assertEqual((rate_cache.hits, rate_cache.misses), (0, 1))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Record.get_for_date(self.usd, date).pk, record.pk)
+        self.assertEqual((rate_cache.hits, rate_cache.misses), (1, 1))
+
+    def test_get_latest_for_date_cached(self):
+        date = datetime(2017, 2, 25)
+
+        record = Record.get_latest_for_date(self.usd, date=date)
+        self.assertEqual(record.date, datetime(2017, 2, 23).date())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Record.get_latest_for_date(self.usd, date=date).pk, record.pk)
+
+    def test_invalidated_on_populate(self):
+        date = datetime(2001, 3, 6)
+        Record.objects.create(currency=self.usd, date=date, value=Decimal('1'))
+
+        self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('1'))
+
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML)), \
+                capture_on_commit() as callbacks:
+            Record.populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd, update=True)
+            self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('1'))
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('28.6600'))
+
+    def test_lru_eviction(self):
+        with mock.patch.object(rate_cache, 'size', 2):
+            for day in (1, 2, 3):
+                rate_cache.set('kind', 'R01235', datetime(2001, 3, day).date(), day)
+
+            self.assertIsNone(rate_cache.get('kind', 'R01235', datetime(2001, 3, 1).date()))
+            self.assertEqual(rate_cache.get('kind', 'R01235', datetime(2001, 3, 3).date()), 3)
+
+
+class SharedRateCacheTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(SharedRateCacheTestCase, self).setUp()
+        patcher = mock.patch.object(shared_rate_cache, 'alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shared_rate_cache.cache.clear)
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML))
+    def test_get_for_dates_read_through(self):
+        date_1, date_2 = datetime(2001, 3, 2), datetime(2001, 3, 7)
+
+        rates = Record.get_for_dates(date_1, date_2, self.usd)
+        self.assertEqual(len(rates), 4)
+
+        with self.assertNumQueries(0):
+            cached = Record.get_for_dates(date_1, date_2, self.usd)
+        self.assertEqual([(rate.pk, rate.date, rate.value) for rate in cached],
+                         [(rate.pk, rate.date, rate.value) for rate in rates])
+        self.assertEqual(cached[0].custom_field, '')
+
+    def test_get_for_date_versioned(self):
+        date = datetime(2001, 3, 6)
+        Record.objects.create(currency=self.usd, date=date, value=Decimal('1'))
+
+        self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('1'))
+        with self.assertNumQueries(0):
+            self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('1'))
+
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML)), \
+                capture_on_commit() as callbacks:
+            Record.populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd, update=True)
+            self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('1'))
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Record.get_for_date(self.usd, date).value, Decimal('28.6600'))
+
+
+class RecordsGetManyTestCase(CurrenciesTestCase):
+    def test_get_many_from_db(self):
+        dates = [datetime(2001, 3, 2), datetime(2001, 3, 3)]
+        for currency in (self.usd, self.eur):
+            for date in dates:
+                Record.objects.create(currency=currency, date=date, value=Decimal('1'))
+
+        with self.assertNumQueries(1):
+            rates = Record.get_many([self.usd, self.eur], dates)
+
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(rates[(self.eur, datetime(2001, 3, 3).date())].value, Decimal('1'))
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates')
+    def test_get_many_dynamic_misses(self, get_dynamic_rates):
+        get_dynamic_rates.side_effect = xml_stream(DYNAMIC_USD_XML)
+        dates = [datetime(2001, 3, 2), datetime(2001, 3, 5), datetime(2001, 3, 7)]
+
+        rates = Record.get_many([self.usd], dates)
+
+        get_dynamic_rates.assert_called_once_with(
+            date_req1=datetime(2001, 3, 2).date(), date_req2=datetime(2001, 3, 7).date(), currency_id='R01235')
+        self.assertEqual(rates[(self.usd, datetime(2001, 3, 7).date())].value, Decimal('28.6300'))
+        self.assertIsNone(rates[(self.usd, datetime(2001, 3, 5).date())])
+
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates')
+    def test_get_many_daily_misses(self, get_daily_rates):
+        get_daily_rates.return_value = XML(DAILY_XML)
+        date = datetime(2017, 2, 23).date()
+        mdl = get_currency_registry().get_by_iso_char_code('MDL')
+
+        rates = Record.get_many([self.usd, self.eur, mdl], [date])
+
+        get_daily_rates.assert_called_once_with(date)
+        self.assertEqual(rates[(self.eur, date)].value, Decimal('60.6569'))
+        self.assertEqual(rates[(mdl, date)].value, Decimal('29.3372'))
+
+
+class RecordsGapsTestCase(CurrenciesTestCase):
+    def test_coverage_gaps(self):
+        day = lambda n: datetime(2001, 3, n).date()  # noqa: E731
+        RateCoverage.add('test_app.record', 'R01235', day(5), day(6))
+        RateCoverage.add('test_app.record', 'R01235', day(7), day(8))
+        RateCoverage.add('test_app.record', 'R01235', day(20), day(21))
+        self.assertEqual(RateCoverage.objects.count(), 2)
+
+        self.assertEqual(RateCoverage.get_gaps('test_app.record', 'R01235', day(1), day(25)),
+                         [(day(1), day(4)), (day(9), day(19)), (day(22), day(25))])
+        self.assertEqual(RateCoverage.get_gaps('test_app.record', 'R01235', day(1), day(25), merge_days=2),
+                         [(day(1), day(4)), (day(9), day(25))])
+        self.assertEqual(RateCoverage.get_gaps('test_app.record', 'R01235', day(6), day(7)), [])
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates')
+    def test_get_for_dates_fetches_gaps_only(self, get_dynamic_rates):
+        get_dynamic_rates.side_effect = xml_stream(DYNAMIC_USD_XML)
+
+        rates = Record.get_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd)
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(get_dynamic_rates.call_count, 1)
+
+        # already fetched range, even if there are no rates for some dates
+        Record.get_for_dates(datetime(2001, 3, 4), datetime(2001, 3, 5), self.usd)
+        self.assertEqual(get_dynamic_rates.call_count, 1)
+
+        Record.get_for_dates(datetime(2001, 3, 1), datetime(2001, 3, 9), self.usd)
+        self.assertEqual(get_dynamic_rates.call_count, 2)
+        get_dynamic_rates.assert_called_with(
+            date_req1=datetime(2001, 3, 1).date(), date_req2=datetime(2001, 3, 9).date(), currency_id='R01235')
+
+        with mock.patch('django_cbrf.abstract_models.GAP_MERGE_DAYS', 0):
+            Record.get_for_dates(datetime(2001, 2, 27), datetime(2001, 3, 11), self.usd)
+        get_dynamic_rates.assert_has_calls([
+            mock.call(date_req1=datetime(2001, 2, 27).date(), date_req2=datetime(2001, 2, 28).date(),
+                      currency_id='R01235'),
+            mock.call(date_req1=datetime(2001, 3, 10).date(), date_req2=datetime(2001, 3, 11).date(),
+                      currency_id='R01235'),
+        ])
+
+
+class LoadRatesWorkersTestCase(CurrenciesTestCase):
+    @staticmethod
+    def get_dynamic_rates(date_req1, date_req2, currency_id):
+        if currency_id == 'R01500':
+            raise ConnectionError('timeout')
+        return xml_stream(DYNAMIC_USD_XML.replace('R01235', currency_id))()
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates')
+    def test_workers(self, get_dynamic_rates):
+        get_dynamic_rates.side_effect = self.get_dynamic_rates
+
+        with self.assertRaisesMessage(CommandError, 'MDL'):
+            call_command('load_rates', 'usd', 'mdl', 'eur', '--workers', '3')
+
+        self.assertEqual(get_dynamic_rates.call_count, 3)
+        self.assertEqual(Record.objects.filter(currency__iso_char_code='USD').count(), 4)
+        self.assertEqual(Record.objects.filter(currency__iso_char_code='EUR').count(), 4)
+        self.assertFalse(Record.objects.filter(currency__iso_char_code='MDL').exists())
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates')
+    def test_populate_for_dates_many(self, get_dynamic_rates):
+        get_dynamic_rates.side_effect = self.get_dynamic_rates
+        usd, mdl = Currency.get_by_iso_char_code('USD'), Currency.get_by_iso_char_code('MDL')
+
+        results = Record.populate_for_dates_many(datetime(2001, 3, 2), datetime(2001, 3, 7), [usd, mdl])
+
+        self.assertEqual(results[usd].inserted, 4)
+        self.assertIsInstance(results[mdl], ConnectionError)
+
+
+@skipIf(django.VERSION < (4, 1), 'async ORM requires Django 4.1')
+class AsyncApiTestCase(CurrenciesTestCase):
+    @mock.patch('django_cbrf.abstract_models.aget_daily_rates', new_callable=mock.AsyncMock)
+    async def test_aget_for_date(self, aget_daily_rates):
+        aget_daily_rates.return_value = XML(DAILY_XML)
+
+        usd = await Currency.aget_by_iso_char_code('usd')
+        self.assertEqual(usd.cbrf_id, 'R01235')
+
+        record = await Record.aget_for_date(usd, datetime(2017, 2, 23))
+        self.assertEqual(record.value, Decimal('57.4762'))
+        aget_daily_rates.assert_awaited_once()
+
+        record = await Record.aget_for_date(usd, datetime(2017, 2, 23))
+        self.assertEqual(record.value, Decimal('57.4762'))
+        aget_daily_rates.assert_awaited_once()
+
+        latest = await Record.aget_latest_for_date(usd, date=datetime(2017, 2, 25))
+        self.assertEqual(latest.date, datetime(2017, 2, 23).date())
+
+    async def test_transport(self):
+        transport = MemoryTransport({'XML_daily.asp': DAILY_XML})
+        set_transport(transport)
+        self.addCleanup(set_transport, None)
+
+        record = await Record.aget_for_date(self.usd, datetime(2017, 2, 23))
+
+        self.assertEqual(record.value, Decimal('57.4762'))
+        self.assertEqual(transport.requests, ['https://www.cbr.ru/scripts/XML_daily.asp?date_req=23/02/2017'])
+        self.assertEqual(transport.timings[-1].status, 200)
+
+    @mock.patch('django_cbrf.abstract_models.aget_dynamic_rates', new_callable=mock.AsyncMock)
+    async def test_aget_for_dates_and_many(self, aget_dynamic_rates):
+        aget_dynamic_rates.side_effect = lambda date_req1, date_req2, currency_id: XML(
+            DYNAMIC_USD_XML.replace('R01235', currency_id))
+        eur = await Currency.aget_by_iso_char_code('EUR')
+
+        rates = await Record.aget_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd)
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(aget_dynamic_rates.await_count, 1)
+
+        rates = await Record.aget_many([self.usd, eur], [datetime(2001, 3, 6), datetime(2001, 3, 7)])
+        self.assertEqual(aget_dynamic_rates.await_count, 2)
+        self.assertEqual(rates[(eur, datetime(2001, 3, 7).date())].value, Decimal('28.6300'))
+        self.assertEqual(rates[(self.usd, datetime(2001, 3, 6).date())].value, Decimal('28.6600'))
+
+
+class AsyncApiDjangoVersionTestCase(TestCase):
+    @mock.patch('django_cbrf.abstract_models.ASYNC_ORM', False)
+    def test_old_django(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'Django 4.1'):
+            async_to_sync(Currency.aget_by_iso_char_code)('USD')
+
+
+@mock.patch('django_cbrf.abstract_models.get_daily_rates', lambda date=None: XML(DAILY_XML))
+class ConversionTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(ConversionTestCase, self).setUp()
+        for cbrf_id, value in (('R01235', '57.4762'), ('R01239', '60.6569'), ('R01500', '29.3372')):
+            Record.objects.create(currency=Currency.objects.get(cbrf_id=cbrf_id), date=datetime(2017, 2, 23),
+                                  value=Decimal(value))
+        self.date = datetime(2017, 2, 25).date()
+
+    def test_convert(self):
+        self.assertEqual(conversion.convert(10, 'usd', 'RUB', self.date), Decimal('574.762'))
+        self.assertEqual(conversion.convert(100, 'RUB', 'MDL', self.date), Decimal(100) / Decimal('2.93372'))
+        self.assertEqual(conversion.convert(1, 'USD', 'EUR', self.date), Decimal('57.4762') / Decimal('60.6569'))
+        self.assertEqual(conversion.convert('5.5', 'EUR', 'EUR', self.date), Decimal('5.5'))
+
+        with self.assertRaises(ValueError):
+            conversion.convert(1, 'LOL', 'RUB', self.date)
+
+    def test_convert_many_exact(self):
+        rows = [(10, 'USD', 'RUB', self.date), (100, 'RUB', 'MDL', self.date), (1, 'usd', 'eur', self.date)]
+        get_currency_registry().load()
+
+        with self.assertNumQueries(1):
+            result = conversion.convert_many(rows, exact=True)
+
+        self.assertEqual(result, [conversion.convert(*row) for row in rows])
+
+        with self.assertRaises(ValueError):
+            conversion.convert_many([(1, 'USD', 'RUB', datetime(2017, 2, 22))])
+        with self.assertRaises(ValueError):
+            conversion.convert_many([(1, 'USD', 'RUB', datetime(2017, 4, 1))])
+
+    def test_convert_many_same_currency(self):
+        rows = [(10, 'USD', 'usd', datetime(2001, 1, 1)), (5, 'XXX', 'XXX', self.date), (10, 'USD', 'RUB', self.date)]
+        self.assertEqual(conversion.convert_many(rows, exact=True), [conversion.convert(*row) for row in rows])
+
+        if conversion.numpy is not None:
+            self.assertEqual(list(conversion.convert_many(rows[:2])), [10.0, 5.0])
+
+    @skipIf(conversion.numpy is None, 'numpy is not installed')
+    def test_convert_many_numpy(self):
+        rows = [(10, 'USD', 'RUB', self.date), (100, 'RUB', 'MDL', self.date)] * 1000
+
+        result = conversion.convert_many(rows)
+
+        self.assertEqual(result.shape, (2000,))
+        self.assertAlmostEqual(result[0], 574.762)
+        self.assertAlmostEqual(result[-1], 100 / 2.93372)
+
+
+class AnnotateConvertedTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(AnnotateConvertedTestCase, self).setUp()
+        usd, eur, mdl = self.usd, self.eur, self.mdl
+        for currency, date, value in ((usd, datetime(2017, 2, 22), '57.0000'), (usd, datetime(2017, 2, 23), '57.4762'),
+                                      (eur, datetime(2017, 2, 23), '60.6569'), (mdl, datetime(2017, 2, 23), '29.0000')):
+            Record.objects.create(currency=currency, date=date, value=Decimal(value))
+
+        Order.objects.create(amount=Decimal('10'), currency=usd, iso_char_code='USD', date=datetime(2017, 2, 22))
+        Order.objects.create(amount=Decimal('10'), currency=usd, iso_char_code='USD', date=datetime(2017, 2, 25))
+        Order.objects.create(amount=Decimal('100'), currency=mdl, iso_char_code='MDL', date=datetime(2017, 2, 23))
+        Order.objects.create(amount=Decimal('10'), currency=eur, iso_char_code='EUR', date=datetime(2017, 2, 21))
+
+    def test_annotate_converted(self):
+        orders = Order.objects.annotate_converted('amount', 'currency', 'date').order_by('-converted_amount')
+
+        self.assertEqual([(order.amount, order.converted_amount) for order in orders], [
+            (Decimal('10'), Decimal('574.762')),
+            (Decimal('10'), Decimal('570')),
+            (Decimal('100'), Decimal('290')),
+            (Decimal('10'), None),
+        ])
+        self.assertEqual(orders.aggregate(total=Sum('converted_amount'))['total'], Decimal('1434.762'))
+
+    def test_annotate_converted_iso_code_cross_rate(self):
+        orders = Order.objects.filter(iso_char_code='MDL').annotate_converted(
+            'amount', 'iso_char_code', 'date', to='usd', amount_name='usd_amount')
+
+        self.assertAlmostEqual(float(orders.get().usd_amount), 290 / 57.4762, places=6)
+
+
+class AsOfTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(AsOfTestCase, self).setUp()
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML)):
+            Record.populate_for_dates(datetime(2001, 3, 1), datetime(2001, 3, 10), self.usd)
+
+    def test_asof_index(self):
+        self.assertIn(['currency', '-date'], [index.fields for index in Record._meta.indexes])
+
+    def test_get_latest_many(self):
+        day = lambda n: datetime(2001, 3, n).date()  # noqa: E731
+
+        with self.assertNumQueries(1):
+            rates = Record.get_latest_many([(self.usd, day(1)), (self.usd, day(5)), (self.usd, day(10)),
+                                            (self.usd, day(3)), (self.eur, day(5))])
+
+        self.assertIsNone(rates[(self.usd, day(1))])
+        self.assertEqual(rates[(self.usd, day(3))].value, Decimal('28.6500'))
+        self.assertEqual(rates[(self.usd, day(5))].value, Decimal('28.6500'))
+        self.assertEqual(rates[(self.usd, day(10))].value, Decimal('28.6300'))
+        self.assertIsNone(rates[(self.eur, day(5))])
+
+        with self.assertNumQueries(2):
+            rates = Record.get_latest_many([(self.usd, day(n)) for n in range(2, 8)], batch_size=3)
+        self.assertEqual(len({record.pk for record in rates.values()}), 4)
+
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates')
+    def test_get_latest_for_date_skips_non_publication_days(self, get_daily_rates):
+        record = Record.get_latest_for_date(self.usd, date=datetime(2001, 3, 5))
+
+        self.assertEqual(record.date, datetime(2001, 3, 3).date())
+        get_daily_rates.assert_not_called()
+
+
+class RateMatrixTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(RateMatrixTestCase, self).setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rates.bin')
+
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML)):
+            Record.populate_for_dates(datetime(2001, 3, 1), datetime(2001, 3, 10), self.usd)
+
+    def test_lookups(self):
+        matrix = RateMatrix(self.path)
+        self.assertIsNone(matrix.get('R01235', datetime(2001, 3, 2)))
+        self.assertEqual(matrix.build(), 6)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(matrix.get('R01235', datetime(2001, 3, 2)), Decimal('28.6200'))
+            self.assertIsNone(matrix.get('R01235', datetime(2001, 3, 4)))
+            self.assertIsNone(matrix.get('R01239', datetime(2001, 3, 2)))
+
+            self.assertEqual(matrix.get_latest('R01235', datetime(2001, 3, 5)),
+                             (datetime(2001, 3, 3).date(), Decimal('28.6500')))
+            self.assertEqual(matrix.get_latest('R01235', datetime(2001, 3, 20))[0], datetime(2001, 3, 7).date())
+            self.assertIsNone(matrix.get_latest('R01235', datetime(2001, 3, 20), lookback_days=7))
+            self.assertIsNone(matrix.get_latest('R01235', datetime(2001, 3, 1)))
+            self.assertEqual(matrix.get_unit_rate('usd', datetime(2001, 3, 4)), Decimal('28.6500'))
+
+    def test_update(self):
+        matrix = RateMatrix(self.path)
+        matrix.build()
+
+        Record.objects.create(currency=self.mdl, date=datetime(2001, 3, 5), value=Decimal('22.5000'))
+        Record.objects.create(currency=self.usd, date=datetime(2001, 3, 9), value=Decimal('28.7000'))
+        self.assertEqual(matrix.update(datetime(2001, 3, 5)), 8)
+
+        self.assertEqual(matrix.get('R01500', datetime(2001, 3, 5)), Decimal('22.5000'))
+        self.assertEqual(matrix.get_unit_rate('MDL', datetime(2001, 3, 6)), Decimal('2.25'))
+        self.assertEqual(matrix.get('R01235', datetime(2001, 3, 2)), Decimal('28.6200'))
+        self.assertEqual(matrix.get_latest('R01235', datetime(2001, 3, 8))[1], Decimal('28.6300'))
+        self.assertEqual(matrix.get_latest('R01235', datetime(2001, 3, 9))[1], Decimal('28.7000'))
+
+    def test_readers_pick_up_new_version(self):
+        writer, reader = RateMatrix(self.path), RateMatrix(self.path, check_interval=0)
+        writer.build()
+        self.assertIsNone(reader.get('R01235', datetime(2001, 3, 9)))
+
+        Record.objects.create(currency=self.usd, date=datetime(2001, 3, 9), value=Decimal('28.7000'))
+        writer.update(datetime(2001, 3, 9))
+        self.assertEqual(reader.get('R01235', datetime(2001, 3, 9)), Decimal('28.7000'))
+
+    def test_updated_after_populate(self):
+        with mock.patch.object(rate_matrix, 'path', self.path):
+            call_command('build_rate_matrix')
+            self.assertIsNone(rate_matrix.get('R01235', datetime(2017, 2, 23)))
+
+            with mock.patch('django_cbrf.abstract_models.get_daily_rates', return_value=XML(DAILY_XML)), \
+                    capture_on_commit() as callbacks:
+                Record.populate_all_for_date(datetime(2017, 2, 23))
+                self.assertIsNone(rate_matrix.get('R01235', datetime(2017, 2, 23)))
+
+            for callback in callbacks:
+                callback()
+            self.assertEqual(rate_matrix.get('R01235', datetime(2017, 2, 23)), Decimal('57.4762'))
+            self.assertEqual(rate_matrix.get_latest('R01235', datetime(2001, 3, 4))[1], Decimal('28.6500'))
+
+    def test_one_update_per_call(self):
+        with mock.patch.object(rate_matrix, 'path', self.path), \
+                mock.patch.object(rate_matrix, 'update') as update, \
+                mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML)), \
+                capture_on_commit() as callbacks:
+            Record.populate_for_dates_many(datetime(2001, 3, 1), datetime(2001, 3, 10), [self.usd, self.mdl],
+                                           update=True)
+            for callback in callbacks:
+                callback()
+        update.assert_called_once_with(datetime(2001, 3, 2).date())
+
+    def test_failed_update_is_retried(self):
+        with mock.patch.object(rate_matrix, 'path', self.path), \
+                mock.patch.object(rate_matrix, 'update', side_effect=[DatabaseError('gone'), 8]) as update, \
+                capture_on_commit() as callbacks:
+            Record.objects.create(currency=self.mdl, date=datetime(2001, 3, 5), value=Decimal('22.5000'))
+            Record._rates_changed(['R01500'], datetime(2001, 3, 5).date())
+            for callback in callbacks:
+                callback()
+            callbacks.clear()
+
+            Record._rates_changed(['R01500'], datetime(2001, 3, 8).date())
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(update.call_args_list, [mock.call(datetime(2001, 3, 5).date())] * 2)
+
+    def test_command_requires_path(self):
+        with self.assertRaises(CommandError):
+            call_command('build_rate_matrix')
+
+
+class StreamingTestCase(CurrenciesTestCase):
+    def test_iterparse_dynamic_rates(self):
+        rates = iterparse_dynamic_rates(xml_stream(DYNAMIC_USD_XML)())
+
+        self.assertEqual(next(rates), (datetime(2001, 3, 2).date(), Decimal('28.6200')))
+        self.assertEqual([date.day for date, _value in rates], [3, 6, 7])
+        self.assertEqual(list(iterparse_dynamic_rates(xml_stream('<ValCurs ID="R01235"/>')())), [])
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates', xml_stream(DYNAMIC_USD_XML))
+    def test_write_stream_in_batches(self):
+        rows = Record._iter_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), self.usd)
+
+        with mock.patch.object(Record, '_bulk_write', wraps=Record._bulk_write) as bulk_write:
+            result = Record._write_stream(rows, batch_size=3)
+
+        self.assertEqual(result, (4, 0, 0))
+        self.assertEqual([len(call.args[0]) for call in bulk_write.call_args_list], [3, 1])
+        self.assertEqual(Record.objects.filter(currency=self.usd).count(), 4)
+
+
+class BackfillTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(BackfillTestCase, self).setUp()
+        self.requests = []
+        self.broken = set()
+
+    def open_dynamic_rates(self, date_req1, date_req2, currency_id):
+        self.requests.append((currency_id, date_req1, date_req2))
+        if (currency_id, date_req1) in self.broken:
+            raise ConnectionError('timeout')
+
+        records, day = [], date_req1
+        while day <= date_req2:
+            records.append('<Record Date="{:%d.%m.%Y}" Id="{}"><Nominal>1</Nominal><Value>30,{:04d}</Value>'
+                           '</Record>'.format(day, currency_id, day.day))
+            day += timedelta(days=1)
+        return xml_stream('<ValCurs ID="{}">{}</ValCurs>'.format(currency_id, ''.join(records)))()
+
+    def test_split_range(self):
+        self.assertEqual(Record._split_range(datetime(2001, 1, 1).date(), datetime(2001, 1, 25).date(), 10), [
+            (datetime(2001, 1, 1).date(), datetime(2001, 1, 10).date()),
+            (datetime(2001, 1, 11).date(), datetime(2001, 1, 20).date()),
+            (datetime(2001, 1, 21).date(), datetime(2001, 1, 25).date()),
+        ])
+
+    def test_resume(self):
+        self.broken.add(('R01235', datetime(2001, 1, 11).date()))
+
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', self.open_dynamic_rates):
+            with self.assertRaisesMessage(CommandError, 'USD'):
+                call_command('backfill_rates', 'usd', '--since', '2001-01-01', '--until', '2001-01-25',
+                             '--chunk-days', '10')
+            self.assertEqual(len(self.requests), 3)
+            self.assertEqual(Record.objects.filter(currency=self.usd).count(), 15)
+
+            self.broken.clear()
+            self.requests.clear()
+            call_command('backfill_rates', 'usd', '--since', '2001-01-01', '--until', '2001-01-25',
+                         '--chunk-days', '10')
+
+        self.assertEqual(self.requests, [('R01235', datetime(2001, 1, 11).date(), datetime(2001, 1, 20).date())])
+        self.assertEqual(Record.objects.filter(currency=self.usd).count(), 25)
+
+    def test_workers_and_progress(self):
+        progress = mock.Mock()
+
+        with mock.patch('django_cbrf.streaming.open_dynamic_rates', self.open_dynamic_rates):
+            results = Record.backfill(datetime(2001, 1, 1).date(), datetime(2001, 3, 31).date(), [self.usd, self.eur],
+                                      chunk_days=30, workers=2, progress=progress)
+
+        self.assertEqual(results[self.usd], (90, 0, 0))
+        self.assertEqual(results[self.eur], (90, 0, 0))
+        self.assertEqual(len(self.requests), 6)
+        self.assertEqual(progress.call_count, 6)
+        self.assertEqual(progress.call_args.args[0][:3], (6, 6, 180))
+
+
+class SyncTestCase(CurrenciesTestCase):
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates', return_value=XML(DAILY_XML))
+    def test_sync_daily(self, get_daily_rates):
+        Record.objects.create(currency=self.usd, date=datetime(2017, 2, 22), value=Decimal('57'))
+        Record.objects.create(currency=self.eur, date=datetime(2017, 2, 22), value=Decimal('60'))
+
+        with mock.patch.object(Record, '_bulk_write', wraps=Record._bulk_write) as bulk_write:
+            results = Record.sync(date_end=datetime(2017, 2, 23))
+
+        get_daily_rates.assert_called_once_with(datetime(2017, 2, 23).date())
+        self.assertEqual(bulk_write.call_count, 1)
+        self.assertEqual(results, {self.usd: (1, 0, 0), self.eur: (1, 0, 0)})
+        self.assertEqual(Record.objects.get(currency=self.eur, date=datetime(2017, 2, 23)).value,
+                         Decimal('60.6569'))
+        self.assertFalse(Record.objects.filter(currency__cbrf_id='R01500').exists())
+
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates')
+    def test_sync_daily_failed_day(self, get_daily_rates):
+        get_daily_rates.side_effect = [OSError('timeout'), XML(DAILY_XML)]
+        Record.objects.create(currency=self.usd, date=datetime(2017, 2, 22), value=Decimal('57'))
+        Record.objects.create(currency=self.eur, date=datetime(2017, 2, 21), value=Decimal('60'))
+        Record.objects.create(currency=self.mdl, date=datetime(2017, 2, 21), value=Decimal('3'))
+
+        results = Record.sync(date_end=datetime(2017, 2, 23))
+
+        self.assertEqual(get_daily_rates.call_count, 2)
+        self.assertEqual(results[self.usd], (1, 0, 0))
+        self.assertIsInstance(results[self.eur], OSError)
+        self.assertIsInstance(results[self.mdl], OSError)
+        self.assertFalse(Record.objects.filter(currency=self.eur, date=datetime(2017, 2, 23)).exists())
+
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates')
+    def test_sync_daily_writes_loaded_days(self, get_daily_rates):
+        get_daily_rates.side_effect = [XML(DAILY_XML), OSError('timeout')]
+        for currency in (self.usd, self.eur, self.mdl):
+            Record.objects.create(currency=currency, date=datetime(2017, 2, 21), value=Decimal('1'))
+
+        results = Record.sync(date_end=datetime(2017, 2, 23))
+
+        self.assertTrue(all(isinstance(result, OSError) for result in results.values()))
+        self.assertEqual(Record.objects.get(currency=self.usd, date=datetime(2017, 2, 23)).value,
+                         Decimal('57.4762'))
+
+    @mock.patch('django_cbrf.streaming.open_dynamic_rates')
+    def test_sync_dynamic(self, open_dynamic_rates):
+        open_dynamic_rates.side_effect = xml_stream(DYNAMIC_USD_XML)
+        Record.objects.create(currency=self.usd, date=datetime(2001, 3, 1), value=Decimal('28'))
+
+        results = Record.sync([self.usd, self.eur], date_end=datetime(2001, 3, 7), days=10)
+
+        self.assertEqual(open_dynamic_rates.call_count, 2)
+        open_dynamic_rates.assert_any_call(date_req1=datetime(2001, 3, 2).date(),
+                                           date_req2=datetime(2001, 3, 7).date(), currency_id='R01235')
+        open_dynamic_rates.assert_any_call(date_req1=datetime(2001, 2, 25).date(),
+                                           date_req2=datetime(2001, 3, 7).date(), currency_id='R01239')
+        self.assertEqual(results[self.usd].inserted, 4)
+
+    @mock.patch('django_cbrf.abstract_models.get_daily_rates')
+    def test_command_up_to_date(self, get_daily_rates):
+        Record.objects.create(currency=self.usd, date=datetime.today(), value=Decimal('57'))
+
+        call_command('sync_rates', '--all')
+
+        get_daily_rates.assert_not_called()
+        with self.assertRaises(CommandError):
+            call_command('sync_rates')
+
+
+class TransportTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
+        logging.disable(logging.CRITICAL)
+        self.transport = MemoryTransport({
+            'XML_valFull.asp': CURRENCIES_XML,
+            'XML_daily.asp': DAILY_XML,
+            'XML_dynamic.asp': DYNAMIC_USD_XML,
+        })
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+
+    def test_memory_transport(self):
+        Currency.populate(bulk=True)
+        usd = Currency.get_by_iso_char_code('USD')
+        Record.populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), usd)
+        Record.populate_for_date(usd, datetime(2017, 2, 23))
+
+        self.assertEqual(Record.objects.filter(currency=usd).count(), 5)
+        self.assertEqual([url.split('?')[0].rsplit('/', 1)[1] for url in self.transport.requests],
+                         ['XML_valFull.asp', 'XML_dynamic.asp', 'XML_daily.asp'])
+        self.assertTrue(self.transport.requests[1].endswith(
+            'XML_dynamic.asp?date_req1=02/03/2001&date_req2=07/03/2001&VAL_NM_RQ=R01235'))
+        self.assertEqual([timing.status for timing in self.transport.timings], [200, 200, 200])
+
+    def test_session_transport_retries(self):
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(503 if len(hits) == 1 else 200)
+                self.end_headers()
+                self.wfile.write(DAILY_XML.encode('windows-1251'))
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        transport = SessionTransport(retries=2, backoff=0, read_timeout=5)
+        body = transport.get('http://127.0.0.1:{}/scripts/XML_daily.asp?'.format(server.server_port))
+
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(XML(body).attrib['Date'], '23.02.2017')
+        self.assertEqual(len(transport.timings), 1)
+        self.assertEqual(transport.timings[0].status, 200)
+
+
+    def test_timing_includes_body(self):
+        body = self.transport.open('https://www.cbr.ru/scripts/XML_daily.asp?date_req=23/02/2017')
+        self.assertEqual(len(self.transport.timings), 0)
+
+        body.read()
+        body.close()
+
+        self.assertEqual(len(self.transport.timings), 1)
+        self.assertEqual(self.transport.timings[0].status, 200)
+
+    def test_session_transport_closes_failed_response(self):
+        transport = SessionTransport(retries=0)
+        response = mock.Mock(**{'raise_for_status.side_effect': requests.HTTPError('404')})
+
+        with mock.patch.object(transport.session, 'get', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                transport.get('https://www.cbr.ru/scripts/XML_daily.asp')
+
+        response.close.assert_called_once_with()
+        self.assertEqual(transport.timings[0].status, None)
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
+        logging.disable(logging.CRITICAL)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.addCleanup(set_transport, None)
+
+        self.network = MemoryTransport({
+            'XML_valFull.asp': CURRENCIES_XML,
+            'XML_daily.asp': DAILY_XML,
+            'XML_dynamic.asp': DYNAMIC_USD_XML,
+        })
+
+    def populate(self):
+        Currency.populate(bulk=True)
+        usd = Currency.get_by_iso_char_code('USD')
+        Record.populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), usd)
+        Record.populate_for_date(usd, datetime(2017, 2, 23))
+
+    def reset_db(self):
+        Record.objects.all().delete()
+        Currency.objects.all().delete()
+        RateCoverage.objects.all().delete()
+        get_currency_registry().invalidate()
+
+    def test_read_through_and_replay(self):
+        set_transport(ArchiveTransport(self.network, self.path, 'read-through'))
+        self.populate()
+        self.assertEqual(len(self.network.requests), 3)
+
+        self.reset_db()
+        self.populate()
+        self.assertEqual(len(self.network.requests), 3)
+
+        self.reset_db()
+        set_transport(ArchiveTransport(MemoryTransport({}), self.path, 'replay'))
+        self.populate()
+        self.assertEqual(Record.objects.count(), 5)
+
+        with self.assertRaises(LookupError):
+            Record.populate_for_date(Currency.get_by_iso_char_code('USD'), datetime(2017, 2, 24))
+
+    def test_archive_files(self):
+        archive = ArchiveTransport(self.network, self.path, 'record')
+        url = 'https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1=02/03/2001&date_req2=07/03/2001&VAL_NM_RQ=R01235'
+
+        archive.get(url)
+        archive.get(url)
+
+        self.assertEqual(len(self.network.requests), 2)
+        self.assertEqual(archive.get_path(url), archive.get_path(
+            'http://localhost:8000/scripts/XML_dynamic.asp?VAL_NM_RQ=R01235&date_req2=07/03/2001&date_req1=02/03/2001'))
+        self.assertTrue(archive.get_path(url).endswith('.xml.gz'))
+        with gzip.open(archive.get_path(url)) as f:
+            self.assertEqual(len(XML(f.read())), 4)
+
+    def test_volatile(self):
+        archive = ArchiveTransport(self.network, self.path, 'read-through')
+        url = 'https://www.cbr.ru/scripts/XML_daily.asp?'
+        self.assertTrue(archive.is_volatile(url))
+        self.assertFalse(archive.is_volatile(url + 'date_req=23/02/2017'))
+
+        archive.get(url)
+        archive.get(url)
+        self.assertEqual(len(self.network.requests), 2)
+
+        self.network.responses.clear()
+        self.assertEqual(XML(archive.get(url)).attrib['Date'], '23.02.2017')
+
+    def test_interrupted_download_is_not_archived(self):
+        archive = ArchiveTransport(self.network, self.path, 'read-through')
+        url = 'https://www.cbr.ru/scripts/XML_daily.asp?date_req=23/02/2017'
+
+        body = archive.open(url)
+        body.read(10)
+        body.close()
+
+        self.assertFalse(os.path.exists(archive.get_path(url)))
+
+
+class RateRowsTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(RateRowsTestCase, self).setUp()
+        for day in (21, 22, 23):
+            Record.objects.create(currency=self.usd, date=datetime(2017, 2, day), value=Decimal('57.{}'.format(day)))
+            Record.objects.create(currency=self.eur, date=datetime(2017, 2, day), value=Decimal('60.{}'.format(day)))
+
+    def test_iter_rows(self):
+        with self.assertNumQueries(1):
+            rows = list(Record.iter_rows(datetime(2017, 2, 22), datetime(2017, 2, 23), chunk_size=1))
+
+        self.assertEqual(rows, [
+            RateRow(datetime(2017, 2, 22).date(), 'USD', Decimal('57.22'), 1),
+            RateRow(datetime(2017, 2, 23).date(), 'USD', Decimal('57.23'), 1),
+            RateRow(datetime(2017, 2, 22).date(), 'EUR', Decimal('60.22'), 1),
+            RateRow(datetime(2017, 2, 23).date(), 'EUR', Decimal('60.23'), 1),
+        ])
+
+        rows = Record.iter_rows(datetime(2017, 2, 1), datetime(2017, 2, 28), [self.eur])
+        self.assertEqual([row.value for row in rows], [Decimal('60.21'), Decimal('60.22'), Decimal('60.23')])
+
+    def test_str_without_extra_queries(self):
+        records = [Record.get_for_date(self.usd, datetime(2017, 2, 21)),
+                   Record.get_latest_for_date(self.eur, date=datetime(2017, 2, 21))]
+        records.extend(Record.get_many([self.usd], [datetime(2017, 2, 22)]).values())
+
+        with self.assertNumQueries(0):
+            rendered = [str(record) for record in records]
+
+        self.assertEqual(rendered, ['[USD] 2017-02-21: 57.2100', '[EUR] 2017-02-21: 60.2100',
+                                    '[USD] 2017-02-22: 57.2200'])
+
+    def test_manager_does_not_join_currency(self):
+        query = str(Record.objects.filter(date=datetime(2017, 2, 21)).values_list('value').query)
+
+        self.assertNotIn('JOIN', query)
+
+
+class NegativeCacheTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(NegativeCacheTestCase, self).setUp()
+        self.transport = self.use_transport({'XML_daily.asp': DAILY_XML})
+        self.delisted = Currency.objects.create(cbrf_id='R01010', parent_code='R01010', name='Австралийский доллар',
+                                                eng_name='Australian Dollar', iso_num_code=36, iso_char_code='AUD')
+
+    def test_missing_currency(self):
+        Record.objects.create(currency=self.delisted, date=datetime(2017, 2, 1), value=Decimal('44.1'))
+
+        for _attempt in range(2):
+            with self.assertRaisesMessage(ValueError, "Error in parameters"):
+                Record.get_for_date(self.delisted, datetime(2017, 2, 23))
+        self.assertEqual(len(self.transport.requests), 1)
+
+        record = Record.get_latest_for_date(self.delisted, date=datetime(2017, 2, 23))
+        self.assertEqual(record.value, Decimal('44.1'))
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_expiry(self):
+        today = datetime.today().date()
+        old = today - timedelta(days=30)
+        for date in (today, today - timedelta(days=3), old):
+            MissingRate.add(Record._meta.label_lower, ['R01010', 'R01235'], date)
+        MissingRate.objects.update(checked=timezone.now() - timedelta(hours=2))
+
+        self.assertFalse(MissingRate.is_missing(Record._meta.label_lower, 'R01235', today))
+        self.assertFalse(MissingRate.is_missing(Record._meta.label_lower, 'R01235', today - timedelta(days=3)))
+        self.assertTrue(MissingRate.is_missing(Record._meta.label_lower, 'R01235', old))
+        self.assertFalse(MissingRate.is_missing(Record._meta.label_lower, 'R01239', old))
+
+        MissingRate.add(Record._meta.label_lower, ['R01235'], today)
+        self.assertTrue(MissingRate.is_missing(Record._meta.label_lower, 'R01235', today))
+
+    @mock.patch('django_cbrf.abstract_models.NEGATIVE_CACHE', False)
+    def test_disabled(self):
+        for _attempt in range(2):
+            with self.assertRaises(ValueError):
+                Record.get_for_date(self.delisted, datetime(2017, 2, 23))
+
+        self.assertEqual(len(self.transport.requests), 2)
+        self.assertFalse(MissingRate.objects.exists())
+
+
+class PublicationCalendarTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(PublicationCalendarTestCase, self).setUp()
+        self.transport = self.use_transport({'XML_daily.asp': DAILY_XML})
+
+    def test_get_for_date(self):
+        record = Record.get_for_date(self.usd, datetime(2017, 2, 25))
+        self.assertEqual(len(self.transport.requests), 1)
+        self.assertEqual(str(PublicationDate.objects.get()), '2017-02-23 - 2017-02-25')
+
+        # currency, record, missing rate, calendar, missing rate and record of the effective date
+        with self.assertNumQueries(6):
+            self.assertEqual(Record.get_for_date(self.usd, datetime(2017, 2, 24)), record)
+        self.assertEqual(Record.get_for_date(self.usd, datetime(2017, 2, 23)), record)
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_get_for_date_requests_effective_date(self):
+        PublicationDate.add(datetime(2017, 2, 23).date(), datetime(2017, 2, 26).date())
+
+        record = Record.get_for_date(self.usd, datetime(2017, 2, 25))
+
+        self.assertEqual(record.date, datetime(2017, 2, 23).date())
+        self.assertEqual(self.transport.requests, ['https://www.cbr.ru/scripts/XML_daily.asp?date_req=23/02/2017'])
+
+    def test_get_latest_for_date(self):
+        record = Record.get_latest_for_date(self.usd, date=datetime(2017, 2, 25))
+        self.assertEqual(record.date, datetime(2017, 2, 23).date())
+
+        self.assertEqual(Record.get_latest_for_date(self.usd, date=datetime(2017, 2, 24)), record)
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_get_many(self):
+        PublicationDate.add(datetime(2017, 2, 23).date(), datetime(2017, 2, 26).date())
+
+        rates = Record.get_many([self.usd, self.eur], [datetime(2017, 2, 23), datetime(2017, 2, 25)])
+
+        self.assertEqual(len(self.transport.requests), 1)
+        self.assertIn('date_req=23/02/2017', self.transport.requests[0])
+        self.assertEqual(rates[(self.usd, datetime(2017, 2, 23).date())].value, Decimal('57.4762'))
+        self.assertEqual(rates[(self.eur, datetime(2017, 2, 23).date())].value, Decimal('60.6569'))
+        self.assertEqual(rates[(self.usd, datetime(2017, 2, 25).date())],
+                         rates[(self.usd, datetime(2017, 2, 23).date())])
+        self.assertEqual(rates[(self.eur, datetime(2017, 2, 25).date())].date, datetime(2017, 2, 23).date())
+
+    def test_get_many_agrees_with_get_for_date(self):
+        PublicationDate.add(datetime(2017, 2, 23).date(), datetime(2017, 2, 26).date())
+        record = Record.get_for_date(self.usd, datetime(2017, 2, 25))
+
+        with self.assertNumQueries(3):  # records, calendar, the effective records
+            rates = Record.get_many([self.usd], [datetime(2017, 2, 25)])
+        self.assertEqual(rates, {(self.usd, datetime(2017, 2, 25).date()): record})
+
+    def test_recent_dates(self):
+        today = datetime.today().date()
+        PublicationDate.add(today - timedelta(days=10), today + timedelta(days=5))
+        PublicationDate.add(today + timedelta(days=1), today + timedelta(days=1))
+        PublicationDate.add(today - timedelta(days=10), today - timedelta(days=20))
+
+        yesterday, tomorrow = today - timedelta(days=1), today + timedelta(days=1)
+        self.assertEqual(PublicationDate.get_effective_dates([yesterday, today, tomorrow]),
+                         {yesterday: today - timedelta(days=10), tomorrow: tomorrow})
+
+
+class RecordingRefresher(BaseRefresher):
+    def __init__(self):
+        super(RecordingRefresher, self).__init__()
+        self.submitted = []
+
+    def _submit(self, model, cbrf_id, date):
+        self.submitted.append((model, cbrf_id, date))
+
+
+class StaleWhileRevalidateTestCase(CurrenciesTestCase):
+    def setUp(self):
+        super(StaleWhileRevalidateTestCase, self).setUp()
+        self.today = datetime.today().date()
+        daily_xml = DAILY_XML.replace('23.02.2017', self.today.strftime('%d.%m.%Y'))
+        self.transport = self.use_transport({'XML_daily.asp': daily_xml})
+        self.stored = Record.objects.create(currency=self.usd, date=self.today - timedelta(days=2), value=Decimal('1'))
+
+    def test_refresh(self):
+        set_refresher(BaseRefresher())
+        self.addCleanup(set_refresher, None)
+
+        record = Record.get_latest(self.usd, max_staleness=3)
+        self.assertEqual(record, self.stored)
+        self.assertTrue(record.stale)
+
+        self.assertEqual(len(self.transport.requests), 1)
+        record = Record.get_latest(self.usd, max_staleness=3)
+        self.assertEqual((record.date, record.value), (self.today, Decimal('57.4762')))
+        self.assertFalse(record.stale)
+
+    def test_no_new_publication(self):
+        yesterday = self.today - timedelta(days=1)
+        self.transport.responses['XML_daily.asp'] = DAILY_XML.replace('23.02.2017', yesterday.strftime('%d.%m.%Y'))
+        set_refresher(BaseRefresher())
+        self.addCleanup(set_refresher, None)
+
+        self.assertTrue(Record.get_latest(self.usd, max_staleness=3).stale)
+        for _attempt in range(4):
+            record = Record.get_latest(self.usd, max_staleness=3)
+            self.assertEqual(record.date, yesterday)
+            self.assertFalse(record.stale)
+        self.assertEqual(len(self.transport.requests), 1)
+
+        PublicationDate.objects.update(checked=timezone.now() - timedelta(hours=1))
+        self.assertTrue(Record.get_latest(self.usd, max_staleness=3).stale)
+        self.assertEqual(len(self.transport.requests), 2)
+
+    def test_one_refresh_in_flight(self):
+        refresher = RecordingRefresher()
+        set_refresher(refresher)
+        self.addCleanup(set_refresher, None)
+
+        for _attempt in range(2):
+            self.assertTrue(Record.get_for_date(self.usd, self.today, max_staleness=3).stale)
+        self.assertEqual(refresher.submitted, [(Record._meta.label_lower, 'R01235', self.today)])
+
+        refresher.done(Record._meta.label_lower, 'R01235')
+        self.assertTrue(Record.get_latest(self.usd, max_staleness=3).stale)
+        self.assertEqual(len(refresher.submitted), 2)
+        self.assertEqual(self.transport.requests, [])
+
+    def test_too_stale_or_past(self):
+        set_refresher(RecordingRefresher())
+        self.addCleanup(set_refresher, None)
+
+        record = Record.get_latest(self.usd, max_staleness=1)
+        self.assertEqual(record.date, self.today)
+        self.assertFalse(record.stale)
+
+        self.assertFalse(Record.get_for_date(self.usd, self.today - timedelta(days=1), max_staleness=3).stale)
+        self.assertEqual(len(self.transport.requests), 2)
+
+    def test_thread_refresher(self):
+        refresher, finished = ThreadRefresher(workers=1), threading.Event()
+        self.addCleanup(refresher.executor.shutdown)
+
+        with mock.patch('django_cbrf.refresh.refresh_rate', side_effect=lambda *args: finished.wait(5)) as refresh:
+            self.assertTrue(refresher.schedule('django_cbrf.record', 'R01235', self.today))
+            self.assertFalse(refresher.schedule('django_cbrf.record', 'R01235', self.today))
+            finished.set()
+            refresher.executor.shutdown(wait=True)
+
+        refresh.assert_called_once_with('django_cbrf.record', 'R01235', self.today)
+        self.assertEqual(refresher._in_flight, set())
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(get_currency_registry().invalidate)
+        logging.disable(logging.CRITICAL)
+        self.metrics = PrometheusMetrics()
+        set_metrics(self.metrics)
+        self.addCleanup(set_metrics, None)
+        set_transport(MemoryTransport({'XML_valFull.asp': CURRENCIES_XML, 'XML_daily.asp': DAILY_XML}))
+        self.addCleanup(set_transport, None)
+
+        patcher = mock.patch.object(rate_cache, 'enabled', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rate_cache.clear)
+
+    def test_lookups_and_fetches(self):
+        Currency.populate(bulk=True)
+        usd = Currency.get_by_iso_char_code('USD')
+        Record.get_for_date(usd, datetime(2017, 2, 23))
+        Record.get_for_date(usd, datetime(2017, 2, 23))
+        Record.populate_all_for_date(datetime(2017, 2, 23))
+
+        get = self.metrics.get
+        self.assertEqual(get('cbrf_lookups_total', method='get_for_date', source='api'), 1)
+        self.assertEqual(get('cbrf_lookups_total', method='get_for_date', source='cache'), 1)
+        self.assertEqual(get('cbrf_api_requests_total', endpoint='XML_daily.asp', status=200), 2)
+        self.assertEqual(get('cbrf_api_requests_total', endpoint='XML_valFull.asp', status=200), 1)
+        self.assertEqual(get('cbrf_api_request_seconds', endpoint='XML_daily.asp'), 2)
+        self.assertEqual(get('cbrf_rows_total', result='inserted'), 3)
+        self.assertEqual(get('cbrf_rows_total', result='skipped'), 1)
+
+    def test_api_errors(self):
+        with self.assertRaises(Exception):
+            Record.populate_for_dates(datetime(2001, 3, 2), datetime(2001, 3, 7), CurrencyInfo(
+                1, 'R01235', 'R01235', 'Доллар США', 'US Dollar', 1, 840, 'USD'))
+
+        self.assertEqual(self.metrics.get('cbrf_api_requests_total', endpoint='XML_dynamic.asp', status='error'), 1)
+
+    def test_view(self):
+        self.metrics.increment('cbrf_rows_total', 3, result='inserted')
+        self.metrics.observe('cbrf_write_seconds', 0.02)
+
+        response = views.metrics(RequestFactory().get('/metrics'))
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE cbrf_rows_total counter', lines)
+        self.assertIn('cbrf_rows_total{result="inserted"} 3', lines)
+        self.assertIn('# TYPE cbrf_write_seconds histogram', lines)
+        self.assertIn('cbrf_write_seconds_bucket{le="0.01"} 0', lines)
+        self.assertIn('cbrf_write_seconds_bucket{le="0.05"} 1', lines)
+        self.assertIn('cbrf_write_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('cbrf_write_seconds_count 1', lines)
+
+    def test_null_metrics(self):
+        set_metrics(BaseMetrics())
+        with BaseMetrics().timer('cbrf_write_seconds'):
+            pass
+
+        with self.assertRaises(Http404):
+            views.metrics(RequestFactory().get('/metrics'))
+
+
 class CustomSettingsTestCase(TestCase):
     def setUp(self):
         logging.disable(logging.CRITICAL)